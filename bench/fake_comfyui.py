@@ -0,0 +1,423 @@
+# stand-in comfyui server for benchmarks
+
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import random
+import struct
+import base64
+import asyncio
+import argparse
+import collections
+
+from aiohttp import web
+from PIL import Image
+
+
+# Module constants
+DEFAULT_NODE_DELAY_SEC = 0.0
+DEFAULT_STEP_DELAY_SEC = 0.01  # Per sampler step
+BINARY_EVENT_PREVIEW_IMAGE = 1
+BINARY_FORMAT_JPEG = 1
+BINARY_FORMAT_PNG = 2
+SAMPLER_TYPES = ["KSampler", "KSamplerAdvanced", "SamplerCustom", "SamplerCustomAdvanced"]
+SAVE_TYPES = ["SaveImage", "SaveImageWebsocket", "PreviewImage"]
+LOAD_IMAGE_TYPES = ["LoadImage", "LoadImageMask"]
+
+
+# Config of the simulated instance
+class FakeConfig:
+    def __init__(self, node_delays=None, step_delay_sec=DEFAULT_STEP_DELAY_SEC, previews=True, error_rate=0.0,
+                 crash_after=0, replay=None, output_path=None, vram_total_mb=24576, vram_free_mb=20480, seed=0,
+                 drop_prompt_responses=0):
+        self.node_delays = node_delays or {}  # node class -> seconds, "*" for other classes
+        self.step_delay_sec = step_delay_sec
+        self.previews = previews  # Send a binary preview frame per sampler step
+        self.error_rate = error_rate  # Fraction of prompts failing with an execution error
+        self.crash_after = crash_after  # Exit the process while executing this many-th prompt, 0 to never crash
+        self.replay = replay  # Recorded frames replayed instead of simulating execution
+        self.drop_prompt_responses = drop_prompt_responses  # Close the connection of this many queued prompts without a response
+        self.output_path = output_path
+        self.vram_total_mb = vram_total_mb
+        self.vram_free_mb = vram_free_mb
+        self.random = random.Random(seed)
+
+    def node_delay(self, class_type):
+        return self.node_delays.get(class_type, self.node_delays.get("*", DEFAULT_NODE_DELAY_SEC))
+
+
+# Load frames recorded by record_comfyui.py
+def load_replay(path):
+    """
+    Reads recorded WebSocket frames, one JSON object per line: {"t": seconds since the prompt was queued,
+    "type": ..., "data": ...} for text frames or {"t": ..., "binary": base64} for binary frames.
+    """
+    frames = []
+    with open(path) as replay_file:
+        for line in replay_file:
+            if line.strip():
+                frames.append(json.loads(line))
+    return frames
+
+
+# Simulated ComfyUI instance
+class FakeComfyUI:
+    """
+    Executes queued prompts one at a time like ComfyUI, sending the execution events over /ws to the
+    client that queued them and saving outputs to disk, /history & /view. Execution is simulated from
+    per-node delays, or replayed from recorded frames.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.clients = {}  # client ID -> websocket
+        self.pending = collections.OrderedDict()  # prompt ID -> (number, prompt, client ID)
+        self.running = None  # (prompt ID, number, prompt, client ID)
+        self.history = {}
+        self.executed = 0
+        self.number = 0
+        self.dropped = 0
+        self.deleted = []  # IDs of prompts deleted from the queue
+        self.interrupted = []  # IDs of prompts interrupted while running
+        self.uploads = []  # Names of uploaded input images
+        self._interrupted = False
+        self._wakeup = asyncio.Event()
+        self._images = {}  # (width, height) -> PNG bytes
+        self._counters = {}  # filename prefix -> last image number
+        self.input_path = os.path.join(config.output_path or ".", "..", "input")
+
+    # http & websocket routes
+    def routes(self):
+        return [
+            web.get("/ws", self.handle_ws),
+            web.get("/system_stats", self.handle_system_stats),
+            web.post("/prompt", self.handle_prompt),
+            web.get("/queue", self.handle_get_queue),
+            web.post("/queue", self.handle_post_queue),
+            web.get("/history/{prompt_id}", self.handle_history),
+            web.get("/view", self.handle_view),
+            web.post("/interrupt", self.handle_interrupt),
+            web.post("/upload/image", self.handle_upload_image),
+            web.get("/fake/stats", self.handle_fake_stats),
+        ]
+
+    async def handle_ws(self, request):
+        websocket = web.WebSocketResponse(max_msg_size=0)
+        await websocket.prepare(request)
+        client_id = request.query.get("clientId") or str(uuid.uuid4())
+        self.clients[client_id] = websocket
+        await websocket.send_str(json.dumps({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": len(self.pending)}}, "sid": client_id}}))
+        try:
+            async for _ in websocket:
+                pass
+        finally:
+            if self.clients.get(client_id) is websocket:
+                del self.clients[client_id]
+        return websocket
+
+    async def handle_system_stats(self, request):
+        return web.json_response({
+            "system": {"comfyui_version": "fake"},
+            "devices": [{
+                "name": "fake", "type": "cuda", "index": 0,
+                "vram_total": self.config.vram_total_mb * 1024 * 1024,
+                "vram_free": self.config.vram_free_mb * 1024 * 1024,
+            }],
+        })
+
+    async def handle_prompt(self, request):
+        body = await request.json()
+        prompt = body.get("prompt")
+        if not isinstance(prompt, dict) or not prompt:
+            return web.json_response({"error": {"type": "invalid_prompt", "message": "Invalid prompt"}, "node_errors": {}}, status=400)
+        for node_id, node in prompt.items():
+            # Like ComfyUI, reject prompts loading images missing from the input folder
+            if node.get("class_type") in LOAD_IMAGE_TYPES and not os.path.isfile(os.path.join(self.input_path, str(node["inputs"].get("image")))):
+                return web.json_response({
+                    "error": {"type": "prompt_outputs_failed_validation", "message": "Prompt outputs failed validation"},
+                    "node_errors": {node_id: {"errors": [{"type": "value_not_in_list", "message": f"Invalid image file: {node['inputs'].get('image')}"}]}},
+                }, status=400)
+        prompt_id = body.get("prompt_id") or str(uuid.uuid4())
+        self.number += 1
+        self.pending[prompt_id] = (self.number, prompt, body.get("client_id"))
+        self._wakeup.set()
+        if self.dropped < self.config.drop_prompt_responses:
+            # The prompt is queued, but the client never learns about it
+            self.dropped += 1
+            request.transport.close()
+            return web.Response(status=200)
+        return web.json_response({"prompt_id": prompt_id, "number": self.number, "node_errors": {}})
+
+    async def handle_get_queue(self, request):
+        running = []
+        if self.running:
+            prompt_id, number, prompt, client_id = self.running
+            running.append([number, prompt_id, prompt, {"client_id": client_id}, []])
+        pending = [[number, prompt_id, prompt, {"client_id": client_id}, []] for prompt_id, (number, prompt, client_id) in self.pending.items()]
+        return web.json_response({"queue_running": running, "queue_pending": pending})
+
+    async def handle_post_queue(self, request):
+        body = await request.json()
+        if body.get("clear"):
+            self.pending.clear()
+        for prompt_id in body.get("delete", []):
+            if self.pending.pop(prompt_id, None):
+                self.deleted.append(prompt_id)
+        return web.Response(status=200)
+
+    async def handle_history(self, request):
+        prompt_id = request.match_info["prompt_id"]
+        return web.json_response({prompt_id: self.history[prompt_id]} if prompt_id in self.history else {})
+
+    async def handle_view(self, request):
+        filename = os.path.basename(request.query.get("filename", ""))
+        path = os.path.join(self.config.output_path, request.query.get("subfolder", ""), filename)
+        if not filename or not os.path.isfile(path):
+            return web.Response(status=404)
+        return web.FileResponse(path, headers={"Content-Type": "image/png"})
+
+    async def handle_upload_image(self, request):
+        form = await request.post()
+        image = form.get("image")
+        if image is None or not hasattr(image, "file"):
+            return web.Response(status=400)
+        filename = os.path.basename(image.filename)
+        os.makedirs(self.input_path, exist_ok=True)
+        with open(os.path.join(self.input_path, filename), "wb") as image_file:
+            image_file.write(image.file.read())
+        self.uploads.append(filename)
+        return web.json_response({"name": filename, "subfolder": "", "type": "input"})
+
+    async def handle_interrupt(self, request):
+        if self.running:
+            self._interrupted = True
+            self.interrupted.append(self.running[0])
+        return web.Response(status=200)
+
+    # requests the stand-in received, for tests
+    async def handle_fake_stats(self, request):
+        return web.json_response({"executed": self.executed, "deleted": self.deleted, "interrupted": self.interrupted, "uploads": self.uploads})
+
+    # execute queued prompts one at a time
+    async def run(self):
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            prompt_id, (number, prompt, client_id) = self.pending.popitem(last=False)
+            self.running = (prompt_id, number, prompt, client_id)
+            self._interrupted = False
+            try:
+                await self.execute(prompt_id, prompt, client_id)
+            except Exception as e:
+                print(f"ERROR: Fake execution of prompt {prompt_id} failed: {str(e)}", file=sys.stderr)
+            finally:
+                self.running = None
+
+    async def send(self, client_id, type, data):
+        websocket = self.clients.get(client_id)
+        if websocket is not None and not websocket.closed:
+            await websocket.send_str(json.dumps({"type": type, "data": data}))
+
+    async def send_bytes(self, client_id, event_type, image_format, data):
+        websocket = self.clients.get(client_id)
+        if websocket is not None and not websocket.closed:
+            await websocket.send_bytes(struct.pack(">II", event_type, image_format) + data)
+
+    async def execute(self, prompt_id, prompt, client_id):
+        self.executed += 1
+        if self.config.crash_after and self.executed >= self.config.crash_after:
+            print(f"Crashing while executing prompt {prompt_id}", file=sys.stderr, flush=True)
+            os._exit(1)
+        if self.config.replay:
+            await self.replay(prompt_id, client_id)
+            self.finish(prompt_id, prompt, client_id, outputs=await self.save_outputs(prompt_id, prompt, client_id, send_images=False))
+            return
+        await self.send(client_id, "execution_start", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)})
+        await self.send(client_id, "execution_cached", {"nodes": [], "prompt_id": prompt_id, "timestamp": int(time.time() * 1000)})
+        failing_node = None
+        if self.config.error_rate and self.config.random.random() < self.config.error_rate:
+            failing_node = self.config.random.choice([node_id for node_id, node in prompt.items() if node["class_type"] in SAMPLER_TYPES] or list(prompt))
+        outputs = {}
+        for node_id, node in prompt.items():
+            if self._interrupted:
+                await self.send(client_id, "execution_interrupted", {"prompt_id": prompt_id, "node_id": node_id, "node_type": node["class_type"], "executed": []})
+                self.history[prompt_id] = {"prompt": [0, prompt_id, prompt, {}, []], "outputs": {}, "status": {"status_str": "error", "completed": False, "messages": []}}
+                return
+            class_type = node["class_type"]
+            await self.send(client_id, "executing", {"node": node_id, "display_node": node_id, "prompt_id": prompt_id})
+            if node_id == failing_node:
+                await self.send(client_id, "execution_error", {
+                    "prompt_id": prompt_id, "node_id": node_id, "node_type": class_type, "executed": [],
+                    "exception_message": "Simulated failure", "exception_type": "RuntimeError", "traceback": [],
+                })
+                self.history[prompt_id] = {"prompt": [0, prompt_id, prompt, {}, []], "outputs": {}, "status": {"status_str": "error", "completed": False, "messages": []}}
+                return
+            await asyncio.sleep(self.config.node_delay(class_type))
+            if class_type in SAMPLER_TYPES:
+                await self.sample(prompt_id, node_id, node, client_id)
+            elif class_type in SAVE_TYPES:
+                outputs[node_id] = await self.save_node(prompt_id, prompt, node_id, client_id, send_images=True)
+        self.finish(prompt_id, prompt, client_id, outputs)
+        await self.send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+        await self.send(client_id, "execution_success", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)})
+
+    # simulate sampler steps with progress events & previews
+    async def sample(self, prompt_id, node_id, node, client_id):
+        steps = int(node["inputs"].get("steps", 20)) if isinstance(node["inputs"].get("steps", 20), (int, float)) else 20
+        preview = self.image(64, 64, "JPEG") if self.config.previews else None
+        for step in range(1, steps + 1):
+            if self._interrupted:
+                return
+            await asyncio.sleep(self.config.step_delay_sec)
+            if preview is not None:
+                await self.send_bytes(client_id, BINARY_EVENT_PREVIEW_IMAGE, BINARY_FORMAT_JPEG, preview)
+            await self.send(client_id, "progress", {"value": step, "max": steps, "prompt_id": prompt_id, "node": node_id})
+
+    # write a save node's images to disk or send them over the websocket
+    async def save_node(self, prompt_id, prompt, node_id, client_id, send_images):
+        node = prompt[node_id]
+        width, height, batch_size = self.latent_size(prompt, node_id)
+        image = self.image(width, height, "PNG")
+        if node["class_type"] == "SaveImageWebsocket":
+            if send_images:
+                for _ in range(batch_size):
+                    # SaveImageWebsocket images arrive as PNG preview frames
+                    await self.send_bytes(client_id, BINARY_EVENT_PREVIEW_IMAGE, BINARY_FORMAT_PNG, image)
+            return {}
+        prefix = node["inputs"].get("filename_prefix", "ComfyUI") if node["class_type"] == "SaveImage" else "ComfyUI_temp"
+        folder = "output" if node["class_type"] == "SaveImage" else "temp"
+        images = []
+        for _ in range(batch_size):
+            counter = self._counters.get(prefix, 0) + 1
+            self._counters[prefix] = counter
+            filename = f"{prefix}_{counter:05}_.png"
+            directory = self.config.output_path if folder == "output" else os.path.join(self.config.output_path, "..", "temp")
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, filename), "wb") as image_file:
+                image_file.write(image)
+            images.append({"filename": filename, "subfolder": "", "type": folder})
+        return {"images": images}
+
+    async def save_outputs(self, prompt_id, prompt, client_id, send_images):
+        outputs = {}
+        for node_id, node in prompt.items():
+            if node["class_type"] in SAVE_TYPES:
+                outputs[node_id] = await self.save_node(prompt_id, prompt, node_id, client_id, send_images)
+        return outputs
+
+    def finish(self, prompt_id, prompt, client_id, outputs):
+        self.history[prompt_id] = {
+            "prompt": [0, prompt_id, prompt, {"client_id": client_id}, list(outputs)],
+            "outputs": {node_id: output for node_id, output in outputs.items() if output},
+            "status": {"status_str": "success", "completed": True, "messages": []},
+        }
+
+    # replay recorded frames with the recorded timing
+    async def replay(self, prompt_id, client_id):
+        started_at = time.monotonic()
+        for frame in self.config.replay:
+            delay = frame.get("t", 0) - (time.monotonic() - started_at)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if "binary" in frame:
+                websocket = self.clients.get(client_id)
+                if websocket is not None and not websocket.closed:
+                    await websocket.send_bytes(base64.b64decode(frame["binary"]))
+                continue
+            data = dict(frame.get("data", {}))
+            if "prompt_id" in data:
+                data["prompt_id"] = prompt_id
+            await self.send(client_id, frame["type"], data)
+
+    # find the size of the latent an output node's images were decoded from
+    def latent_size(self, prompt, node_id, seen=None):
+        seen = seen or set()
+        if node_id in seen or node_id not in prompt:
+            return 512, 512, 1
+        seen.add(node_id)
+        inputs = prompt[node_id]["inputs"]
+        if "width" in inputs and "height" in inputs:
+            if "batch_size" in inputs:
+                return int(inputs["width"]), int(inputs["height"]), int(inputs["batch_size"])
+            # ImageScale keeps the batch of its input images
+            link = inputs.get("image")
+            batch_size = self.latent_size(prompt, str(link[0]), seen)[2] if isinstance(link, list) and len(link) == 2 else 1
+            return int(inputs["width"]), int(inputs["height"]), batch_size
+        if "amount" in inputs:
+            # RepeatLatentBatch
+            width, height, batch_size = self.latent_size(prompt, str(inputs["samples"][0]), seen)
+            return width, height, batch_size * int(inputs["amount"])
+        for name in ["images", "samples", "latent_image", "latent", "pixels"]:
+            link = inputs.get(name)
+            if isinstance(link, list) and len(link) == 2:
+                return self.latent_size(prompt, str(link[0]), seen)
+        return 512, 512, 1
+
+    # noise image, roughly as hard to compress & encode as a generated one
+    def image(self, width, height, image_format):
+        key = (width, height, image_format)
+        if key not in self._images:
+            buffer = io.BytesIO()
+            Image.frombytes("RGB", (width, height), self.config.random.randbytes(width * height * 3)).save(buffer, image_format)
+            self._images[key] = buffer.getvalue()
+        return self._images[key]
+
+
+# parse "KSampler=0.5,*=0.01" into per-class delays
+def parse_node_delays(value):
+    delays = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            class_type, seconds = item.split("=", 1)
+            delays[class_type.strip()] = float(seconds)
+    return delays
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stand-in ComfyUI server for benchmarks")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--listen", default="127.0.0.1")
+    parser.add_argument("--output-path", default=os.path.join(os.getcwd(), "output"))
+    parser.add_argument("--node-delays", default=os.getenv("FAKE_COMFYUI_NODE_DELAYS", ""), help='Seconds per node class, e.g. "CheckpointLoaderSimple=0.5,*=0.01"')
+    parser.add_argument("--step-delay", type=float, default=float(os.getenv("FAKE_COMFYUI_STEP_DELAY_SEC", str(DEFAULT_STEP_DELAY_SEC))))
+    parser.add_argument("--no-previews", action="store_true", default=os.getenv("FAKE_COMFYUI_PREVIEWS", "TRUE") != "TRUE")
+    parser.add_argument("--error-rate", type=float, default=float(os.getenv("FAKE_COMFYUI_ERROR_RATE", "0")))
+    parser.add_argument("--crash-after", type=int, default=int(os.getenv("FAKE_COMFYUI_CRASH_AFTER", "0")))
+    parser.add_argument("--replay", default=os.getenv("FAKE_COMFYUI_REPLAY", ""), help="Frames recorded by record_comfyui.py")
+    parser.add_argument("--drop-prompt-responses", type=int, default=0, help="Drop the connection of this many queued prompts")
+    # Accepted for compatibility with the ComfyUI command line used by the handler
+    parser.add_argument("--extra-model-paths-config", default=None)
+    parser.add_argument("--preview-method", default=None)
+    parser.add_argument("--preview-size", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    config = FakeConfig(
+        node_delays=parse_node_delays(args.node_delays),
+        step_delay_sec=args.step_delay,
+        previews=not args.no_previews and args.preview_method != "none",
+        error_rate=args.error_rate,
+        crash_after=args.crash_after,
+        replay=load_replay(args.replay) if args.replay else None,
+        output_path=args.output_path,
+        drop_prompt_responses=args.drop_prompt_responses,
+    )
+    os.makedirs(config.output_path, exist_ok=True)
+    comfyui = FakeComfyUI(config)
+
+    async def start_executor(app):
+        app["executor"] = asyncio.get_running_loop().create_task(comfyui.run())
+
+    app = web.Application(client_max_size=256 * 1024 * 1024)
+    app.add_routes(comfyui.routes())
+    app.on_startup.append(start_executor)
+    print(f"Fake ComfyUI listening on {args.listen}:{args.port}", flush=True)
+    web.run_app(app, host=args.listen, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
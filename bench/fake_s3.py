@@ -0,0 +1,152 @@
+# stand-in s3 server for benchmarks
+
+import sys
+import uuid
+import hashlib
+import argparse
+import urllib.parse
+
+from aiohttp import web
+
+
+# Module constants
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>'
+
+
+# Decode an aws-chunked request body
+def decode_aws_chunked(body):
+    data = bytearray()
+    position = 0
+    while position < len(body):
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";")[0], 16)
+        if size == 0:
+            break
+        start = line_end + 2
+        data += body[start:start + size]
+        position = start + size + 2
+    return bytes(data)
+
+
+def xml_response(body, status=200):
+    return web.Response(text=XML_HEADER + body, status=status, content_type="application/xml")
+
+
+def error_response(code, message, status):
+    return xml_response(f"<Error><Code>{code}</Code><Message>{message}</Message></Error>", status)
+
+
+# In-memory S3 subset used by the worker
+class FakeS3:
+    """
+    Path-style S3 API subset: head bucket, put/get/head/delete object, server-side copy and multipart uploads.
+    Objects are kept in memory.
+    """
+
+    def __init__(self):
+        self.objects = {}  # (bucket, key) -> (data, headers)
+        self.uploads = {}  # upload ID -> (bucket, key, headers, {part number: data})
+        self.requests = 0
+
+    def routes(self):
+        return [
+            web.head("/{bucket}", self.handle_head_bucket),
+            web.head("/{bucket}/", self.handle_head_bucket),
+            web.route("*", "/{bucket}/{key:.+}", self.handle_object),
+        ]
+
+    async def handle_head_bucket(self, request):
+        self.requests += 1
+        return web.Response(status=200)
+
+    async def handle_object(self, request):
+        self.requests += 1
+        bucket = request.match_info["bucket"]
+        key = urllib.parse.unquote(request.match_info["key"])
+        query = request.query
+        if request.method == "PUT":
+            if "uploadId" in query:
+                return await self.upload_part(request, query["uploadId"], int(query["partNumber"]))
+            if "x-amz-copy-source" in request.headers:
+                return self.copy_object(request, bucket, key)
+            return await self.put_object(request, bucket, key)
+        if request.method == "POST":
+            if "uploads" in query:
+                upload_id = uuid.uuid4().hex
+                self.uploads[upload_id] = (bucket, key, self.object_headers(request), {})
+                return xml_response(f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+            if "uploadId" in query:
+                return self.complete_upload(query["uploadId"])
+        if request.method in ["GET", "HEAD"]:
+            stored = self.objects.get((bucket, key))
+            if stored is None:
+                if request.method == "HEAD":
+                    return web.Response(status=404)
+                return error_response("NoSuchKey", "The specified key does not exist.", 404)
+            data, headers = stored
+            headers = dict(headers, **{"ETag": f'"{hashlib.md5(data).hexdigest()}"', "Content-Length": str(len(data))})
+            if request.method == "HEAD":
+                return web.Response(status=200, headers=headers)
+            return web.Response(body=data, headers=headers)
+        if request.method == "DELETE":
+            if "uploadId" in query:
+                self.uploads.pop(query["uploadId"], None)
+            else:
+                self.objects.pop((bucket, key), None)
+            return web.Response(status=204)
+        return error_response("NotImplemented", f"{request.method} is not implemented", 501)
+
+    def object_headers(self, request):
+        return {name: request.headers[name] for name in ["Content-Type", "Cache-Control"] if name in request.headers}
+
+    async def read_body(self, request):
+        body = await request.read()
+        if "aws-chunked" in request.headers.get("Content-Encoding", "") or "x-amz-decoded-content-length" in request.headers:
+            body = decode_aws_chunked(body)
+        return body
+
+    async def put_object(self, request, bucket, key):
+        data = await self.read_body(request)
+        self.objects[(bucket, key)] = (data, self.object_headers(request))
+        return web.Response(status=200, headers={"ETag": f'"{hashlib.md5(data).hexdigest()}"'})
+
+    def copy_object(self, request, bucket, key):
+        source_bucket, _, source_key = urllib.parse.unquote(request.headers["x-amz-copy-source"]).lstrip("/").partition("/")
+        stored = self.objects.get((source_bucket, source_key))
+        if stored is None:
+            return error_response("NoSuchKey", "The specified key does not exist.", 404)
+        data, headers = stored
+        if request.headers.get("x-amz-metadata-directive") == "REPLACE":
+            headers = self.object_headers(request)
+        self.objects[(bucket, key)] = (data, headers)
+        return xml_response(f'<CopyObjectResult><ETag>"{hashlib.md5(data).hexdigest()}"</ETag></CopyObjectResult>')
+
+    async def upload_part(self, request, upload_id, part_number):
+        if upload_id not in self.uploads:
+            return error_response("NoSuchUpload", "The specified upload does not exist.", 404)
+        data = await self.read_body(request)
+        self.uploads[upload_id][3][part_number] = data
+        return web.Response(status=200, headers={"ETag": f'"{hashlib.md5(data).hexdigest()}"'})
+
+    def complete_upload(self, upload_id):
+        if upload_id not in self.uploads:
+            return error_response("NoSuchUpload", "The specified upload does not exist.", 404)
+        bucket, key, headers, parts = self.uploads.pop(upload_id)
+        data = b"".join(parts[number] for number in sorted(parts))
+        self.objects[(bucket, key)] = (data, headers)
+        return xml_response(f'<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>"{hashlib.md5(data).hexdigest()}-{len(parts)}"</ETag></CompleteMultipartUploadResult>')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stand-in S3 server for benchmarks")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--listen", default="127.0.0.1")
+    args = parser.parse_args(argv)
+    app = web.Application(client_max_size=1024 * 1024 * 1024)
+    app.add_routes(FakeS3().routes())
+    print(f"Fake S3 listening on {args.listen}:{args.port}", flush=True)
+    web.run_app(app, host=args.listen, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
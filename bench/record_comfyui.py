@@ -0,0 +1,58 @@
+# record comfyui websocket traffic for replay by the fake server
+
+import sys
+import json
+import time
+import uuid
+import base64
+import argparse
+import requests
+
+from websockets.sync.client import connect
+
+
+# Record the frames of one prompt
+def record(url, workflow_data, output_path):
+    """
+    Queues an API-format workflow to a running ComfyUI and writes every WebSocket frame received until
+    it finishes, one JSON object per line with the seconds since the prompt was queued.
+    """
+    client_id = str(uuid.uuid4())
+    ws_url = url.replace("http://", "ws://").replace("https://", "wss://").rstrip("/") + f"/ws?clientId={client_id}"
+    frames = 0
+    with connect(ws_url, max_size=None) as websocket, open(output_path, "w") as output_file:
+        response = requests.post(f"{url.rstrip('/')}/prompt", json={"prompt": workflow_data, "client_id": client_id}, timeout=30)
+        response.raise_for_status()
+        prompt_id = response.json()["prompt_id"]
+        queued_at = time.monotonic()
+        for message in websocket:
+            offset = round(time.monotonic() - queued_at, 4)
+            if isinstance(message, bytes):
+                output_file.write(json.dumps({"t": offset, "binary": base64.b64encode(message).decode("ascii")}) + "\n")
+                frames += 1
+                continue
+            event = json.loads(message)
+            if event.get("data", {}).get("prompt_id") not in [None, prompt_id]:
+                continue
+            if event["type"] in ["status", "crystools.monitor"]:
+                continue
+            output_file.write(json.dumps({"t": offset, "type": event["type"], "data": event["data"]}) + "\n")
+            frames += 1
+            if event["type"] in ["execution_success", "execution_error", "execution_interrupted"]:
+                break
+    print(f"Recorded {frames} frames of prompt {prompt_id} to {output_path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record ComfyUI WebSocket traffic of one prompt")
+    parser.add_argument("workflow", help="ComfyUI API-format workflow JSON")
+    parser.add_argument("output", help="Recorded frames, one JSON object per line")
+    parser.add_argument("--url", default="http://127.0.0.1:8188")
+    args = parser.parse_args(argv)
+    with open(args.workflow) as workflow_file:
+        workflow_data = json.load(workflow_file)
+    record(args.url, workflow_data, args.output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
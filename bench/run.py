@@ -0,0 +1,299 @@
+# handler benchmarks against a stand-in comfyui
+
+import os
+import sys
+import json
+import time
+import socket
+import base64
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+SRC_PATH = os.path.join(os.path.dirname(BENCH_PATH), "src")
+
+# Module constants
+RESULT_PREFIX = "BENCH_RESULT "
+STARTUP_TIMEOUT_SEC = 30
+FAKE_COMFYUI_MAIN = """# generated by bench/run.py
+import sys
+sys.path.insert(0, {bench_path!r})
+import fake_comfyui
+fake_comfyui.main(sys.argv[1:] + ["--output-path", {output_path!r}])
+"""
+FAKE_S3_BUCKET = "bench-bucket"
+INPUT_IMAGE_SIZE = (768, 768)  # Synthetic input images of img2img & inpainting workflows
+
+
+# Pick an unused local port, followed by count - 1 more unused ports
+def get_free_port(count=1):
+    while True:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        try:
+            for next_port in range(port + 1, port + count):
+                with socket.socket() as sock:
+                    sock.bind(("127.0.0.1", next_port))
+            return port
+        except OSError:
+            continue
+
+
+# Wait until a local port accepts connections
+def wait_for_port(port, timeout=STARTUP_TIMEOUT_SEC):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"ERROR: Nothing listening on port {port} after {timeout} seconds")
+
+
+# Nearest-rank percentile
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+
+# Base64 noise PNG as an input image
+def make_input_image():
+    import io
+    import random
+    from PIL import Image
+    buffer = io.BytesIO()
+    width, height = INPUT_IMAGE_SIZE
+    Image.frombytes("RGB", INPUT_IMAGE_SIZE, random.Random(0).randbytes(width * height * 3)).save(buffer, "PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+# Run one scenario in this process, driving handler() directly
+def run_scenario(args):
+    """
+    Imports the handler configured by environment variables, starts the stand-in ComfyUI through it and
+    sends concurrent synthetic RunPod events. Progress updates are counted instead of sent to RunPod.
+    """
+    sys.path.insert(0, SRC_PATH)
+    import handler
+
+    handler.setup_logging(os.getenv("LOG_LEVEL", "WARNING"))
+    progress_updates = [0]
+
+    def update_job(event, progress_percentage, eta_sec=None):
+        progress_updates[0] += 1
+    handler.update_job = update_job
+
+    if handler.ENABLE_S3_UPLOAD:
+        handler.init_s3()
+    handler.init_comfyui()
+
+    # The same input images for every job, uploaded to ComfyUI once
+    input_images = {
+        name: make_input_image()
+        for name in getattr(handler.get_workflow(args.workflow).load, "input_images", [])
+    }
+
+    def make_event(index):
+        job_input = {
+            "prompt": f"benchmark prompt {index}",
+            "workflow": args.workflow,
+            "num_images": args.num_images,
+            "output_format": args.output_format,
+            **input_images,
+        }
+        return {"id": f"bench-{index}", "input": job_input}
+
+    async def run_job(semaphore, index, latencies, errors):
+        async with semaphore:
+            start_time = time.perf_counter()
+            result = await handler.handler(make_event(index))
+            elapsed = time.perf_counter() - start_time
+        if result == "ERROR" or (isinstance(result, dict) and "error" in result):
+            errors.append(index)
+        else:
+            latencies.append(elapsed)
+
+    async def run_jobs():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        await asyncio.gather(*[run_job(semaphore, -index - 1, [], []) for index in range(args.warmup_jobs)])
+        latencies, errors = [], []
+        start_time = time.perf_counter()
+        await asyncio.gather(*[run_job(semaphore, index, latencies, errors) for index in range(args.jobs)])
+        return time.perf_counter() - start_time, latencies, errors
+
+    try:
+        wall_time, latencies, errors = asyncio.run(run_jobs())
+    finally:
+        handler.cleanup()
+
+    result = {
+        "workflow": args.workflow,
+        "output_mode": handler.COMFYUI_OUTPUT_MODE,
+        "s3": handler.ENABLE_S3_UPLOAD,
+        "output_format": args.output_format,
+        "num_images": args.num_images,
+        "jobs": args.jobs,
+        "concurrency": args.concurrency,
+        "errors": len(errors),
+        "wall_sec": round(wall_time, 4),
+        "throughput_jobs_per_sec": round(len(latencies) / wall_time, 3) if wall_time else None,
+        "p50_sec": percentile(latencies, 0.50),
+        "p95_sec": percentile(latencies, 0.95),
+        "p99_sec": percentile(latencies, 0.99),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "progress_updates": progress_updates[0],
+    }
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+# Run one scenario in a fresh process with its own stand-ins
+def spawn_scenario(args, workflow, output_mode, s3_port):
+    """
+    Each scenario gets a fresh worker process, since the handler reads its configuration at import time,
+    and a fresh stand-in ComfyUI started by the handler itself from a generated main.py.
+    """
+    with tempfile.TemporaryDirectory(prefix="bench-comfyui-") as comfyui_path:
+        output_path = os.path.join(comfyui_path, "output")
+        os.makedirs(output_path)
+        with open(os.path.join(comfyui_path, "main.py"), "w") as main_file:
+            main_file.write(FAKE_COMFYUI_MAIN.format(bench_path=BENCH_PATH, output_path=output_path))
+
+        env = dict(os.environ)
+        env.update({
+            "ENVIRONMENT": "DEVELOPMENT",
+            "COMFYUI_PATH_DEV": comfyui_path,
+            "PYTHON_PATH_DEV": sys.executable,
+            "COMFYUI_PORT": str(get_free_port(args.instances)),
+            "COMFYUI_GPUS": ",".join(str(gpu) for gpu in range(args.instances)) if args.instances > 1 else "",
+            "COMFYUI_OUTPUT_MODE": output_mode,
+            "COMFYUI_WARMUP_WORKFLOWS": "",
+            "ENABLE_NETWORK_VOLUME": "FALSE",
+            "LOG_LEVEL": args.log_level,
+            "FAKE_COMFYUI_NODE_DELAYS": args.node_delays,
+            "FAKE_COMFYUI_STEP_DELAY_SEC": str(args.step_delay),
+            "FAKE_COMFYUI_PREVIEWS": "FALSE" if args.no_previews else "TRUE",
+            "FAKE_COMFYUI_ERROR_RATE": str(args.error_rate),
+            "FAKE_COMFYUI_CRASH_AFTER": str(args.crash_after),
+            "FAKE_COMFYUI_REPLAY": os.path.abspath(args.replay) if args.replay else "",
+        })
+        if s3_port:
+            env.update({
+                "ENABLE_S3_UPLOAD": "TRUE",
+                "AWS_ACCESS_KEY": "bench",
+                "AWS_SECRET_KEY": "bench",
+                "AWS_BUCKET_NAME": FAKE_S3_BUCKET,
+                "AWS_ENDPOINT_URL_S3": f"http://127.0.0.1:{s3_port}",
+            })
+        else:
+            env["ENABLE_S3_UPLOAD"] = "FALSE"
+
+        command = [
+            sys.executable, os.path.abspath(__file__), "--scenario",
+            "--workflow", workflow,
+            "--jobs", str(args.jobs),
+            "--warmup-jobs", str(args.warmup_jobs),
+            "--concurrency", str(args.concurrency),
+            "--num-images", str(args.num_images),
+            "--output-format", args.output_format,
+        ]
+        process = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL, text=True)
+        for line in process.stdout.splitlines():
+            if line.startswith(RESULT_PREFIX):
+                return json.loads(line[len(RESULT_PREFIX):])
+            if args.verbose:
+                print(line)
+        raise RuntimeError(f"ERROR: Scenario {workflow}/{output_mode} exited with code {process.returncode} without a result")
+
+
+# Get the commit being benchmarked
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_PATH, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+# Print results, compared to a baseline if given
+def print_results(results, baseline=None):
+    baseline_results = {}
+    if baseline:
+        baseline_results = {(r["workflow"], r["output_mode"], r["s3"]): r for r in baseline["results"]}
+    columns = ["workflow", "output_mode", "s3", "jobs", "errors", "throughput_jobs_per_sec", "p50_sec", "p95_sec", "p99_sec", "peak_rss_mb"]
+    print(" | ".join(columns))
+    for result in results:
+        cells = []
+        base = baseline_results.get((result["workflow"], result["output_mode"], result["s3"]))
+        for column in columns:
+            value = result[column]
+            cell = f"{value:.4f}" if isinstance(value, float) else str(value)
+            if base and isinstance(value, float) and base.get(column):
+                cell += f" ({100 * (value - base[column]) / base[column]:+.1f}%)"
+            cells.append(cell)
+        print(" | ".join(cells))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the handler against a stand-in ComfyUI")
+    parser.add_argument("--workflows", default="sd_1_5", help="Comma separated workflow names")
+    parser.add_argument("--output-modes", default="file,websocket,history", help="Comma separated ComfyUI output modes")
+    parser.add_argument("--s3", action="store_true", help="Upload outputs to a stand-in S3 instead of returning base64")
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--warmup-jobs", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--instances", type=int, default=1, help="Stand-in ComfyUI instances, as if the worker had this many GPUs")
+    parser.add_argument("--num-images", type=int, default=1)
+    parser.add_argument("--output-format", default="png")
+    parser.add_argument("--node-delays", default="", help='Stand-in seconds per node class, e.g. "CheckpointLoaderSimple=0.5,*=0.01"')
+    parser.add_argument("--step-delay", type=float, default=0.0, help="Stand-in seconds per sampler step")
+    parser.add_argument("--no-previews", action="store_true", help="Don't send binary preview frames")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of prompts failing with an execution error")
+    parser.add_argument("--crash-after", type=int, default=0, help="Crash the stand-in every this many prompts")
+    parser.add_argument("--replay", default="", help="Replay frames recorded by record_comfyui.py instead of simulating execution")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", default="", help="Write the results to a JSON file")
+    parser.add_argument("--compare", default="", help="Compare to the results JSON of an earlier run")
+    parser.add_argument("--verbose", action="store_true", help="Show worker & stand-in output")
+    parser.add_argument("--scenario", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workflow", default="sd_1_5", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        run_scenario(args)
+        return
+
+    s3_process = None
+    s3_port = None
+    if args.s3:
+        s3_port = get_free_port()
+        s3_process = subprocess.Popen([sys.executable, os.path.join(BENCH_PATH, "fake_s3.py"), "--port", str(s3_port)], stdout=subprocess.DEVNULL)
+        wait_for_port(s3_port)
+    try:
+        results = []
+        for workflow in [w.strip() for w in args.workflows.split(",") if w.strip()]:
+            for output_mode in [m.strip() for m in args.output_modes.split(",") if m.strip()]:
+                print(f"Running {workflow} with {output_mode} output{' and S3 upload' if args.s3 else ''}...", flush=True)
+                results.append(spawn_scenario(args, workflow, output_mode, s3_port))
+    finally:
+        if s3_process:
+            s3_process.terminate()
+            s3_process.wait()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({"commit": get_commit(), "time": int(time.time()), "args": vars(args), "results": results}, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
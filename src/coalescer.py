@@ -0,0 +1,205 @@
+# cross-request prompt coalescing
+
+import logging
+import json
+import time
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+
+# Module constants
+OUTPUT_NODE_TYPES = ["SaveImage", "SaveImageWebsocket", "PreviewImage"]  # Never shared between jobs
+
+
+# Check if a node input is a link to another node's output
+def is_link(value, workflow_data):
+    return (
+        isinstance(value, list) and len(value) == 2 and
+        isinstance(value[0], str) and value[0] in workflow_data and
+        isinstance(value[1], int)
+    )
+
+
+# Order workflow nodes so every node comes after the nodes it links to
+def topological_order(workflow_data):
+    order = []
+    visited = set()
+
+    def visit(node_id):
+        if node_id in visited:
+            return
+        visited.add(node_id)
+        for value in workflow_data[node_id]["inputs"].values():
+            if is_link(value, workflow_data):
+                visit(value[0])
+        order.append(node_id)
+
+    for node_id in workflow_data:
+        visit(node_id)
+    return order
+
+
+# Get the output node IDs of a workflow
+def get_output_nodes(workflow_data):
+    return [id for id, node in workflow_data.items() if node["class_type"] in OUTPUT_NODE_TYPES]
+
+
+# Get the IDs of the given nodes and every node they depend on
+def get_ancestor_nodes(workflow_data, node_ids):
+    ancestors = set()
+    pending = list(node_ids)
+    while pending:
+        node_id = pending.pop()
+        if node_id in ancestors or node_id not in workflow_data:
+            continue
+        ancestors.add(node_id)
+        for value in workflow_data[node_id]["inputs"].values():
+            if is_link(value, workflow_data):
+                pending.append(value[0])
+    return ancestors
+
+
+# Merge several ComfyUI API-format workflows into one graph
+def merge_workflows(workflows):
+    """
+    Merges workflows into a single graph, sharing every node that is identical across them
+    (same class & inputs after remapping links), e.g. the checkpoint loader, negative prompt
+    encode & empty latent. Output nodes are never shared. Returns the merged graph and,
+    for each input workflow, the IDs of its output nodes in the merged graph.
+    """
+    merged = {}
+    shared_nodes = {}  # node signature -> merged node ID
+    workflow_output_nodes = []
+    for index, workflow_data in enumerate(workflows):
+        id_map = {}
+        for node_id in topological_order(workflow_data):
+            node = workflow_data[node_id]
+            inputs = {
+                name: [id_map[value[0]], value[1]] if is_link(value, workflow_data) else value
+                for name, value in node["inputs"].items()
+            }
+            is_output = node["class_type"] in OUTPUT_NODE_TYPES
+            signature = json.dumps([node["class_type"], inputs], sort_keys=True)
+            if not is_output and signature in shared_nodes:
+                id_map[node_id] = shared_nodes[signature]
+                continue
+            merged_id = node_id if index == 0 else f"{index}_{node_id}"
+            merged[merged_id] = {**node, "inputs": inputs}
+            id_map[node_id] = merged_id
+            if not is_output:
+                shared_nodes[signature] = merged_id
+        workflow_output_nodes.append([id_map[id] for id in get_output_nodes(workflow_data)])
+    return merged, workflow_output_nodes
+
+
+# Holds compatible requests for a short window and queues them as one prompt
+class PromptCoalescer:
+    """
+    Collects requests with the same coalescing key (e.g. workflow & aspect ratio) for up to
+    a short window and queues them to ComfyUI as a single merged prompt, so they share the
+    per-prompt overhead, the loaded checkpoint & the negative prompt encode.
+    """
+
+    def __init__(self, window_sec, max_batch_size, queue_merged_prompt, abandon_merged_prompt=None):
+        self.window_sec = window_sec
+        self.max_batch_size = max_batch_size
+        self.batches = 0  # Merged prompts queued
+        self.jobs = 0  # Jobs queued through merged prompts
+        self.batch_sizes = {}  # Batch size -> number of batches
+        self.total_wait_sec = 0.0  # Latency added by waiting for the window, summed over jobs
+        self._queue_merged_prompt = queue_merged_prompt  # async (workflow_data, [events]) -> prompt ID
+        self._abandon_merged_prompt = abandon_merged_prompt  # async (prompt ID, [events], cancel) for jobs gone while queueing
+        self._groups = {}  # key -> list of pending requests
+        self._members = {}  # prompt ID -> jobs still holding the merged prompt
+
+    # queue a workflow, possibly merged with other jobs' workflows
+    async def submit(self, key, workflow_data, events):
+        """
+        Queue a job's workflow, merged with other compatible requests arriving within the window.
+        The job's event queue is subscribed to the merged prompt. Returns the prompt ID,
+        the merged workflow and the IDs of this job's output nodes in it.
+        """
+        future = asyncio.get_running_loop().create_future()
+        group = self._groups.setdefault(key, [])
+        group.append({
+            "workflow_data": workflow_data,
+            "events": events,
+            "future": future,
+            "submitted_at": time.monotonic(),
+        })
+        if len(group) >= self.max_batch_size:
+            self._flush(key)
+        elif len(group) == 1:
+            asyncio.get_running_loop().call_later(self.window_sec, self._flush, key, group)
+        return await future
+
+    # let go of a merged prompt
+    def release(self, prompt_id):
+        """
+        Called by each job of a merged prompt when it is done with it. Returns True if no other
+        job holds the prompt anymore, i.e. it can be cancelled if it is still queued or running.
+        """
+        members = self._members.get(prompt_id)
+        if members is None:
+            return True
+        if members <= 1:
+            del self._members[prompt_id]
+            return True
+        self._members[prompt_id] = members - 1
+        return False
+
+    def stats(self):
+        """
+        Returns coalescing statistics for logging & metrics.
+        """
+        return {
+            "batches": self.batches,
+            "jobs": self.jobs,
+            "batch_sizes": dict(self.batch_sizes),
+            "average_batch_size": self.jobs / self.batches if self.batches else 0,
+            "average_wait_sec": self.total_wait_sec / self.jobs if self.jobs else 0,
+        }
+
+    # close a group and queue it as one prompt
+    def _flush(self, key, group=None):
+        if group is not None and self._groups.get(key) is not group:
+            # The group was already flushed when it filled up
+            return
+        group = self._groups.pop(key, None)
+        if group:
+            asyncio.get_running_loop().create_task(self._queue(group))
+
+    async def _queue(self, group):
+        # Drop jobs that were cancelled while waiting for the window
+        group = [r for r in group if not r["future"].done()]
+        if not group:
+            return
+        now = time.monotonic()
+        try:
+            merged, output_nodes = merge_workflows([r["workflow_data"] for r in group])
+            prompt_id = await self._queue_merged_prompt(merged, [r["events"] for r in group])
+        except Exception as e:
+            for request in group:
+                if not request["future"].done():
+                    request["future"].set_exception(e)
+            return
+
+        wait_sec = sum(now - r["submitted_at"] for r in group)
+        self.batches += 1
+        self.jobs += len(group)
+        self.batch_sizes[len(group)] = self.batch_sizes.get(len(group), 0) + 1
+        self.total_wait_sec += wait_sec
+        logger.info(f"Queued {len(group)} coalesced jobs as prompt {prompt_id} with {len(merged)} nodes, waited {wait_sec / len(group):.3f} seconds on average")
+        abandoned = []
+        for request, nodes in zip(group, output_nodes):
+            if request["future"].done():
+                # Cancelled while the prompt was being queued
+                abandoned.append(request["events"])
+            else:
+                request["future"].set_result((prompt_id, merged, nodes))
+        members = len(group) - len(abandoned)
+        if members:
+            self._members[prompt_id] = members
+        if abandoned and self._abandon_merged_prompt:
+            await self._abandon_merged_prompt(prompt_id, abandoned, not members)
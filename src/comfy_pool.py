@@ -0,0 +1,152 @@
+# pool of comfyui instances, one per gpu
+
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+# Module constants
+AFFINITY_SLACK = 1  # Extra prompts an instance holding a job's checkpoint may have over the least loaded one
+VAE_TILE_SIZES = [(40960, 1024), (20480, 768), (12288, 512), (0, 256)]  # Total VRAM in MB -> tiled VAE tile size in pixels
+DEFAULT_VAE_TILE_SIZE = 512  # Tiled VAE tile size while the VRAM is unknown
+
+
+# A managed ComfyUI instance
+class ComfyInstance:
+    """
+    The state of one ComfyUI process: its GPU, port & client ID, and the process, WebSocket,
+    supervisor, HTTP session & capacity snapshot that belong to it. The prompts queued to it
+    by this worker and the models its last prompt loaded are tracked for routing.
+    """
+
+    def __init__(self, index, host, port, gpu=None, name="ComfyUI"):
+        self.index = index
+        self.gpu = gpu  # GPU the process is pinned to, None for all visible GPUs
+        self.port = port
+        self.name = name
+        self.client_id = str(uuid.uuid4())
+        self.web_url = f"http://{host}:{port}"
+        self.ws_url = f"ws://{host}:{port}/ws"
+        self.process = None
+        self.socket = None
+        self.supervisor = None
+        self.session = None
+        self.session_loop = None
+        self.capacity = None  # Queue depth & VRAM snapshot from the last health probe
+        self.vram_total = None  # VRAM in bytes of the instance's GPU, from its first health probe
+        self.resident_checkpoints = None  # Models loaded by the last prompt queued to the instance
+        self.prompts = set()  # IDs of unfinished prompts queued by this worker
+        self.dispatched = 0  # Prompts queued to the instance
+
+    def is_ready(self):
+        return self.supervisor is not None and self.supervisor.is_ready()
+
+    # get the tile size of tiled vae nodes
+    def get_vae_tile_size(self):
+        """
+        Returns the tile size for tiled VAE decodes & encodes on the instance. It only depends on the GPU's total
+        VRAM, not on the momentary free VRAM, so the same job always gives the same pixels on the same GPU.
+        """
+        if self.vram_total is None:
+            return DEFAULT_VAE_TILE_SIZE
+        vram_total_mb = self.vram_total // (1024 * 1024)
+        for min_vram_total_mb, tile_size in VAE_TILE_SIZES:
+            if vram_total_mb >= min_vram_total_mb:
+                return tile_size
+        return VAE_TILE_SIZES[-1][1]
+
+    def status(self):
+        status = {
+            "gpu": self.gpu,
+            "port": self.port,
+            "prompts": len(self.prompts),
+            "dispatched": self.dispatched,
+            "resident_checkpoints": list(self.resident_checkpoints or []),
+            "vae_tile_size": self.get_vae_tile_size(),
+        }
+        if self.supervisor:
+            status.update(self.supervisor.status())
+        return status
+
+
+# Routes prompts to ComfyUI instances
+class ComfyPool:
+    """
+    Picks the instance each prompt is queued to: the least loaded ready instance, preferring one whose
+    last prompt loaded the same checkpoint, or that has loaded none yet, unless it is busier by more
+    than the affinity slack.
+    Remembers which instance runs each prompt, so later requests about it go to the same instance.
+    """
+
+    def __init__(self, instances, affinity_slack=AFFINITY_SLACK):
+        self.instances = instances
+        self.affinity_slack = affinity_slack
+        self.affinity_hits = 0  # Prompts sent to an instance already holding their checkpoint
+        self._prompt_instances = {}  # prompt ID -> instance
+
+    def __len__(self):
+        return len(self.instances)
+
+    def __iter__(self):
+        return iter(self.instances)
+
+    def get_ready(self):
+        return [instance for instance in self.instances if instance.is_ready()]
+
+    def is_ready(self):
+        return any(instance.is_ready() for instance in self.instances)
+
+    # pick the instance for a prompt
+    def pick(self, checkpoints=None):
+        """
+        Returns the ready instance to queue a prompt loading the given checkpoints to, or None if no
+        instance is ready.
+        """
+        ready = self.get_ready()
+        if not ready:
+            return None
+        least_loaded = min(len(instance.prompts) for instance in ready)
+
+        def rank(instance):
+            # An instance that hasn't loaded any model yet costs the same as one holding the checkpoint
+            resident = (
+                checkpoints and instance.resident_checkpoints in (None, checkpoints) and
+                len(instance.prompts) <= least_loaded + self.affinity_slack
+            )
+            return (not resident, len(instance.prompts), instance.index)
+        return min(ready, key=rank)
+
+    # record a prompt queued to an instance
+    def assign(self, prompt_id, instance, checkpoints=None):
+        if checkpoints and instance.resident_checkpoints == checkpoints:
+            self.affinity_hits += 1
+        instance.resident_checkpoints = checkpoints or instance.resident_checkpoints
+        instance.prompts.add(prompt_id)
+        instance.dispatched += 1
+        self._prompt_instances[prompt_id] = instance
+
+    # follow a prompt that ComfyUI queued under a different ID
+    def rename(self, prompt_id, new_prompt_id):
+        instance = self._prompt_instances.pop(prompt_id, None)
+        if instance:
+            instance.prompts.discard(prompt_id)
+            instance.prompts.add(new_prompt_id)
+            self._prompt_instances[new_prompt_id] = instance
+
+    # get the instance a prompt was queued to
+    def get(self, prompt_id):
+        return self._prompt_instances.get(prompt_id)
+
+    # forget a finished or cancelled prompt
+    def release(self, prompt_id):
+        instance = self._prompt_instances.pop(prompt_id, None)
+        if instance:
+            instance.prompts.discard(prompt_id)
+        return instance
+
+    def stats(self):
+        return {
+            "instances": {instance.name: instance.status() for instance in self.instances},
+            "affinity_hits": self.affinity_hits,
+        }
@@ -0,0 +1,228 @@
+# comfyui websocket multiplexer
+
+import logging
+import re
+import json
+import time
+import threading
+import websockets
+from websockets.sync.client import connect
+
+logger = logging.getLogger(__name__)
+
+
+# Module constants
+RECONNECT_DELAY_MIN_SEC = 0.25  # First retry delay after a dropped connection
+RECONNECT_DELAY_MAX_SEC = 5  # Retry delay cap while ComfyUI is unreachable
+OPEN_TIMEOUT_SEC = 10  # Handshake timeout per connection attempt
+BACKLOG_MAX_PROMPTS = 64  # Prompts to keep early frames for, before anyone subscribes
+BACKLOG_MAX_FRAMES = 64  # Frames kept per backlogged prompt
+PROMPT_ID_PATTERN = re.compile(r'"prompt_id":\s*"([^"]+)"')  # Cheap pre-parse routing key
+
+
+# Single long-lived websocket shared by all jobs on the worker
+class ComfySocket:
+    """
+    Keeps one WebSocket connection to a ComfyUI instance open in a background thread,
+    reconnecting automatically, and routes events by prompt ID to per-job asyncio queues.
+    """
+
+    def __init__(self, ws_url, client_id):
+        self.url = f"{ws_url}?clientId={client_id}"
+        self.connections = 0  # Successful connections so far
+        self.reconnects = 0  # Connections after the first one
+        self.last_message_at = 0.0  # Monotonic time of the last received frame
+        self._subscribers = {}  # prompt_id -> list of (loop, queue)
+        self._backlog = {}  # prompt_id -> raw frames received before subscription
+        self._executing_prompt_id = None  # Prompt currently executing in ComfyUI
+        self._executing_node = None  # Node currently executing in ComfyUI
+        self._lock = threading.Lock()
+        self._connected = threading.Event()
+        self._stopped = threading.Event()
+        self._websocket = None
+        self._thread = None
+
+    # start the background connection thread
+    def start(self):
+        """
+        Start the background thread that owns the connection.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="comfyui-websocket", daemon=True)
+        self._thread.start()
+
+    # stop the background connection thread
+    def stop(self):
+        """
+        Close the connection and stop reconnecting.
+        """
+        self._stopped.set()
+        websocket = self._websocket
+        if websocket:
+            try:
+                websocket.close()
+            except Exception as e:
+                logger.error(f"Error closing WebSocket connection: {str(e)}")
+        if self._thread:
+            self._thread.join(timeout=OPEN_TIMEOUT_SEC)
+            self._thread = None
+        logger.info("Closed WebSocket connection")
+
+    # block until the connection is open
+    def wait_connected(self, timeout=None):
+        """
+        Wait for the connection to be established. Returns True if connected.
+        """
+        return self._connected.wait(timeout)
+
+    def is_connected(self):
+        return self._connected.is_set()
+
+    # register a per-job event queue for a prompt
+    def subscribe(self, prompt_id, queue, loop):
+        """
+        Route events for the given prompt ID to an asyncio queue owned by the given event loop.
+        Frames that arrived before the subscription are replayed into the queue.
+        """
+        with self._lock:
+            self._subscribers.setdefault(prompt_id, []).append((loop, queue))
+            backlog = self._backlog.pop(prompt_id, [])
+        for message in backlog:
+            event = self._decode(message)
+            if event:
+                queue.put_nowait(event)
+
+    # remove a per-job event queue
+    def unsubscribe(self, prompt_id, queue):
+        """
+        Stop routing events for the given prompt ID to the given queue.
+        """
+        with self._lock:
+            subscribers = self._subscribers.get(prompt_id, [])
+            subscribers[:] = [s for s in subscribers if s[1] is not queue]
+            if not subscribers:
+                self._subscribers.pop(prompt_id, None)
+
+    # hand a worker-generated event to a prompt's subscribers
+    def publish(self, prompt_id, event):
+        """
+        Deliver an event to every queue subscribed to the given prompt ID, e.g. when the
+        worker removed the prompt from the ComfyUI queue and no event will come from ComfyUI.
+        """
+        self._deliver(prompt_id, event)
+
+    # fail every in-flight job
+    def fail_all(self, reason):
+        """
+        Deliver a worker error event to every subscribed job, e.g. when ComfyUI crashed.
+        """
+        self._broadcast({"type": "worker_error", "data": {"message": reason}})
+
+    # background connection loop
+    def _run(self):
+        delay = RECONNECT_DELAY_MIN_SEC
+        while not self._stopped.is_set():
+            try:
+                with connect(self.url, open_timeout=OPEN_TIMEOUT_SEC, max_size=None) as websocket:
+                    self._websocket = websocket
+                    self._connected.set()
+                    if self.connections > 0:
+                        self.reconnects += 1
+                        logger.info(f"Reconnected WebSocket to ComfyUI (reconnects: {self.reconnects})")
+                        # Frames may have been missed while disconnected
+                        self._broadcast({"type": "reconnected", "data": {}})
+                    else:
+                        logger.info("Opened WebSocket connection to ComfyUI")
+                    self.connections += 1
+                    delay = RECONNECT_DELAY_MIN_SEC
+                    for message in websocket:
+                        self.last_message_at = time.monotonic()
+                        self._dispatch(message)
+            except (OSError, TimeoutError, websockets.exceptions.WebSocketException) as e:
+                if self._connected.is_set():
+                    logger.info(f"WebSocket connection to ComfyUI lost: {str(e)}")
+            except Exception as e:
+                logger.error(f"Unexpected WebSocket error: {str(e)}")
+            finally:
+                self._websocket = None
+                self._connected.clear()
+            self._stopped.wait(delay)
+            delay = min(delay * 2, RECONNECT_DELAY_MAX_SEC)
+
+    # route a single frame to its subscribers
+    def _dispatch(self, message):
+        # Binary frames (previews, websocket image outputs) carry no prompt ID,
+        # they belong to whichever prompt is executing and are passed through untouched
+        if isinstance(message, bytes):
+            prompt_id = self._executing_prompt_id
+            if prompt_id:
+                self._deliver(prompt_id, {
+                    "type": "binary",
+                    "data": {"prompt_id": prompt_id, "node": self._executing_node, "bytes": message}
+                })
+            return
+
+        # Cheap routing check before paying for a full JSON parse
+        match = PROMPT_ID_PATTERN.search(message)
+        if not match:
+            return
+        prompt_id = match.group(1)
+
+        # Only one prompt executes at a time, so any prompt event marks the executing prompt
+        if prompt_id != self._executing_prompt_id:
+            self._executing_prompt_id = prompt_id
+            self._executing_node = None
+
+        with self._lock:
+            subscribed = prompt_id in self._subscribers
+            if not subscribed:
+                self._remember(prompt_id, message)
+        if not subscribed:
+            return
+
+        event = self._decode(message)
+        if event:
+            if event["type"] == "executing":
+                self._executing_node = event["data"].get("node")
+            self._deliver(prompt_id, event)
+
+    # keep early frames for prompts nobody has subscribed to yet
+    def _remember(self, prompt_id, message):
+        frames = self._backlog.get(prompt_id)
+        if frames is None:
+            if len(self._backlog) >= BACKLOG_MAX_PROMPTS:
+                self._backlog.pop(next(iter(self._backlog)))
+            frames = self._backlog[prompt_id] = []
+        if len(frames) < BACKLOG_MAX_FRAMES:
+            frames.append(message)
+
+    # parse a text frame into an event
+    def _decode(self, message):
+        try:
+            event = json.loads(message)
+        except ValueError:
+            logger.warning("Dropping malformed WebSocket frame")
+            return None
+        if "type" not in event or "data" not in event:
+            return None
+        return event
+
+    # hand an event to every queue subscribed to a prompt
+    def _deliver(self, prompt_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(prompt_id, []))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                # Owning event loop is closed, the job is gone
+                self.unsubscribe(prompt_id, queue)
+
+    # hand an event to every subscribed queue
+    def _broadcast(self, event):
+        with self._lock:
+            prompt_ids = list(self._subscribers.keys())
+        for prompt_id in prompt_ids:
+            self._deliver(prompt_id, event)
@@ -1,22 +1,44 @@
+import io
 import os
 import time
-import json
 import math
+import errno
 import uuid
 import boto3
 import base64
 import runpod
 import signal
-import shutil
 import asyncio
+import aiohttp
 import requests
 import botocore
+import boto3.s3.transfer
+import struct
+import logging
+import itertools
 import threading
-import traceback
-import websockets
 import subprocess
+import contextvars
 
-from workflows import get_workflow, get_default_workflow
+from concurrent.futures import ThreadPoolExecutor
+from coalescer import PromptCoalescer, get_ancestor_nodes, get_output_nodes
+from comfy_pool import ComfyInstance, ComfyPool
+from comfy_socket import ComfySocket
+from model_cache import ModelPrefetcher, ModelStager, get_model_files, write_model_paths_config
+from retention import RetentionManager
+from metrics import JobMetrics, JobTimings, MetricsServer
+from logs import LOG_FORMATS, setup_logging, shutdown_logging, stream_output, get_recent_output, job_id_var
+from input_images import ASPECT_RATIOS, UploadCache, fetch_image, get_image_aspect_ratio, is_upload_filename
+from image_encoding import parse_output_format, encode_image, encode_preview, get_content_type, get_extension
+from progress import ProgressReporter, StageTimings
+from result_cache import ResultCache, get_cache_key
+from scheduler import ModelScheduler, get_checkpoints
+from streaming import JobStream
+from supervisor import STARTUP_TIMEOUT_SEC, ComfySupervisor
+from workflows import DEFAULT_WORKFLOW_NAME, get_workflow, get_default_workflow, get_workflow_names
+from workflows.templates import AUTO_TILE_SIZE_META, patch_workflow
+
+logger = logging.getLogger("handler")
 
 
 # Worker Configuration
@@ -30,10 +52,23 @@ PYTHON_PATH_DEV = os.getenv('PYTHON_PATH_DEV', '/usr/bin/python3')
 PYTHON_PATH = "/opt/venv/bin/python" if PROD else PYTHON_PATH_DEV
 # Health check mode
 HEALTH_CHECK_MODE = os.getenv('HEALTH_CHECK_MODE', 'FALSE') == 'TRUE'
+# Logging config
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()  # "text" or "json" (one object per line)
+RETURN_ERROR_DETAILS = os.getenv('RETURN_ERROR_DETAILS', 'FALSE') == 'TRUE'  # Return the error & recent ComfyUI output to callers
+ERROR_DETAILS_LINES = int(os.getenv('ERROR_DETAILS_LINES', '20'))
 # Network volume config
 ENABLE_NETWORK_VOLUME = os.getenv('ENABLE_NETWORK_VOLUME', 'FALSE') == 'TRUE'
 MODEL_CACHE_PATH_DEV = os.getenv('MODEL_CACHE_PATH_DEV', '/workspace/models')
 MODEL_CACHE_PATH = "/runpod-volume/models" if PROD else MODEL_CACHE_PATH_DEV
+MODEL_PATHS_CONFIG_NAME = "extra_model_paths.worker.yaml"  # Generated in the ComfyUI folder, next to any user config
+ENABLE_MODEL_PREFETCH = os.getenv('ENABLE_MODEL_PREFETCH', 'TRUE') == 'TRUE'
+MODEL_PREFETCH_WORKERS = int(os.getenv('MODEL_PREFETCH_WORKERS', '4'))
+MODEL_PREFETCH_MAX_MB = os.getenv('MODEL_PREFETCH_MAX_MB', '')  # Defaults to half of the available memory
+ENABLE_MODEL_STAGING = os.getenv('ENABLE_MODEL_STAGING', 'FALSE') == 'TRUE'  # Copy used models to local disk
+MODEL_STAGING_PATH = os.getenv('MODEL_STAGING_PATH', '/models-staging')
+MODEL_STAGING_MAX_GB = float(os.getenv('MODEL_STAGING_MAX_GB', '50'))
+MODEL_STAGING_WORKERS = int(os.getenv('MODEL_STAGING_WORKERS', '2'))
 # AWS config
 ENABLE_S3_UPLOAD = os.getenv('ENABLE_S3_UPLOAD', 'FALSE') == 'TRUE'
 AWS_ACCESS_KEY = os.getenv('AWS_ACCESS_KEY', '')
@@ -42,193 +77,497 @@ AWS_BUCKET_NAME = os.getenv('AWS_BUCKET_NAME', '')
 AWS_REGION_DEFAULT = 'us-east-1'
 AWS_REGION = os.getenv('AWS_REGION', AWS_REGION_DEFAULT)
 S3_CACHE_CONTROL_MAX_AGE = "31536000"  # 1 year cache
+S3_MULTIPART_THRESHOLD_MB = int(os.getenv('S3_MULTIPART_THRESHOLD_MB', '8'))
+S3_MULTIPART_CHUNKSIZE_MB = int(os.getenv('S3_MULTIPART_CHUNKSIZE_MB', '8'))
+S3_MAX_CONCURRENCY = int(os.getenv('S3_MAX_CONCURRENCY', '10'))
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', '20'))
 # ComfyUI config
-COMFYUI_PORT = 3000
-COMFYUI_CLIENT_ID = str(uuid.uuid4())
+COMFYUI_PORT = int(os.getenv('COMFYUI_PORT', '3000'))  # Port of the first instance, further instances use the following ports
+COMFYUI_GPUS = os.getenv('COMFYUI_GPUS', '').strip().lower()  # "" for one instance on all GPUs, "auto" or e.g. "0,1" for one instance per GPU
 COMFYUI_FILENAME_PREFIX = APP_NAME
-COMFYUI_WEB_URL = f"http://{LOCAL_HOST_IP}:{COMFYUI_PORT}"
-COMFYUI_WS_URL = f"ws://{LOCAL_HOST_IP}:{COMFYUI_PORT}/ws"
 COMFYUI_PATH_DEV = os.getenv('COMFYUI_PATH_DEV', os.path.expanduser("~/comfyui"))
 COMFYUI_PATH = "/comfyui" if PROD else COMFYUI_PATH_DEV
 COMFYUI_JOB_TIMEOUT_SEC = int(os.getenv("COMFYUI_JOB_TIMEOUT_SEC", "180"))
+COMFYUI_READY_TIMEOUT_SEC = int(os.getenv("COMFYUI_READY_TIMEOUT_SEC", "60"))
+COMFYUI_STOP_TIMEOUT_SEC = 10
+COMFYUI_CANCEL_TIMEOUT_SEC = 10  # Cancelling a prompt of a failed job gives up after this long
+# Output retrieval: "file" reads the saved PNG from disk, "websocket" receives image bytes over the shared
+# WebSocket (SaveImageWebsocket node), "history" downloads the outputs listed in /history via /view
+COMFYUI_OUTPUT_MODES = ["file", "websocket", "history"]
+COMFYUI_OUTPUT_MODE = os.getenv("COMFYUI_OUTPUT_MODE", "file").lower()
+COMFYUI_BINARY_EVENT_PREVIEW_IMAGE = 1
+COMFYUI_BINARY_HEADER_SIZE = 8  # Event type + image format
+BASE64_CHUNK_SIZE = 3 * 256 * 1024  # Multiple of 3 so encoded chunks concatenate cleanly
+COMFYUI_MAX_NUM_IMAGES = int(os.getenv("COMFYUI_MAX_NUM_IMAGES", "8"))
+# Progress config, reports are rate limited & estimated from learned node timings per workflow
+PROGRESS_MIN_INTERVAL_SEC = float(os.getenv("PROGRESS_MIN_INTERVAL_SEC", "1"))
+PROGRESS_INCLUDE_ETA = os.getenv("PROGRESS_INCLUDE_ETA", "FALSE") == "TRUE"  # e.g. "42% (ETA 7s)" instead of "42%"
+# Warm-up config, workflows whose models are loaded at startup with a minimal graph (comma separated, empty to disable)
+COMFYUI_WARMUP_WORKFLOWS = [w.strip() for w in os.getenv("COMFYUI_WARMUP_WORKFLOWS", DEFAULT_WORKFLOW_NAME).split(",") if w.strip()]
+COMFYUI_WARMUP_TIMEOUT_SEC = int(os.getenv("COMFYUI_WARMUP_TIMEOUT_SEC", "300"))
+COMFYUI_WARMUP_IMAGE_SIZE = 64  # Smallest latent-friendly size, the image itself is discarded
+# Coalescing config, compatible requests arriving within the window are merged into one prompt
+COMFYUI_COALESCE_WINDOW_MS = int(os.getenv("COMFYUI_COALESCE_WINDOW_MS", "0"))
+COMFYUI_COALESCE_MAX_BATCH = int(os.getenv("COMFYUI_COALESCE_MAX_BATCH", "4"))
+# Scheduling config, pending prompts are reordered to keep the resident checkpoint loaded
+ENABLE_MODEL_SCHEDULER = os.getenv("ENABLE_MODEL_SCHEDULER", "FALSE") == "TRUE"
+COMFYUI_SCHEDULER_MAX_IN_FLIGHT = int(os.getenv("COMFYUI_SCHEDULER_MAX_IN_FLIGHT", "1"))
+COMFYUI_SCHEDULER_MAX_WAIT_SEC = int(os.getenv("COMFYUI_SCHEDULER_MAX_WAIT_SEC", "30"))
+COMFYUI_HTTP_POOL_SIZE = 16
+COMFYUI_HTTP_RETRIES = 10
+COMFYUI_HTTP_RETRY_STATUSES = [502, 503, 504]
+COMFYUI_HTTP_UNSAFE_RETRY_STATUSES = [503]  # Statuses non-GET requests are retried on, ComfyUI didn't act on the request
+COMFYUI_HTTP_BACKOFF_SEC = 0.1
+COMFYUI_HTTP_BACKOFF_MAX_SEC = 2
+# Blocking I/O config (disk reads, base64 encoding, S3 uploads)
+IO_MAX_WORKERS = int(os.getenv("IO_MAX_WORKERS", "4"))
+# Output encoding config (WebP/JPEG/AVIF re-encoding of ComfyUI PNG outputs)
+ENCODE_MAX_WORKERS = int(os.getenv("ENCODE_MAX_WORKERS", str(os.cpu_count() or 2)))
+# Concurrency config
+COMFYUI_MAX_CONCURRENCY = max(1, int(os.getenv("COMFYUI_MAX_CONCURRENCY", "1")))
+COMFYUI_MAX_QUEUE_DEPTH = int(os.getenv("COMFYUI_MAX_QUEUE_DEPTH", "2"))
+COMFYUI_MIN_FREE_VRAM_MB = int(os.getenv("COMFYUI_MIN_FREE_VRAM_MB", "1024"))
+COMFYUI_CAPACITY_STALE_SEC = 10
+# Result cache config, results of jobs with explicit seeds are reused for identical requests
+ENABLE_RESULT_CACHE = os.getenv('ENABLE_RESULT_CACHE', 'FALSE') == 'TRUE'
+RESULT_CACHE_PATH = os.getenv('RESULT_CACHE_PATH', '/tmp/result-cache')
+RESULT_CACHE_MAX_MB = int(os.getenv('RESULT_CACHE_MAX_MB', '1024'))
+RESULT_CACHE_S3_PREFIX = os.getenv('RESULT_CACHE_S3_PREFIX', '')  # Shared S3 tier, disabled if empty
+# Retention config, budget for the files the worker writes to the ComfyUI output, input & temp folders
+ENABLE_OUTPUT_RETENTION = os.getenv('ENABLE_OUTPUT_RETENTION', 'TRUE') == 'TRUE'
+OUTPUT_RETENTION_MAX_GB = float(os.getenv('OUTPUT_RETENTION_MAX_GB', '10'))
+OUTPUT_RETENTION_MAX_AGE_HOURS = float(os.getenv('OUTPUT_RETENTION_MAX_AGE_HOURS', '24'))
+OUTPUT_RETENTION_MIN_FREE_GB = float(os.getenv('OUTPUT_RETENTION_MIN_FREE_GB', '2'))  # Oldest files are deleted while the disk has less free space
+OUTPUT_RETENTION_INTERVAL_SEC = int(os.getenv('OUTPUT_RETENTION_INTERVAL_SEC', '300'))
+# Metrics config, per-stage job timing histograms served in Prometheus format
+ENABLE_METRICS = os.getenv('ENABLE_METRICS', 'FALSE') == 'TRUE'
+METRICS_HOST = os.getenv('METRICS_HOST', LOCAL_HOST_IP)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))
+# Streaming config, the handler yields progress, throttled latent previews & the result as a stream
+ENABLE_STREAMING = os.getenv('ENABLE_STREAMING', 'FALSE') == 'TRUE'
+STREAM_PREVIEW_INTERVAL_SEC = float(os.getenv('STREAM_PREVIEW_INTERVAL_SEC', '0.5'))
+STREAM_PREVIEW_MAX_SIZE = int(os.getenv('STREAM_PREVIEW_MAX_SIZE', '256'))
+STREAM_PREVIEW_QUALITY = 70
+COMFYUI_PREVIEW_METHOD = os.getenv('COMFYUI_PREVIEW_METHOD', 'latent2rgb' if ENABLE_STREAMING else '')  # ComfyUI only sends latent previews with a preview method
+# Input image config, img2img & inpainting images given as URLs or base64, uploaded to ComfyUI by content hash
+INPUT_IMAGE_NAMES = ["image", "mask"]
+INPUT_IMAGE_MAX_MB = float(os.getenv('INPUT_IMAGE_MAX_MB', '20'))
+INPUT_IMAGE_MAX_MEGAPIXELS = float(os.getenv('INPUT_IMAGE_MAX_MEGAPIXELS', '40'))
+INPUT_IMAGE_DOWNLOAD_TIMEOUT_SEC = int(os.getenv('INPUT_IMAGE_DOWNLOAD_TIMEOUT_SEC', '30'))
+INPUT_IMAGE_UPLOAD_CACHE_SIZE = int(os.getenv('INPUT_IMAGE_UPLOAD_CACHE_SIZE', '1024'))  # Input images known to be in ComfyUI's input folder
 
 
 # Worker memory
-comfy_session = None
-comfyui_process = None
-active_websockets = None
+comfy_pool = None
+download_session = None
+download_session_loop = None
+input_upload_cache = None
+io_executor = None
+encode_executor = None
+prompt_coalescer = None
+model_prefetcher = None
+model_stager = None
+model_scheduler = None
+retention_manager = None
+stage_timings = StageTimings()
+cancelled_prompts = {"pending": 0, "running": 0, "gpu_sec": 0.0}  # Prompts cancelled after their jobs were gone
+result_cache = None
+job_metrics = None
+metrics_server = None
 s3_client = None
-
-
-# utility method for ComfyUI logging
-def stream_output(pipe, prefix):
-    """
-    Stream output from a pipe to stdout with a prefix
-    """
-    for line in iter(pipe.readline, ''):
-        print(f"{prefix}: {line.rstrip()}")
+s3_transfer_config = None
+s3_client_lock = threading.Lock()
 
 
 # start managed local ComfyUI instance
-def start_comfyui():
+def start_comfyui(instance):
     """
-    Start ComfyUI if it's not already running
+    Start a ComfyUI instance if it's not already running, pinned to its GPU if it has one
     Returns the process object
     """
-    global comfyui_process
-    
     # Check if ComfyUI is already running on the specified port
     try:
-        print("Checking if ComfyUI instance  is already running before starting new ComfyUI instance")
-        response = requests.get(f"{COMFYUI_WEB_URL}/system_stats", timeout=1)
+        logger.debug("Checking if ComfyUI instance  is already running before starting new ComfyUI instance")
+        response = requests.get(f"{instance.web_url}/system_stats", timeout=1)
         if response.status_code == 200:
-            print(f"ComfyUI instance is already running on port {COMFYUI_PORT}")
+            logger.info(f"{instance.name} is already running on port {instance.port}")
             return None
     except requests.exceptions.RequestException:
         pass
 
     # Start ComfyUI
     try:
-        print(f"Starting new ComfyUI instance on port {COMFYUI_PORT}...")
+        logger.info(f"Starting new {instance.name} on port {instance.port}...")
+        args = [ PYTHON_PATH, "main.py", "--port", str(instance.port), "--listen", "0.0.0.0" ]
+        if ENABLE_NETWORK_VOLUME:
+            args += [ "--extra-model-paths-config", f"{COMFYUI_PATH}/{MODEL_PATHS_CONFIG_NAME}" ]
+        if COMFYUI_PREVIEW_METHOD:
+            args += [ "--preview-method", COMFYUI_PREVIEW_METHOD, "--preview-size", str(STREAM_PREVIEW_MAX_SIZE) ]
+        env = None
+        if instance.gpu is not None:
+            env = {**os.environ, "CUDA_VISIBLE_DEVICES": str(instance.gpu)}
         process = subprocess.Popen(
-            [ PYTHON_PATH, "main.py", "--port", str(COMFYUI_PORT), "--listen", "0.0.0.0" ],
+            args,
             cwd=COMFYUI_PATH,
+            env=env,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             preexec_fn=os.setsid,  # Makes the process a session leader
             bufsize=1,  # Line buffered
             universal_newlines=True  # Text mode
         )
-        comfyui_process = process
+        instance.process = process
+        instance.resident_checkpoints = None
 
         # Start threads to handle output streams
+        output_logger = logging.getLogger("comfyui" if instance.gpu is None else f"comfyui.gpu{instance.gpu}")
         stdout_thread = threading.Thread(
             target=stream_output, 
-            args=(process.stdout, "ComfyUI"),
+            args=(process.stdout, output_logger),
             daemon=True
         )
         stderr_thread = threading.Thread(
             target=stream_output, 
-            # args=(process.stderr, "ComfyUI Error"),
-            args=(process.stderr, "ComfyUI"),
+            args=(process.stderr, output_logger),
             daemon=True
         )
         
         stdout_thread.start()
         stderr_thread.start()
         
-        print("ComfyUI process started")
+        logger.info(f"{instance.name} process started")
         return process
     except Exception as e:
-        print(f"ERROR: Failed to start ComfyUI: {str(e)}")
+        logger.error(f"Failed to start {instance.name}: {str(e)}")
         raise
 
 
 # stop managed local ComfyUI instance
-def stop_comfyui():
+def stop_comfyui(instance):
     """
-    Stop the ComfyUI process if it's running
+    Stop a ComfyUI instance's process if it's running
     """
-    global comfyui_process
-    if comfyui_process:
+    process = instance.process
+    if process:
         try:
-            # Kill the entire process group
-            os.killpg(os.getpgid(comfyui_process.pid), signal.SIGTERM)
-            comfyui_process = None
-            print("ComfyUI process stopped")
+            if process.poll() is None:
+                # Kill the entire process group
+                os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+                try:
+                    process.wait(timeout=COMFYUI_STOP_TIMEOUT_SEC)
+                except subprocess.TimeoutExpired:
+                    os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+                    process.wait()
+            instance.process = None
+            logger.info(f"{instance.name} process stopped")
         except Exception as e:
-            print(f"ERROR: Failed to stop ComfyUI: {str(e)}")
+            logger.error(f"Failed to stop {instance.name}: {str(e)}")
             raise
 
 
-# wait until local ComfyUI instance is available
-def wait_for_comfyui():
+# point comfyui at the network volume models
+def configure_model_paths():
     """
-    Check if the service is ready to receive requests.
+    Generates an extra_model_paths config that adds the model folders on the network volume
+    to ComfyUI's search paths, leaving the models bundled in the image in place.
     """
-    print("Waiting for ComfyUI")
-    while True:
+    config_path = f"{COMFYUI_PATH}/{MODEL_PATHS_CONFIG_NAME}"
+    staging_path = MODEL_STAGING_PATH if ENABLE_MODEL_STAGING else None
+    folders = write_model_paths_config(config_path, MODEL_CACHE_PATH, staging_path=staging_path)
+    logger.info(f"Configured ComfyUI model folders {', '.join(folders)} from {MODEL_CACHE_PATH}{f' staged in {staging_path}' if staging_path else ''} in {config_path}")
+
+
+# find the network volume models used by workflows
+def get_workflow_model_files(workflow_names):
+    """
+    Returns the (model folder, file name) pairs on the network volume referenced by the given workflows, in order.
+    """
+    model_files = []
+    for workflow_name in workflow_names:
         try:
-            print("Checking if ComfyUI is running")
-            response = requests.get(f"{COMFYUI_WEB_URL}/system_stats", timeout=120)
-            if response.status_code != 200:
-                raise RuntimeError(f"ERROR: Got error {response.status_code} from ComfyUI")
-            return
-        except requests.exceptions.RequestException:
-            print("ComfyUI not ready yet. Retrying...")
-        except Exception as err:
-            print("ERROR Error: ", err)
-        time.sleep(0.5)
-
-
-def link_cached_models():
-    print("Linking models from cache")
-    # Get types by listing directories in MODEL_CACHE_PATH
-    types = [d for d in os.listdir(MODEL_CACHE_PATH) 
-             if os.path.isdir(os.path.join(MODEL_CACHE_PATH, d))]
-    # Link model types
-    for type in types:
-        source_path = f"{MODEL_CACHE_PATH}/{type}"
-        target_path = f"{COMFYUI_PATH}/models/{type}"
-        # Remove existing directory/link if it exists
-        if os.path.exists(target_path):
-            if os.path.islink(target_path):
-                os.unlink(target_path)
-            else:
-                shutil.rmtree(target_path)
-        # Create symbolic link
-        os.symlink(source_path, target_path)
-        print(f"Linked {type} models into {target_path}")
+            workflow = get_workflow(workflow_name)
+            input_images = {name: "" for name in getattr(workflow.load, "input_images", [])}
+            workflow_data = workflow.load("", "1_1", "models", COMFYUI_FILENAME_PREFIX, **({"input_images": input_images} if input_images else {}))
+        except Exception as e:
+            logger.warning(f"Cannot find models of workflow {workflow_name}: {str(e)}")
+            continue
+        for folder, filename in get_model_files(workflow_data):
+            if os.path.isfile(os.path.join(MODEL_CACHE_PATH, folder, filename)):
+                model_files.append((folder, filename))
+    return list(dict.fromkeys(model_files))
+
+
+# find the network volume models used by the registered workflows
+def get_prefetch_model_paths():
+    """
+    Yields the paths of the model files referenced by the registered workflows, warm-up workflows
+    first, then the default workflow, then all other workflows. Each workflow is only imported & built
+    when the paths of the ones before it were taken, so their models are read meanwhile.
+    """
+    for workflow_name in dict.fromkeys(COMFYUI_WARMUP_WORKFLOWS + [DEFAULT_WORKFLOW_NAME] + get_workflow_names()):
+        for folder, filename in get_workflow_model_files([workflow_name]):
+            yield os.path.join(MODEL_CACHE_PATH, folder, filename)
+
+
+# read the workflows' models into the page cache in the background
+def start_model_prefetch():
+    """
+    Starts reading the models used by the registered workflows from the network volume
+    into the page cache, so the first load of each checkpoint doesn't hit the volume cold.
+    The workflows are found & built in the prefetch thread, not on the startup path.
+    """
+    global model_prefetcher
+    if MODEL_PREFETCH_MAX_MB:
+        max_bytes = int(MODEL_PREFETCH_MAX_MB) * 1024 * 1024
+    else:
+        max_bytes = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2
+    model_prefetcher = ModelPrefetcher(MODEL_PREFETCH_WORKERS, max_bytes)
+    model_prefetcher.start(get_prefetch_model_paths)
+
+
+# copy models to local disk as they are used
+def start_model_staging():
+    """
+    Starts the local disk staging cache for network volume models, and starts copying the models
+    of the warm-up workflows. Other models are copied when a job first uses them.
+    """
+    global model_stager
+    model_stager = ModelStager(
+        MODEL_CACHE_PATH,
+        MODEL_STAGING_PATH,
+        int(MODEL_STAGING_MAX_GB * 1024 * 1024 * 1024),
+        MODEL_STAGING_WORKERS
+    )
+    for folder, filename in get_workflow_model_files(COMFYUI_WARMUP_WORKFLOWS):
+        model_stager.stage(folder, filename)
+
+
+# stop copying models to local disk
+def stop_model_staging():
+    global model_stager
+    if model_stager:
+        model_stager.stop()
+        logger.info(f"Model staging stats: {model_stager.stats()}")
+        model_stager = None
+
+
+# check if a comfyui file was written by the worker
+def is_worker_file(name):
+    """
+    Returns True for files saved under the worker's filename prefix & input images uploaded under their
+    content hash. Any other file, e.g. inputs baked into the image or added by the user, isn't the worker's.
+    """
+    return name.startswith(f"{COMFYUI_FILENAME_PREFIX}_") or is_upload_filename(name)
+
+
+# start enforcing the retention budget of comfyui's file folders
+def start_retention_manager():
+    """
+    Deletes output & temp files left behind by earlier runs of the worker, then keeps the files the worker
+    wrote to the ComfyUI output, input & temp folders within the retention budget from a background thread.
+    """
+    global retention_manager
+    retention_manager = RetentionManager(
+        [f"{COMFYUI_PATH}/output", f"{COMFYUI_PATH}/input", f"{COMFYUI_PATH}/temp"],
+        int(OUTPUT_RETENTION_MAX_GB * 1024 * 1024 * 1024),
+        OUTPUT_RETENTION_MAX_AGE_HOURS * 3600,
+        int(OUTPUT_RETENTION_MIN_FREE_GB * 1024 * 1024 * 1024),
+        OUTPUT_RETENTION_INTERVAL_SEC,
+        is_owned=is_worker_file
+    )
+    retention_manager.start(orphan_prefixes=[f"{COMFYUI_FILENAME_PREFIX}_"])
+    logger.info(f"Retention stats: {retention_manager.stats()}")
+
+
+# stop enforcing the retention budget
+def stop_retention_manager():
+    global retention_manager
+    if retention_manager:
+        retention_manager.stop()
+        logger.info(f"Retention stats: {retention_manager.stats()}")
+        retention_manager = None
+
+
+# stop prefetching models
+def stop_model_prefetch():
+    global model_prefetcher
+    if model_prefetcher:
+        model_prefetcher.stop()
+        logger.info(f"Model prefetch stats: {model_prefetcher.stats()}")
+        model_prefetcher = None
 
 
 # setup comfyui http session
-def setup_comfyui_session():
+def get_comfyui_session(instance):
     """
-    Creates an HTTP request session configured for ComfyUI communication.
-    The session is set up with automatic retries for common HTTP server errors.
+    Returns the pooled keep-alive async HTTP session for communication with a ComfyUI instance,
+    creating it on first use in the running event loop.
     """
-    global comfy_session
-    comfy_session = requests.Session()
-    retries = requests.adapters.Retry(total=10, backoff_factor=0.1, status_forcelist=[502, 503, 504])
-    comfy_session.mount('http://', requests.adapters.HTTPAdapter(max_retries=retries))
+    loop = asyncio.get_running_loop()
+    if instance.session is None or instance.session.closed or instance.session_loop is not loop:
+        connector = aiohttp.TCPConnector(limit=COMFYUI_HTTP_POOL_SIZE)
+        instance.session = aiohttp.ClientSession(
+            base_url=instance.web_url,
+            connector=connector,
+            raise_for_status=False
+        )
+        instance.session_loop = loop
+    return instance.session
 
 
 # close comfyui http session
-def close_comfyui_session():
+def close_comfyui_session(instance):
     """
-    Close HTTP request session for ComfyUI if it exists.
+    Close HTTP request session for a ComfyUI instance if it exists.
     """
-    global comfy_session
-    if comfy_session:
+    session, session_loop = instance.session, instance.session_loop
+    if session and not session.closed:
         try:
-            comfy_session.close()
-            print("Closed HTTP session")
+            if not session_loop.is_closed() and not session_loop.is_running():
+                session_loop.run_until_complete(session.close())
+            else:
+                # Release pooled connections without the finished event loop
+                session.detach()
+            logger.info(f"Closed HTTP session of {instance.name}")
         except Exception as e:
-            print(f"ERROR: Error while closing HTTP session: {str(e)}")
+            logger.error(f"Error while closing HTTP session: {str(e)}")
             raise
+    instance.session = None
+    instance.session_loop = None
+
+
+# get input image download http session
+def get_download_session():
+    """
+    Returns the pooled async HTTP session for downloading input images,
+    creating it on first use in the running event loop.
+    """
+    global download_session, download_session_loop
+    loop = asyncio.get_running_loop()
+    if download_session is None or download_session.closed or download_session_loop is not loop:
+        download_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=INPUT_IMAGE_DOWNLOAD_TIMEOUT_SEC),
+            raise_for_status=False
+        )
+        download_session_loop = loop
+    return download_session
+
+
+# close input image download http session
+def close_download_session():
+    global download_session, download_session_loop
+    if download_session and not download_session.closed:
+        if not download_session_loop.is_closed() and not download_session_loop.is_running():
+            download_session_loop.run_until_complete(download_session.close())
+        else:
+            download_session.detach()
+    download_session = None
+    download_session_loop = None
+
+
+# send a request to comfyui, retrying transient server errors
+async def comfyui_request(instance, method, path, **kwargs):
+    """
+    Send an HTTP request to a local ComfyUI instance over its pooled session and return the parsed JSON body.
+    Retries connection errors and 502/503/504 responses with exponential backoff. Other methods than GET are
+    only retried if the connection couldn't be made or on 503, since ComfyUI may have acted on a request
+    that was dropped midway, e.g. queued a prompt, and a retry would do it twice.
+    A callable data argument is called for each attempt, e.g. to rewind a streamed upload.
+    """
+    session = get_comfyui_session(instance)
+    if method == "GET":
+        retry_statuses, retry_errors = COMFYUI_HTTP_RETRY_STATUSES, aiohttp.ClientConnectionError
+    else:
+        retry_statuses, retry_errors = COMFYUI_HTTP_UNSAFE_RETRY_STATUSES, aiohttp.ClientConnectorError
+    for attempt in range(COMFYUI_HTTP_RETRIES + 1):
+        last_attempt = attempt == COMFYUI_HTTP_RETRIES
+        request_kwargs = kwargs
+        if callable(kwargs.get("data")):
+            request_kwargs = {**kwargs, "data": kwargs["data"]()}
+        try:
+            async with session.request(method, path, **request_kwargs) as response:
+                if response.status not in retry_statuses or last_attempt:
+                    if response.status >= 400:
+                        body = await response.text()
+                        raise RuntimeError(f"ERROR: ComfyUI returned {response.status} for {path}: {body}")
+                    return await response.json(content_type=None)
+        except retry_errors:
+            if last_attempt:
+                raise
+        await asyncio.sleep(min(COMFYUI_HTTP_BACKOFF_SEC * 2 ** attempt, COMFYUI_HTTP_BACKOFF_MAX_SEC))
+
+
+# run blocking disk/network work off the event loop
+async def run_blocking(func, *args):
+    """
+    Run a blocking function in the bounded I/O thread pool so it cannot stall other jobs' event handling.
+    """
+    global io_executor
+    if io_executor is None:
+        io_executor = ThreadPoolExecutor(max_workers=IO_MAX_WORKERS, thread_name_prefix="io")
+    # Carry the job context over so the worker thread's log records keep the job ID
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(io_executor, context.run, func, *args)
+
+
+# run cpu-bound image encoding off the event loop
+async def run_encode(func, *args):
+    """
+    Run an image encoding function in the bounded encoding thread pool, kept separate from
+    the I/O pool so slow encodes don't hold up uploads. Pillow releases the GIL while encoding.
+    """
+    global encode_executor
+    if encode_executor is None:
+        encode_executor = ThreadPoolExecutor(max_workers=ENCODE_MAX_WORKERS, thread_name_prefix="encode")
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(encode_executor, context.run, func, *args)
+
+
+# shut down the blocking i/o thread pools
+def close_io_executor():
+    """
+    Wait for pending blocking work and shut down the I/O & encoding thread pools.
+    """
+    global io_executor, encode_executor
+    if io_executor:
+        io_executor.shutdown(wait=True)
+        io_executor = None
+    if encode_executor:
+        encode_executor.shutdown(wait=True)
+        encode_executor = None
+
+
+# wait for a supervised ComfyUI instance before running a job
+async def ensure_comfyui():
+    """
+    Returns immediately if a supervisor reports its ComfyUI instance as ready, otherwise waits
+    for a bounded time while the instances are being started or restarted.
+    """
+    if comfy_pool.is_ready():
+        return
+    logger.info("Waiting for ComfyUI to become ready")
+    deadline = time.monotonic() + COMFYUI_READY_TIMEOUT_SEC
+    while not comfy_pool.is_ready():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"ERROR: ComfyUI not ready after {COMFYUI_READY_TIMEOUT_SEC} seconds ({comfy_pool.stats()})")
+        await asyncio.sleep(0.1)
 
 
 # queue new image generation prompt via local ComfyUI instance
-def queue_prompt(user_prompt, workflow_data):
+async def queue_prompt(instance, workflow_data, prompt_id):
     """
-    Queue a prompt to ComfyUI and return the prompt ID
+    Queue a prompt to a ComfyUI instance under the given prompt ID and return the prompt ID ComfyUI assigned
     """
-    global comfy_session
     try:
-        sanitized_prompt = str(user_prompt).encode('unicode_escape').decode('utf-8')
-        print(f"Queueing prompt {sanitized_prompt}")
-
         request_data = {
             "prompt": workflow_data,
-            "client_id": COMFYUI_CLIENT_ID
+            "prompt_id": prompt_id,
+            "client_id": instance.client_id
         }
-        print("Sending prompt request to ComfyUI local instance")
-        response = comfy_session.post(f"{COMFYUI_WEB_URL}/prompt", json=request_data)
+        logger.debug(f"Sending prompt request to {instance.name}")
+        response_data = await comfyui_request(instance, "POST", "/prompt", json=request_data)
         
-        response.raise_for_status()
-        response_data = response.json()
-        
-        print(f"ComfyUI response: {response_data}")
+        logger.debug(f"ComfyUI response: {response_data}")
         
         if not response_data:
             raise ValueError("ERROR: Empty ComfyUI response")
@@ -240,7 +579,7 @@ def queue_prompt(user_prompt, workflow_data):
         return response_data['prompt_id']
         
     except Exception as e:
-        print(f"ERROR: Error queueing prompt: {str(e)}")
+        logger.error(f"Error queueing prompt: {str(e)}")
         raise
 
 
@@ -248,255 +587,1048 @@ def queue_prompt(user_prompt, workflow_data):
 def get_s3_client():
     """
     Returns a cached boto3 S3 client instance, creating a new one if it doesn't exist.
+    The client keeps a connection pool sized for concurrent multipart uploads.
     """
-    global s3_client
-    if s3_client:
-        print("Already connected to S3")
-    else:
-        print("Connecting to S3")
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=AWS_ACCESS_KEY,
-            aws_secret_access_key=AWS_SECRET_KEY,
-            region_name=AWS_REGION
-        )
-        print("Connected to S3")
+    global s3_client, s3_transfer_config
+    with s3_client_lock:
+        if not s3_client:
+            logger.info("Connecting to S3")
+            s3_client = boto3.client(
+                's3',
+                aws_access_key_id=AWS_ACCESS_KEY,
+                aws_secret_access_key=AWS_SECRET_KEY,
+                region_name=AWS_REGION,
+                config=botocore.config.Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS)
+            )
+            s3_transfer_config = boto3.s3.transfer.TransferConfig(
+                multipart_threshold=S3_MULTIPART_THRESHOLD_MB * 1024 * 1024,
+                multipart_chunksize=S3_MULTIPART_CHUNKSIZE_MB * 1024 * 1024,
+                max_concurrency=S3_MAX_CONCURRENCY,
+                use_threads=True
+            )
+            logger.info("Connected to S3")
     return s3_client
 
 
+# connect to S3 at worker start
+def init_s3():
+    """
+    Creates the S3 client and opens a pooled connection to the bucket ahead of the first job,
+    so the first upload doesn't pay for client setup & the TLS handshake.
+    """
+    if not AWS_BUCKET_NAME:
+        logger.warning("S3 upload is enabled but AWS_BUCKET_NAME is not set")
+        return
+    try:
+        get_s3_client().head_bucket(Bucket=AWS_BUCKET_NAME)
+        logger.info(f"Warmed up S3 connection to bucket {AWS_BUCKET_NAME}")
+    except Exception as e:
+        logger.warning(f"Failed to warm up S3 connection: {str(e)}")
+
+
+# read-only file object over in-memory data
+class BufferReader(io.RawIOBase):
+    """
+    Seekable file object over a bytes-like buffer, letting S3 read upload parts
+    from in-memory image data without copying the whole buffer first.
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast("B")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), len(self._view) - self._position)
+        buffer[:size] = self._view[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
 # get path on filesystem of job output image
-def get_output_image_path(job_id):
+def get_output_image_path(job_id, image_index=1, branched=False):
+    """
+    Constructs and returns the filesystem path where ComfyUI will save an output image for a given job ID.
+    ComfyUI numbers the images of a batch from 1. Jobs with per-image seeds save each image from its own
+    sampler branch, branches after the first under the job's prefix suffixed with the branch index.
+    """
+    if branched and image_index > 1:
+        return f"{COMFYUI_PATH}/output/{COMFYUI_FILENAME_PREFIX}_{job_id}-{image_index - 1}_00001_.png"
+    return f"{COMFYUI_PATH}/output/{COMFYUI_FILENAME_PREFIX}_{job_id}_{image_index:05}_.png"
+
+
+# read job output image into memory
+def read_output_image(job_id, image_index=1, branched=False):
+    """
+    Reads an image file saved by ComfyUI for a given job into memory and removes the file.
+    """
+    image_path = get_output_image_path(job_id, image_index, branched)
+    if not os.path.exists(image_path):
+        raise FileNotFoundError(f"ERROR: Generated image not found at {image_path}")
+    with open(image_path, 'rb') as image_file:
+        image_data = image_file.read()
+    os.remove(image_path)
+    return image_data
+
+
+# delete the output files of a finished job
+def remove_job_files(job_id, num_images=1):
+    """
+    Deletes the image files ComfyUI saved for a job, if any are left after the job finished or failed.
+    """
+    paths = [
+        get_output_image_path(job_id, image_index, branched)
+        for image_index in range(1, num_images + 1)
+        for branched in [False, True]
+    ]
+    paths = list(dict.fromkeys(paths))
+    if retention_manager:
+        retention_manager.remove_files(paths)
+        return
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# get S3 key of job output image
+def get_upload_filename(job_id, output_format="png", image_index=None):
     """
-    Constructs and returns the filesystem path where ComfyUI will save the output image for a given job ID.
+    Returns the S3 key an output image is uploaded to, images of multi-image jobs are suffixed with their index.
     """
-    return f"{COMFYUI_PATH}/output/{COMFYUI_FILENAME_PREFIX}_{job_id}_00001_.png"
+    filename = f"{job_id}_{image_index}" if image_index else job_id
+    return f"{filename}.{get_extension(output_format)}"
+
+
+# get public URL of an S3 object
+def get_s3_url(key):
+    return f"https://{AWS_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{key}"
 
 
 # upload job output image to S3
-def upload_image(job_id):
+def upload_image(job_id, image_data=None, output_format="png", image_index=None, branched=False):
     """
     Uploads the generated image to AWS S3 if bucket is configured, returning the public URL.
+    Uploads the given in-memory image bytes if provided, otherwise the image file saved by ComfyUI.
+    The S3 key & content type follow the output format, images of multi-image jobs are suffixed with their index.
     Returns empty string if S3 upload is not enabled or fails.
     """
     if AWS_BUCKET_NAME and AWS_BUCKET_NAME != "":
-        image_path = get_output_image_path(job_id)
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"ERROR: Generated image not found at {image_path}")
-        print("Getting S3 client")
+        image_path = None
+        if image_data is None:
+            image_path = get_output_image_path(job_id, image_index or 1, branched)
+            if not os.path.exists(image_path):
+                raise FileNotFoundError(f"ERROR: Generated image not found at {image_path}")
         s3_client = get_s3_client()
         try:
-            filename = f"{job_id}.png"
-            print("Uploading image file to S3")
-            s3_client.upload_file(
-                image_path,
-                AWS_BUCKET_NAME,
-                filename,
-                ExtraArgs={
-                    'ContentType': 'image/png',
-                    'CacheControl': f"max-age={S3_CACHE_CONTROL_MAX_AGE}",
-                }
-            )
-            url = f"https://{AWS_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{filename}"
-            print(f"Uploaded image file to S3 at URL: {url}")
-            print(f"Removing image file at path: {image_path}")
-            os.remove(image_path)
+            filename = get_upload_filename(job_id, output_format, image_index)
+            extra_args = {
+                'ContentType': get_content_type(output_format),
+                'CacheControl': f"max-age={S3_CACHE_CONTROL_MAX_AGE}",
+            }
+            if image_path:
+                logger.debug("Uploading image file to S3")
+                s3_client.upload_file(
+                    image_path,
+                    AWS_BUCKET_NAME,
+                    filename,
+                    ExtraArgs=extra_args,
+                    Config=s3_transfer_config
+                )
+            else:
+                logger.debug("Uploading in-memory image to S3")
+                s3_client.upload_fileobj(
+                    BufferReader(image_data),
+                    AWS_BUCKET_NAME,
+                    filename,
+                    ExtraArgs=extra_args,
+                    Config=s3_transfer_config
+                )
+            url = get_s3_url(filename)
+            logger.info(f"Uploaded image file to S3 at URL: {url}")
+            if image_path:
+                logger.debug(f"Removing image file at path: {image_path}")
+                os.remove(image_path)
             return url
         except botocore.exceptions.ClientError as e:
-            print(f"ERROR: Error uploading to S3: {str(e)}")
-            print("Check if AWS creds are added in env variables, they might be missing")
+            logger.error(f"Error uploading to S3: {str(e)}")
+            logger.info("Check if AWS creds are added in env variables, they might be missing")
             raise
         except Exception as e:
-            print(f"ERROR: Unexpected error during upload: {str(e)}")
-            print("Check if AWS creds are added in env variables, they might be missing")
+            logger.error(f"Unexpected error during upload: {str(e)}")
+            logger.info("Check if AWS creds are added in env variables, they might be missing")
             raise
     return ""
 
 
+# base64 encode image data chunk by chunk
+def encode_base64(chunks, size):
+    """
+    Base64 encodes a stream of byte chunks of known total size into a string.
+    Chunks are encoded into a preallocated buffer, so the whole raw image, a copy of it
+    and the encoded string are never all held in memory at once.
+    """
+    encoded = bytearray(4 * ((size + 2) // 3))
+    offset = 0
+    pending = b""
+    for chunk in chunks:
+        if pending:
+            chunk = pending + bytes(chunk)
+        usable = len(chunk) - len(chunk) % 3
+        pending = bytes(chunk[usable:])
+        part = base64.b64encode(chunk[:usable])
+        encoded[offset:offset + len(part)] = part
+        offset += len(part)
+    if pending:
+        part = base64.b64encode(pending)
+        encoded[offset:offset + len(part)] = part
+    return encoded.decode('ascii')
+
+
+# read a file in chunks
+def read_chunks(path):
+    """
+    Yields the contents of a file in base64-aligned chunks.
+    """
+    with open(path, 'rb') as file:
+        while chunk := file.read(BASE64_CHUNK_SIZE):
+            yield chunk
+
+
+# split in-memory data into chunks without copying
+def memory_chunks(data):
+    """
+    Yields zero-copy slices of in-memory data in base64-aligned chunks.
+    """
+    view = memoryview(data)
+    for offset in range(0, len(view), BASE64_CHUNK_SIZE):
+        yield view[offset:offset + BASE64_CHUNK_SIZE]
+
+
 # get encoded job output image
-def get_base64_image(job_id):
+def get_base64_image(job_id, image_data=None, image_index=1, branched=False):
     """
-    Reads the output image for a given job and returns it as a base64-encoded string.
-    Returns empty string if image not found.
+    Returns an output image for a given job as a base64-encoded string, from the given
+    in-memory image bytes if provided, otherwise from the image file saved by ComfyUI.
     """
-    print("Converting image to base64")
-    image_path = get_output_image_path(job_id)
+    logger.debug("Converting image to base64")
+    if image_data is not None:
+        return encode_base64(memory_chunks(image_data), len(image_data))
+
+    image_path = get_output_image_path(job_id, image_index, branched)
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"ERROR: Generated image not found at {image_path}")
-    
-    with open(image_path, 'rb') as image_file:
-        # Read the binary image data
-        image_binary = image_file.read()
-        # Convert to base64 and decode to string (removing b'' prefix)
-        base64_string = base64.b64encode(image_binary).decode('utf-8')
-        return base64_string
-    
-    return ""
+    return encode_base64(read_chunks(image_path), os.path.getsize(image_path))
+
+
+# extract the image from a binary websocket frame
+def get_binary_frame_image(frame):
+    """
+    Returns a zero-copy view of the image bytes in a ComfyUI binary image frame,
+    or None if the frame isn't an image.
+    """
+    if len(frame) <= COMFYUI_BINARY_HEADER_SIZE:
+        return None
+    event_type = struct.unpack(">I", frame[:4])[0]
+    if event_type != COMFYUI_BINARY_EVENT_PREVIEW_IMAGE:
+        return None
+    return memoryview(frame)[COMFYUI_BINARY_HEADER_SIZE:]
+
+
+# download job output images listed in the comfyui history
+async def get_history_images(prompt_id, output_nodes):
+    """
+    Downloads the images of the given output nodes of a completed prompt into memory via /history & /view,
+    without guessing filenames or reading the output folder.
+    """
+    instance = get_prompt_instance(prompt_id)
+    history = (await comfyui_request(instance, "GET", f"/history/{prompt_id}")).get(prompt_id, {})
+    outputs = history.get("outputs", {})
+    images = []
+    session = get_comfyui_session(instance)
+    for node_id in output_nodes:
+        for image in outputs.get(node_id, {}).get("images", []):
+            params = {
+                "filename": image["filename"],
+                "subfolder": image.get("subfolder", ""),
+                "type": image.get("type", "output"),
+            }
+            async with session.get("/view", params=params) as response:
+                response.raise_for_status()
+                images.append(await response.read())
+    if not images:
+        raise RuntimeError(f"ERROR: No output images in ComfyUI history for prompt {prompt_id}")
+    return images
 
 
 # update serverless job progress status in Runpod
-def update_job(event, progress_percentage):
+def update_job(event, progress_percentage, eta_sec=None):
     """
-    Updates the job progress on Runpod with a percentage completion value.
+    Updates the job progress on Runpod with a percentage completion value, and the ETA if enabled.
     """
     if event:
-        runpod.serverless.progress_update(event, f"{progress_percentage}%")
+        progress = f"{progress_percentage}%"
+        if PROGRESS_INCLUDE_ETA and eta_sec is not None:
+            progress = f"{progress} (ETA {math.ceil(eta_sec)}s)"
+        runpod.serverless.progress_update(event, progress)
 
 
-# close any active ws connections
-def close_active_websockets():
+# open a comfyui instance's shared websocket
+def start_comfyui_socket(instance):
     """
-    Close any active WebSocket connections.
+    Open the worker's long-lived WebSocket connection to a ComfyUI instance.
+    The connection is shared by all jobs on the instance and reconnects automatically.
     """
-    global active_websockets
-    if active_websockets:
-        print("Cleaning up active WebSocket connections")
-        for ws in active_websockets.copy():
-            try:
-                asyncio.create_task(ws.close())
-                print("Closed WebSocket connection")
-            except Exception as e:
-                print(f"ERROR: Error closing WebSocket connection: {str(e)}")
-        active_websockets.clear()
+    if instance.socket is None:
+        instance.socket = ComfySocket(instance.ws_url, instance.client_id)
+    instance.socket.start()
 
 
-# launch a websocket listener for a comfyui job
-async def handle_websocket(prompt_id, job_id, job_event, workflow_data):
+# close a comfyui instance's shared websocket
+def stop_comfyui_socket(instance):
     """
-    Async WebSocket handler to monitor job status
+    Close an instance's shared WebSocket connection if it exists.
     """
-    global active_websockets
-    total_nodes = len(workflow_data.keys())
-    progress_per_node = float(100 / float(total_nodes))
-    nodes_seen = set()
-    
-    ws_url = f"{COMFYUI_WS_URL}?clientId={COMFYUI_CLIENT_ID}"
-    
-    async with websockets.connect(ws_url) as websocket:
-        if active_websockets == None:
-            active_websockets = set()
-        active_websockets.add(websocket)
-        try:
-            while True:
-                try:
-                    message = await websocket.recv()
-                    response = json.loads(message)
-                    
-                    if "type" not in response or "data" not in response:
-                        continue
-                        
-                    type = response['type']
-                    data = response['data']
-                    
-                    if "prompt_id" not in data or data["prompt_id"] != prompt_id:
-                        continue
-
-                    job_progress_percentage = 0
-                    
-                    if type in ["executing", "progress"]:
-                        if "node" in data and data["node"]:
-                            node_label = data["node"]
-                            nodes_seen.add(node_label)
-                            job_progress_percentage = float(100 * (float(len(nodes_seen)) - 1) / float(total_nodes))
-                            
-                            if 'max' in data and 'value' in data:
-                                curr_node_progress = float(data['value'])
-                                max_node_progress = float(data['max'])
-                                job_progress_percentage += float(progress_per_node * curr_node_progress / max_node_progress)
-                                
-                            job_progress_percentage = int(math.ceil(job_progress_percentage))
-                            print(f"Job {job_id} with prompt {prompt_id} is {job_progress_percentage}% done")
-                            update_job(job_event, job_progress_percentage)
-
-                    elif type == "execution_success":
-                        job_progress_percentage = 99
-                        print(f"ComfyUI generation for job {job_id} completed successfully")
-                        print(f"Job {job_id} with prompt {prompt_id} is {job_progress_percentage}% done")
-                        update_job(job_event, job_progress_percentage)
-                        return
-
-                    elif type == "execution_error":
-                        error_msg = data.get("error", "Unknown error occurred")
-                        print(f"ERROR: job {job_id} execution failed")
-                        print(error_msg)
-                        raise RuntimeError(error_msg)
-
-                except websockets.exceptions.ConnectionClosed:
-                    break
-                except Exception as e:
-                    print(f"WebSocket error: {str(e)}")
-                    raise
-        finally:
-            active_websockets.remove(websocket)
+    if instance.socket:
+        logger.info(f"Cleaning up WebSocket connection of {instance.name}")
+        instance.socket.stop()
+        instance.socket = None
+
+
+# probe comfyui health, sampling queue depth & vram headroom
+def probe_comfyui(instance):
+    """
+    Health probe run by an instance's supervisor thread. Raises if the instance is unhealthy, and refreshes
+    its capacity snapshot used by the concurrency modifier so that it never blocks on HTTP.
+    """
+    stats_response = requests.get(f"{instance.web_url}/system_stats", timeout=2)
+    stats_response.raise_for_status()
+    devices = stats_response.json().get("devices", [])
+    if instance.vram_total is None:
+        instance.vram_total = min((d["vram_total"] for d in devices if d.get("vram_total")), default=None)
+    if COMFYUI_MAX_CONCURRENCY <= 1:
+        return
+    queue_response = requests.get(f"{instance.web_url}/queue", timeout=2)
+    queue_response.raise_for_status()
+    queue_data = queue_response.json()
+    instance.capacity = {
+        "queue_running": len(queue_data.get("queue_running", [])),
+        "queue_pending": len(queue_data.get("queue_pending", [])),
+        "vram_free": min((d.get("vram_free", 0) for d in devices), default=None),
+        "updated_at": time.monotonic(),
+    }
+
+
+# start supervising a comfyui instance
+def start_comfyui_supervisor(instance):
+    """
+    Start a ComfyUI instance under a background supervisor that restarts it on crashes or hangs.
+    """
+    instance.supervisor = ComfySupervisor(
+        lambda: start_comfyui(instance),
+        lambda: stop_comfyui(instance),
+        lambda: probe_comfyui(instance),
+        instance.socket,
+        name=instance.name
+    )
+    instance.supervisor.start()
+
+
+# stop supervising a comfyui instance
+def stop_comfyui_supervisor(instance):
+    """
+    Stop an instance's supervisor so it doesn't restart ComfyUI during shutdown.
+    """
+    if instance.supervisor:
+        logger.info(f"Stopping {instance.name} supervisor ({instance.supervisor.status()})")
+        instance.supervisor.stop()
+
+
+# combine the capacity snapshots of the comfyui instances
+def get_comfyui_capacity():
+    """
+    Returns the capacity of the least busy ready instance with a fresh snapshot, or None if there is none.
+    The worker only backs off when every instance is under pressure.
+    """
+    now = time.monotonic()
+    snapshots = [
+        instance.capacity for instance in comfy_pool.get_ready()
+        if instance.capacity and now - instance.capacity["updated_at"] <= COMFYUI_CAPACITY_STALE_SEC
+    ]
+    if not snapshots:
+        return None
+    return min(snapshots, key=lambda capacity: (capacity["queue_pending"], -(capacity["vram_free"] or 0)))
+
+
+# decide how many jobs this worker accepts at once
+def concurrency_modifier(current_concurrency):
+    """
+    Returns the number of jobs Runpod should keep in flight on this worker.
+    Backs off to a single job under VRAM pressure or a deep ComfyUI queue, and returns
+    to the configured maximum once there is headroom again. Runpod drains in-flight jobs
+    before resizing, so the two thresholds are kept apart to avoid flapping.
+    """
+    if COMFYUI_MAX_CONCURRENCY <= 1:
+        return 1
+    capacity = get_comfyui_capacity() if comfy_pool else None
+    if not capacity:
+        return current_concurrency
+
+    min_free_vram = COMFYUI_MIN_FREE_VRAM_MB * 1024 * 1024
+    vram_free = capacity["vram_free"]
+    under_pressure = (
+        capacity["queue_pending"] >= COMFYUI_MAX_QUEUE_DEPTH or
+        (vram_free is not None and vram_free < min_free_vram)
+    )
+    has_headroom = (
+        capacity["queue_pending"] == 0 and
+        (vram_free is None or vram_free >= 2 * min_free_vram)
+    )
+
+    target_concurrency = current_concurrency
+    if under_pressure:
+        target_concurrency = 1
+    elif has_headroom:
+        target_concurrency = COMFYUI_MAX_CONCURRENCY
+    if target_concurrency != current_concurrency:
+        logger.info(f"Changing job concurrency from {current_concurrency} to {target_concurrency} (capacity: {capacity})")
+    return target_concurrency
+
+
+# check whether comfyui already finished a prompt
+async def is_prompt_complete(prompt_id):
+    """
+    Look up a prompt in the ComfyUI history, used to recover events missed during a reconnect.
+    Raises if ComfyUI reported an execution error for the prompt.
+    """
+    history = (await comfyui_request(get_prompt_instance(prompt_id), "GET", f"/history/{prompt_id}")).get(prompt_id)
+    if not history:
+        return False
+    status = history.get("status", {})
+    if status.get("status_str") == "error":
+        raise RuntimeError(f"ERROR: ComfyUI prompt {prompt_id} failed")
+    return status.get("completed", False)
+
+
+# follow a comfyui job's events on the shared websocket
+async def handle_websocket(prompt_id, job_id, progress, events, output_nodes, preview_nodes=None, on_preview=None):
+    """
+    Async handler consuming the job's routed WebSocket events to monitor job status.
+    Execution events update the job's progress reporter, and latent previews of the given
+    nodes are passed to on_preview if given.
+    Returns the images received over the WebSocket from the job's own output nodes, if any,
+    in the order of the output nodes, since ComfyUI doesn't run output nodes in a fixed order.
+    """
+    images = {}  # Output node ID -> images in the order the node sent them
+
+    while True:
+        response = await events.get()
+        type = response['type']
+        data = response['data']
+
+        if type == "binary":
+            if data["node"] in output_nodes:
+                image = get_binary_frame_image(data["bytes"])
+                if image is not None:
+                    images.setdefault(data["node"], []).append(image)
+            elif on_preview and data["node"] in preview_nodes:
+                image = get_binary_frame_image(data["bytes"])
+                if image is not None:
+                    on_preview(image)
+
+        elif type in ["executing", "progress", "execution_cached"]:
+            if progress.on_event(type, data):
+                logger.debug(f"Job {job_id} with prompt {prompt_id} is {progress.progress}% done, ETA {progress.eta_sec:.1f} seconds")
+
+        elif type == "execution_success":
+            progress.on_event(type, data)
+            logger.info(f"ComfyUI generation for job {job_id} completed successfully")
+            logger.debug(f"Job {job_id} with prompt {prompt_id} is {progress.progress}% done")
+            return [image for node_id in output_nodes for image in images.get(node_id, [])]
+
+        elif type == "execution_error":
+            error_msg = data.get("exception_message", data.get("error", "Unknown error occurred"))
+            logger.error(f"job {job_id} execution failed")
+            logger.info(error_msg)
+            raise RuntimeError(error_msg)
+
+        elif type == "execution_interrupted":
+            raise RuntimeError(f"ERROR: ComfyUI prompt {prompt_id} was interrupted")
+
+        elif type == "worker_error":
+            raise RuntimeError(f"ERROR: {data['message']}")
+
+        elif type == "reconnected":
+            # Completion events may have been lost while the socket was down
+            if await is_prompt_complete(prompt_id):
+                logger.info(f"ComfyUI generation for job {job_id} completed while WebSocket was reconnecting")
+                if COMFYUI_OUTPUT_MODE == "websocket":
+                    raise RuntimeError(f"ERROR: WebSocket output images for job {job_id} were lost while reconnecting")
+                return []
+
+
+# look up a job's result in the result cache
+def get_cached_result(cache_key, job_id, num_images, output_format):
+    """
+    Returns the cached result of a job as S3 URLs or base64 images, one per image, or None on a cache miss.
+    With S3 upload enabled, results in the S3 tier are returned by URL without transferring them,
+    results in the local tier are uploaded under the job ID.
+    """
+    extension = get_extension(output_format)
+    if ENABLE_S3_UPLOAD:
+        size = result_cache.get_s3_size(cache_key, num_images, extension)
+        if size is not None:
+            result_cache.record_hit("s3", size)
+            return [
+                get_s3_url(result_cache.get_s3_key(cache_key, image_index, extension))
+                for image_index in range(1, num_images + 1)
+            ]
+
+    tier = "local"
+    images = result_cache.get_local(cache_key, num_images, extension)
+    if images is None and not ENABLE_S3_UPLOAD:
+        tier = "s3"
+        images = result_cache.get_s3(cache_key, num_images, extension)
+        if images is not None:
+            for image_index, image_data in enumerate(images, start=1):
+                result_cache.put_local(cache_key, image_index, extension, image_data)
+    if images is None:
+        result_cache.record_miss()
+        return None
+
+    result_cache.record_hit(tier, sum(len(image_data) for image_data in images))
+    if ENABLE_S3_UPLOAD:
+        return [
+            upload_image(job_id, image_data, output_format, image_index if num_images > 1 else None)
+            for image_index, image_data in enumerate(images, start=1)
+        ]
+    return [get_base64_image(job_id, image_data) for image_data in images]
+
+
+# store a job output image in the result cache
+def store_result_image(cache_key, job_id, image_index, image_data, output_format, num_images):
+    """
+    Stores an encoded output image in the local tier and the S3 tier of the result cache.
+    With S3 upload enabled, the uploaded image is copied into the S3 tier server-side.
+    Failures are logged without failing the job.
+    """
+    extension = get_extension(output_format)
+    try:
+        result_cache.put_local(cache_key, image_index, extension, image_data)
+        if ENABLE_S3_UPLOAD:
+            source_key = get_upload_filename(job_id, output_format, image_index if num_images > 1 else None)
+            result_cache.put_s3(cache_key, image_index, extension, source_key=source_key)
+        else:
+            result_cache.put_s3(cache_key, image_index, extension, image_data=image_data, extra_args={
+                'ContentType': get_content_type(output_format),
+                'CacheControl': f"max-age={S3_CACHE_CONTROL_MAX_AGE}",
+            })
+    except Exception as e:
+        logger.warning(f"Failed to cache output {image_index} of job {job_id}: {str(e)}")
+
+
+# get the comfyui instance a prompt was queued to
+def get_prompt_instance(prompt_id):
+    instance = comfy_pool.get(prompt_id)
+    if instance is None:
+        raise RuntimeError(f"ERROR: Prompt {prompt_id} is not queued to any ComfyUI instance")
+    return instance
+
+
+# stop routing a prompt's events to a job event queue
+def unsubscribe_prompt(prompt_id, events):
+    """
+    Unsubscribe a job event queue from a prompt on the instance it was queued to,
+    or on every instance if the prompt was already released.
+    """
+    instance = comfy_pool.get(prompt_id)
+    for instance in [instance] if instance else comfy_pool:
+        if instance.socket:
+            instance.socket.unsubscribe(prompt_id, events)
+
+
+# size the tiles of tiled vae nodes for a comfyui instance
+def apply_vae_tile_size(workflow_data, tile_size):
+    """
+    Returns the workflow with the tile size of the tiled VAE decodes & encodes its template left to the worker
+    set for the instance it is queued to. Tile sizes set by the workflow itself, e.g. in JSON workflows, are kept.
+    """
+    patches = {}
+    for node_id in get_auto_tile_size_nodes(workflow_data):
+        if workflow_data[node_id]["inputs"].get("tile_size") != tile_size:
+            patches[(node_id, "tile_size")] = tile_size
+            patches[(node_id, "overlap")] = tile_size // 8
+    return patch_workflow(workflow_data, patches) if patches else workflow_data
+
+
+# find the tiled vae nodes the worker sizes
+def get_auto_tile_size_nodes(workflow_data):
+    return [node_id for node_id, node in workflow_data.items() if node.get("_meta", {}).get(AUTO_TILE_SIZE_META)]
+
+
+# get the result cache key of a job's graph
+def get_result_cache_key(workflow_data, output_format, quality, instance=None):
+    """
+    Returns the result cache key of a job's graph with its worker-sized VAE tiles as on the given instance,
+    or as on every ready instance if they agree, since the tile size changes the output's pixels.
+    Returns None while the tile size a prompt would get isn't known.
+    """
+    if get_auto_tile_size_nodes(workflow_data):
+        instances = [instance] if instance else comfy_pool.get_ready()
+        tile_sizes = {candidate.get_vae_tile_size() for candidate in instances}
+        if len(tile_sizes) != 1:
+            return None
+        workflow_data = apply_vae_tile_size(workflow_data, tile_sizes.pop())
+    return get_cache_key(workflow_data, output_format, quality)
+
+
+# queue a prompt with job event queues subscribed to it
+async def queue_subscribed_prompt(workflow_data, event_queues, instance=None):
+    """
+    Queue a prompt with the given job event queues subscribed to its events before it is queued,
+    to the given ComfyUI instance or the one the pool picks for the prompt's checkpoints.
+    Returns the prompt ID.
+    """
+    checkpoints = get_checkpoints(workflow_data)
+    if instance is None:
+        instance = comfy_pool.pick(checkpoints)
+        if instance is None:
+            raise RuntimeError("ERROR: No ComfyUI instance is ready")
+    workflow_data = apply_vae_tile_size(workflow_data, instance.get_vae_tile_size())
+    loop = asyncio.get_running_loop()
+    prompt_id = str(uuid.uuid4())
+    for events in event_queues:
+        instance.socket.subscribe(prompt_id, events, loop)
+    # Count the prompt against the instance before queuing it, so concurrent jobs spread across instances
+    comfy_pool.assign(prompt_id, instance, checkpoints)
+    try:
+        queued_prompt_id = await queue_prompt(instance, workflow_data, prompt_id)
+    except Exception:
+        for events in event_queues:
+            instance.socket.unsubscribe(prompt_id, events)
+        comfy_pool.release(prompt_id)
+        raise
+    if queued_prompt_id != prompt_id:
+        # Older ComfyUI versions ignore client-provided prompt IDs
+        for events in event_queues:
+            instance.socket.subscribe(queued_prompt_id, events, loop)
+            instance.socket.unsubscribe(prompt_id, events)
+        comfy_pool.rename(prompt_id, queued_prompt_id)
+    if len(comfy_pool) > 1:
+        logger.debug(f"Queued prompt {queued_prompt_id} to {instance.name} ({len(instance.prompts)} prompts)")
+    return queued_prompt_id
+
+
+# queue a prompt through the model scheduler if enabled
+async def queue_scheduled_prompt(workflow_data, event_queues):
+    """
+    Queue a prompt with the given job event queues subscribed to it, once the model scheduler
+    picks it if scheduling is enabled. Returns the prompt ID.
+    """
+    if model_scheduler:
+        return await model_scheduler.submit(workflow_data, event_queues)
+    return await queue_subscribed_prompt(workflow_data, event_queues)
+
+
+# wait for a scheduled prompt to finish
+async def wait_scheduled_prompt(prompt_id, events):
+    """
+    Wait until a prompt queued by the model scheduler finished, bounded by the job timeout.
+    """
+    try:
+        await asyncio.wait_for(wait_for_prompt(prompt_id, events), timeout=COMFYUI_JOB_TIMEOUT_SEC)
+    finally:
+        unsubscribe_prompt(prompt_id, events)
+
+
+# remove or interrupt a prompt in comfyui
+async def cancel_prompt(prompt_id):
+    """
+    Deletes a prompt from the ComfyUI queue if it is still pending, or interrupts it if it is running.
+    Subscribers of a deleted prompt get an interrupted event, since ComfyUI sends none.
+    Returns "pending" or "running", or None if the prompt had already finished.
+    """
+    instance = comfy_pool.get(prompt_id)
+    if instance is None:
+        return None
+    queue = await comfyui_request(instance, "GET", "/queue")
+    if any(item[1] == prompt_id for item in queue.get("queue_pending", [])):
+        await comfyui_request(instance, "POST", "/queue", json={"delete": [prompt_id]})
+        instance.socket.publish(prompt_id, {"type": "execution_interrupted", "data": {"prompt_id": prompt_id}})
+        return "pending"
+    if any(item[1] == prompt_id for item in queue.get("queue_running", [])):
+        # Recent ComfyUI versions only interrupt the given prompt, older ones whatever is running
+        await comfyui_request(instance, "POST", "/interrupt", json={"prompt_id": prompt_id})
+        return "running"
+    return None
+
+
+# stop the work of a prompt no job waits for anymore
+async def cancel_abandoned_prompt(prompt_id, started_at=None):
+    """
+    Cancels a prompt whose jobs timed out, failed or were cancelled, so it stops using the GPU and
+    doesn't hold up later jobs. Counts the GPU seconds a running prompt had used since the given
+    monotonic start time. Failures are logged without raising.
+    """
+    try:
+        state = await asyncio.wait_for(cancel_prompt(prompt_id), timeout=COMFYUI_CANCEL_TIMEOUT_SEC)
+    except Exception as e:
+        logger.warning(f"Failed to cancel prompt {prompt_id}: {str(e)}")
+        return
+    if state is None:
+        return
+    gpu_sec = time.monotonic() - started_at if state == "running" and started_at else 0.0
+    cancelled_prompts[state] += 1
+    cancelled_prompts["gpu_sec"] += gpu_sec
+    if job_metrics:
+        job_metrics.observe_cancelled(state, gpu_sec)
+    logger.info(f"Cancelled {state} prompt {prompt_id}{f' after {gpu_sec:.1f} GPU seconds' if gpu_sec else ''}")
+
+
+# let go of a prompt queued for jobs that are gone
+async def abandon_prompt(prompt_id, event_queues, cancel):
+    """
+    Unsubscribes the event queues of jobs cancelled while their prompt was being queued,
+    and cancels the prompt if no other job holds it.
+    """
+    for events in event_queues:
+        unsubscribe_prompt(prompt_id, events)
+    if cancel:
+        await cancel_abandoned_prompt(prompt_id)
+        comfy_pool.release(prompt_id)
+
+
+# fetch a job's input images
+async def fetch_input_images(sources):
+    """
+    Downloads or decodes the given input image sources, by name, concurrently.
+    Returns the fetched InputImages by name, the caller closes them.
+    """
+    session = get_download_session() if any(source.startswith(("http://", "https://")) for source in sources.values()) else None
+    results = await asyncio.gather(*[
+        fetch_image(
+            source,
+            session,
+            run_blocking,
+            int(INPUT_IMAGE_MAX_MB * 1024 * 1024),
+            int(INPUT_IMAGE_MAX_MEGAPIXELS * 1000000)
+        )
+        for source in sources.values()
+    ], return_exceptions=True)
+    images = dict(zip(sources.keys(), results))
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        close_input_images(images)
+        raise errors[0]
+    for name, image in images.items():
+        logger.debug(f"Fetched input {name} {image.filename} ({image.width}x{image.height}, {image.size} bytes)")
+    return images
+
+
+# close a job's fetched input images
+def close_input_images(images):
+    for image in (images or {}).values():
+        if not isinstance(image, BaseException):
+            image.close()
+
+
+# upload an input image to comfyui's input folder
+async def upload_input_image(image):
+    """
+    Uploads an input image to ComfyUI under its content hash, streamed from its buffer.
+    """
+    def form():
+        image.file.seek(0)
+        data = aiohttp.FormData()
+        data.add_field("image", image.file, filename=image.filename, content_type=image.content_type)
+        data.add_field("type", "input")
+        data.add_field("overwrite", "true")
+        return data
+    # Instances share the input folder, so any of them can take the upload
+    instance = comfy_pool.pick()
+    if instance is None:
+        raise RuntimeError("ERROR: No ComfyUI instance is ready")
+    response = await comfyui_request(instance, "POST", "/upload/image", data=form)
+    if response.get("name") != image.filename:
+        raise RuntimeError(f"ERROR: ComfyUI stored input image {image.filename} as {response.get('name')}")
+    logger.debug(f"Uploaded input image {image.filename} ({image.size} bytes)")
+
+
+# make sure comfyui has a job's input images
+async def upload_input_images(images):
+    """
+    Uploads the input images ComfyUI doesn't have yet, concurrently. Images it already has are marked
+    as recently used, so the retention budget deletes them last.
+    """
+    global input_upload_cache
+    if input_upload_cache is None:
+        input_upload_cache = UploadCache(f"{COMFYUI_PATH}/input", INPUT_IMAGE_UPLOAD_CACHE_SIZE)
+    skipped = await asyncio.gather(*[input_upload_cache.ensure(image, upload_input_image) for image in images.values()])
+    if retention_manager:
+        reused = [input_upload_cache.get_path(image.filename) for image, skip in zip(images.values(), skipped) if skip]
+        if reused:
+            await run_blocking(retention_manager.touch, reused)
+
+
+# queue a job's workflow, coalesced with compatible jobs if enabled
+async def submit_prompt(workflow_data, events, coalesce_key):
+    """
+    Queue a job's workflow to ComfyUI, merged with compatible concurrent jobs when coalescing is enabled.
+    Returns the prompt ID, the queued workflow and the IDs of the job's output nodes in it.
+    """
+    if prompt_coalescer:
+        return await prompt_coalescer.submit(coalesce_key, workflow_data, events)
+    prompt_id = await queue_scheduled_prompt(workflow_data, [events])
+    return prompt_id, workflow_data, get_output_nodes(workflow_data)
 
 
 # process an image generation job via comfyui
-async def process_job(user_prompt, workflow, aspect_ratio, job_id, job_event):
+async def process_job(user_prompt, workflow, aspect_ratio, job_id, job_event, output_format="png", quality=None, num_images=1, seeds=None, timings=None, input_images=None, denoise=None, stream=None):
     """
     Processes a single image generation job by starting ComfyUI, queuing the prompt with the specified workflow,
     monitoring execution via WebSocket, and returning either an S3 URL or base64 image data on completion.
+    Images are re-encoded into the requested output format first, unless it is PNG.
+    Multi-image jobs generate all images in one prompt and return a list, finishing the images in parallel.
+    Jobs with explicit seeds are deterministic, their results are served from the result cache if enabled.
+    Fetched input images, by name, are uploaded to ComfyUI unless it already has them.
+    Progress & latent previews are also added to the given stream, if any.
+    The time spent in each stage of the job is added to the given timings.
     """
-    print(f"Starting job {job_id}")
-    # Ensure ComfyUI is running
-    print("Checking if ComfyUI is running at job start")
-    start_comfyui()
-    wait_for_comfyui()
+    logger.info(f"Starting job {job_id}")
+    if timings is None:
+        timings = JobTimings()
     
     # Process the request
+    prompt_id = None
+    progress = None
+    completed = False  # The prompt finished executing
+    finished = False  # The job's result is returned
+    model_files = None  # Models pinned in the staging cache
+    events = asyncio.Queue()
     try:
 
-        workflow_data = workflow.load(
-            user_prompt,
-            aspect_ratio,
-            job_id,
-            COMFYUI_FILENAME_PREFIX
-        )
+        # Only img2img & inpainting workflows take input images
+        load_kwargs = {}
+        if input_images:
+            load_kwargs["input_images"] = {name: image.filename for name, image in input_images.items()}
+            load_kwargs["denoise"] = denoise
+        with timings.measure("graph_build"):
+            workflow_data = workflow.load(
+                user_prompt,
+                aspect_ratio,
+                job_id,
+                COMFYUI_FILENAME_PREFIX,
+                output_mode=COMFYUI_OUTPUT_MODE,
+                num_images=num_images,
+                seeds=seeds,
+                **load_kwargs
+            )
 
-        prompt_id = queue_prompt(
-            user_prompt,
-            workflow_data
-        )
+        # Copy the job's models to local disk in the background for later jobs,
+        # the staged copies the prompt may load are kept until it is done
+        if model_stager:
+            model_files = get_model_files(workflow_data)
+            model_stager.pin(model_files)
+            for folder, filename in model_files:
+                model_stager.stage(folder, filename)
+
+        cache_key = None
+        if result_cache and seeds:
+            cache_key = get_result_cache_key(workflow_data, output_format, quality)
+        if cache_key:
+            with timings.measure("cache_lookup"):
+                results = await run_blocking(get_cached_result, cache_key, job_id, num_images, output_format)
+            if results is not None:
+                logger.info(f"Completed job {job_id} from result cache {cache_key}")
+                return results if num_images > 1 else results[0]
+
+        # Ensure ComfyUI is running
+        logger.debug("Checking if ComfyUI is running at job start")
+        with timings.measure("health_check"):
+            await ensure_comfyui()
+
+        if input_images:
+            with timings.measure("input_upload"):
+                await upload_input_images(input_images)
+
+        sanitized_prompt = str(user_prompt).encode('unicode_escape').decode('utf-8')
+        logger.debug(f"Queueing prompt {sanitized_prompt}")
+        with timings.measure("queue_prompt"):
+            prompt_id, queued_workflow_data, output_nodes = await submit_prompt(
+                workflow_data,
+                events,
+                (workflow.__name__, aspect_ratio)
+            )
+        queued_at = time.monotonic()
+        if result_cache and seeds:
+            # Key the result by the tile size of the instance the prompt was routed to
+            cache_key = get_result_cache_key(workflow_data, output_format, quality, comfy_pool.get(prompt_id))
+        workflow_data = queued_workflow_data
         
-        await asyncio.wait_for(
-            handle_websocket(prompt_id, job_id, job_event, workflow_data),
+        # Report progress from a background task, rate limited
+        async def send_progress(progress_percentage, eta_sec):
+            if stream:
+                stream.put_progress(progress_percentage, eta_sec)
+            await run_blocking(update_job, job_event, progress_percentage, eta_sec)
+        progress = ProgressReporter(
+            send_progress,
+            (workflow.__name__, aspect_ratio, num_images),
+            workflow_data,
+            stage_timings,
+            PROGRESS_MIN_INTERVAL_SEC
+        )
+
+        # Only previews of the job's own samplers, merged prompts run other jobs' samplers too
+        preview_nodes = get_ancestor_nodes(workflow_data, output_nodes) if stream else None
+        images = await asyncio.wait_for(
+            handle_websocket(
+                prompt_id,
+                job_id,
+                progress,
+                events,
+                output_nodes,
+                preview_nodes,
+                stream.put_preview if stream else None
+            ),
             timeout=COMFYUI_JOB_TIMEOUT_SEC
         )
+        completed = True
+        if progress.started_at is not None:
+            timings.add("queue_wait", max(0.0, progress.started_at - queued_at))
+        timings.add_nodes(progress.node_seconds)
 
-        result = None
-        if ENABLE_S3_UPLOAD:
-            image_url = upload_image(
-                job_id
-            )
-            result = image_url
+        # In-memory image bytes, or None to read the image files saved by ComfyUI
+        branched = bool(seeds) and len(seeds) > 1
+        if COMFYUI_OUTPUT_MODE == "websocket":
+            if len(images) < num_images:
+                raise RuntimeError(f"ERROR: Received {len(images)} of {num_images} output images over WebSocket for job {job_id}")
+        elif COMFYUI_OUTPUT_MODE == "history":
+            with timings.measure("output_retrieval"):
+                images = await get_history_images(prompt_id, output_nodes)
         else:
-            base64_image_data =  get_base64_image(
-                job_id
-            )
-            result = base64_image_data
+            images = [None] * num_images
 
-        print(f"Completed job {job_id}")
+        # Encode & upload a single output image
+        async def finish_image(image_index, image_data):
+            if image_data is None and (cache_key or output_format != "png"):
+                with timings.measure("output_retrieval"):
+                    image_data = await run_blocking(read_output_image, job_id, image_index, branched)
+            if output_format != "png":
+                png_size = len(image_data)
+                with timings.measure("encode"):
+                    image_data, encode_time = await run_encode(encode_image, image_data, output_format, quality)
+                logger.info(f"Encoded job {job_id} output {image_index} as {output_format} (quality {quality}) in {encode_time:.3f} seconds, {png_size} -> {len(image_data)} bytes")
+            if image_data is None:
+                # PNG files saved by ComfyUI are uploaded or encoded straight from disk
+                output_size = await run_blocking(os.path.getsize, get_output_image_path(job_id, image_index, branched))
+            else:
+                output_size = len(image_data)
+            timings.add_output(output_format, output_size)
+
+            if ENABLE_S3_UPLOAD:
+                with timings.measure("upload"):
+                    result = await run_blocking(
+                        upload_image,
+                        job_id,
+                        image_data,
+                        output_format,
+                        image_index if num_images > 1 else None,
+                        branched
+                    )
+            else:
+                # Reads the saved image file while encoding if it wasn't read yet
+                with timings.measure("base64"):
+                    result = await run_blocking(
+                        get_base64_image,
+                        job_id,
+                        image_data,
+                        image_index,
+                        branched
+                    )
+            if cache_key:
+                await run_blocking(store_result_image, cache_key, job_id, image_index, image_data, output_format, num_images)
+            return result
+
+        results = await asyncio.gather(*[
+            finish_image(image_index, image_data)
+            for image_index, image_data in enumerate(images[:num_images], start=1)
+        ])
+        result = results if num_images > 1 else results[0]
+
+        logger.info(f"Completed job {job_id}")
+        finished = True
         return result
             
     except asyncio.TimeoutError:
         raise TimeoutError(f"ERROR: ComfyUI prompt request timed out after {COMFYUI_JOB_TIMEOUT_SEC} seconds")
+    finally:
+        if stream:
+            stream.close()
+        if progress:
+            await progress.close(finished)
+        if prompt_id:
+            unsubscribe_prompt(prompt_id, events)
+            # A merged prompt is only cancelled once none of its jobs wait for it
+            last_holder = prompt_coalescer.release(prompt_id) if prompt_coalescer else True
+            if not completed and last_holder:
+                await cancel_abandoned_prompt(prompt_id, progress.started_at if progress else None)
+            if last_holder:
+                comfy_pool.release(prompt_id)
+            await run_blocking(remove_job_files, job_id, num_images)
+        if model_files is not None and model_stager:
+            model_stager.unpin(model_files)
+
+
+# get the metrics label of a job's aspect ratio
+def get_aspect_ratio_label(aspect_ratio):
+    """
+    Returns a job's aspect ratio as one of the known "W_H" ratios, so "16:9" and "16_9" share a label,
+    or "other" for invalid & uncommon ratios, so client input can't add metric series.
+    """
+    try:
+        width_ratio, height_ratio = map(int, aspect_ratio.replace(':', '_').split('_'))
+    except (AttributeError, ValueError):
+        return "other"
+    aspect_ratio = f"{width_ratio}_{height_ratio}"
+    return aspect_ratio if aspect_ratio in ASPECT_RATIOS else "other"
 
 
 # main runpod serverless function handler
-async def handler(event):
+async def handler(event, stream=None):
     """
-    Async RunPod handler function
+    Async RunPod handler function, adding progress & previews to the given stream if any
     """
     if HEALTH_CHECK_MODE:
         return "OK"
     
-    print("Received request for inference")
-    print(event)
+    logger.info("Received request for inference")
+    logger.debug(event)
+    start_time = time.monotonic()
         
     try:
         if 'id' not in event:
             raise RuntimeError("ERROR: missing 'id' field in runpod handler request")
         job_id = event["id"]
+        job_id_var.set(job_id)
 
-        print(f"Processing Runpod job ID: {job_id}")
+        logger.info(f"Processing Runpod job ID: {job_id}")
 
         if 'input' not in event:
             raise RuntimeError("ERROR: missing 'input' field in runpod handler request")
@@ -509,38 +1641,398 @@ async def handler(event):
         if 'workflow' in event['input']:
             workflow = get_workflow(event["input"]["workflow"])
 
-        aspect_ratio = "1_1"
-        if 'aspect_ratio' in event['input']:
-            aspect_ratio = event["input"]["aspect_ratio"]
-        
-        return await process_job(prompt, workflow, aspect_ratio, job_id, event)
+        # Input images, as URLs or base64, for workflows that take them
+        workflow_input_images = getattr(workflow.load, "input_images", [])
+        input_sources = {name: event["input"][name] for name in INPUT_IMAGE_NAMES if event["input"].get(name) is not None}
+        for name in input_sources:
+            if name not in workflow_input_images:
+                raise RuntimeError(f"ERROR: Workflow doesn't take an 'input.{name}' image")
+        for name in workflow_input_images:
+            if name not in input_sources:
+                raise RuntimeError(f"ERROR: missing 'input.{name}' field, an image URL or base64 string")
+        denoise = event["input"].get("denoise")
+        if denoise is not None:
+            if not workflow_input_images:
+                raise RuntimeError("ERROR: 'input.denoise' is only supported by img2img & inpainting workflows")
+            denoise = float(denoise)
+            if denoise <= 0 or denoise > 1:
+                raise RuntimeError("ERROR: 'input.denoise' must be greater than 0 and at most 1")
+
+        output_format, quality = parse_output_format(
+            event["input"].get("output_format"),
+            event["input"].get("quality")
+        )
+
+        seeds = event["input"].get("seeds")
+        if seeds is None and event["input"].get("seed") is not None:
+            seeds = [int(event["input"]["seed"])]
+        if seeds is not None:
+            if not isinstance(seeds, list) or not seeds:
+                raise RuntimeError("ERROR: 'input.seeds' must be a non-empty list of integers")
+            seeds = [int(seed) for seed in seeds]
+        num_images = int(event["input"].get("num_images", len(seeds) if seeds else 1))
+        if num_images < 1 or num_images > COMFYUI_MAX_NUM_IMAGES:
+            raise RuntimeError(f"ERROR: 'input.num_images' must be between 1 and {COMFYUI_MAX_NUM_IMAGES}")
+        if seeds and len(seeds) not in [1, num_images]:
+            raise RuntimeError("ERROR: 'input.seeds' must have one seed, or one seed per image")
+        return_timings = bool(event["input"].get("return_timings", False))
+
+        workflow_name = workflow.__name__.rsplit(".", 1)[-1]
+        timings = JobTimings()
+        aspect_ratio = event["input"].get("aspect_ratio")
+        input_images = None
+        try:
+            if input_sources:
+                with timings.measure("input_fetch"):
+                    input_images = await fetch_input_images(input_sources)
+                # Keep the input image's shape unless asked otherwise
+                if aspect_ratio is None:
+                    aspect_ratio = get_image_aspect_ratio(input_images["image"].width, input_images["image"].height)
+            aspect_ratio = aspect_ratio or "1_1"
+            result = await process_job(prompt, workflow, aspect_ratio, job_id, event, output_format, quality, num_images, seeds, timings, input_images, denoise, stream)
+        except Exception:
+            if job_metrics:
+                job_metrics.observe(workflow_name, get_aspect_ratio_label(aspect_ratio or "1_1"), timings, status="error")
+            raise
+        finally:
+            close_input_images(input_images)
+        if job_metrics:
+            # The workflow validated the aspect ratio when it sized the image
+            job_metrics.observe(workflow_name, get_aspect_ratio_label(aspect_ratio), timings)
+        if return_timings:
+            return {"result": result, "timings": timings.to_dict()}
+        return result
             
     except Exception as e:
-        print(f"ERROR: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception(f"{str(e)}")
+        if isinstance(e, OSError) and e.errno == errno.ENOSPC and retention_manager:
+            retention_manager.request_sweep()
+        # ComfyUI output around the failure, shared by all in-flight jobs of the worker
+        comfyui_output = get_recent_output(start_time)[-ERROR_DETAILS_LINES:]
+        if comfyui_output:
+            logger.error("Recent ComfyUI output:\n" + "\n".join(comfyui_output))
+        if RETURN_ERROR_DETAILS:
+            return {"error": str(e), "comfyui_output": comfyui_output}
         return "ERROR"
     
 
+# upload a latent preview for streaming to S3
+def upload_stream_preview(job_id, preview_index, preview):
+    """
+    Uploads a streamed preview JPEG next to the job's outputs and returns its public URL.
+    """
+    key = f"{job_id}_preview_{preview_index}.jpg"
+    get_s3_client().put_object(
+        Bucket=AWS_BUCKET_NAME,
+        Key=key,
+        Body=preview,
+        ContentType="image/jpeg",
+        CacheControl=f"max-age={S3_CACHE_CONTROL_MAX_AGE}"
+    )
+    return get_s3_url(key)
+
+
+# encode & upload a latent preview for streaming
+async def encode_stream_preview(job_id, preview_index, image_data):
+    preview = await run_encode(encode_preview, image_data, STREAM_PREVIEW_MAX_SIZE, STREAM_PREVIEW_QUALITY)
+    return await run_blocking(upload_stream_preview, job_id, preview_index, preview)
+
+
+# streaming runpod serverless function handler
+async def stream_handler(event):
+    """
+    Async generator RunPod handler, yielding the job's progress & throttled latent previews while it runs,
+    then its result. Previews are uploaded to S3 and streamed as URLs, so the aggregated job output stays
+    small. They are skipped without S3 upload, or if the job sets "previews" to false.
+    """
+    job_input = event.get("input") if isinstance(event.get("input"), dict) else {}
+    job_id = event.get("id") or str(uuid.uuid4())
+    preview_indexes = itertools.count(1)
+    previews = bool(job_input.get("previews", True)) and ENABLE_S3_UPLOAD and bool(AWS_BUCKET_NAME)
+    stream = JobStream(
+        lambda image_data: encode_stream_preview(job_id, next(preview_indexes), image_data),
+        STREAM_PREVIEW_INTERVAL_SEC,
+        previews
+    )
+    job = asyncio.ensure_future(handler(event, stream))
+    try:
+        async for update in stream.updates(job):
+            yield update
+        result = await job
+    finally:
+        # The client went away, cancel the job & its prompt
+        if not job.done():
+            job.cancel()
+    logger.debug(f"Streamed {stream.previews_sent} previews, dropped {stream.previews_dropped}")
+    if result == "ERROR":
+        yield {"type": "error", "error": result}
+    elif isinstance(result, dict) and "error" in result:
+        yield {"type": "error", **result}
+    else:
+        yield {"type": "result", "result": result}
+
+
 # initialize runpod serverless function
 def init_runpod():
     """
-    Starts the Runpod serverless handler with the async handler function.
+    Starts the Runpod serverless handler with the async handler function, or the streaming
+    generator handler if enabled. Streamed updates are also aggregated into the job's output,
+    so /run & /runsync clients still get the result, as its last update.
+    """
+    logger.info(f"Starting Runpod serverless handler{' with streaming' if ENABLE_STREAMING else ''}")
+    if ENABLE_STREAMING:
+        runpod.serverless.start({
+            "handler": stream_handler,
+            "concurrency_modifier": concurrency_modifier,
+            "return_aggregate_stream": True,
+        })
+        return
+    runpod.serverless.start({
+        "handler": handler,
+        "concurrency_modifier": concurrency_modifier,
+    })
+
+
+# start serving job metrics
+def start_metrics_server():
+    """
+    Aggregates job stage timings and serves them in Prometheus format from a local HTTP endpoint.
     """
-    print("Starting Runpod serverless handler")
-    runpod.serverless.start({ "handler": handler })
+    global job_metrics, metrics_server
+    job_metrics = JobMetrics()
+    metrics_server = MetricsServer(job_metrics.render, METRICS_HOST, METRICS_PORT)
+    metrics_server.start()
 
 
-# initialize comfyui background process
+# stop serving job metrics
+def stop_metrics_server():
+    global metrics_server
+    if metrics_server:
+        metrics_server.stop()
+        metrics_server = None
+
+
+# initialize cross-request prompt coalescing
+def start_prompt_coalescer():
+    """
+    Enables coalescing of compatible requests into merged prompts if a coalescing window is configured.
+    """
+    global prompt_coalescer
+    if COMFYUI_COALESCE_WINDOW_MS > 0 and COMFYUI_COALESCE_MAX_BATCH > 1:
+        logger.info(f"Coalescing up to {COMFYUI_COALESCE_MAX_BATCH} requests within {COMFYUI_COALESCE_WINDOW_MS} ms")
+        prompt_coalescer = PromptCoalescer(
+            COMFYUI_COALESCE_WINDOW_MS / 1000,
+            COMFYUI_COALESCE_MAX_BATCH,
+            queue_scheduled_prompt,
+            abandon_prompt
+        )
+
+
+# initialize model-affinity scheduling
+def start_model_scheduler():
+    """
+    Enables reordering of pending prompts by checkpoint if model scheduling is enabled.
+    """
+    global model_scheduler
+    if ENABLE_MODEL_SCHEDULER and len(comfy_pool) > 1:
+        logger.warning("Model scheduling is not supported with multiple ComfyUI instances, routing prompts by model instead")
+    elif ENABLE_MODEL_SCHEDULER:
+        logger.info(f"Scheduling prompts by model with {COMFYUI_SCHEDULER_MAX_IN_FLIGHT} in flight, passing over prompts for up to {COMFYUI_SCHEDULER_MAX_WAIT_SEC} seconds")
+        model_scheduler = ModelScheduler(
+            queue_subscribed_prompt,
+            wait_scheduled_prompt,
+            COMFYUI_SCHEDULER_MAX_IN_FLIGHT,
+            COMFYUI_SCHEDULER_MAX_WAIT_SEC,
+            abandon_prompt
+        )
+
+
+# initialize the result cache
+def init_result_cache():
+    """
+    Creates the result cache, indexing results cached on local disk by previous runs.
+    The S3 tier is enabled if a prefix is configured.
+    """
+    global result_cache
+    use_s3 = bool(RESULT_CACHE_S3_PREFIX and AWS_BUCKET_NAME)
+    logger.info(f"Initializing result cache at {RESULT_CACHE_PATH} ({RESULT_CACHE_MAX_MB} MB){' with S3 tier' if use_s3 else ''}")
+    result_cache = ResultCache(
+        RESULT_CACHE_PATH,
+        RESULT_CACHE_MAX_MB * 1024 * 1024,
+        s3_client=get_s3_client() if use_s3 else None,
+        bucket=AWS_BUCKET_NAME,
+        s3_prefix=RESULT_CACHE_S3_PREFIX
+    )
+
+
+# get the gpus to run comfyui instances on
+def get_comfyui_gpus():
+    """
+    Returns the GPU indices to pin one ComfyUI instance each to, or [None] for a single instance using every GPU.
+    """
+    if not COMFYUI_GPUS:
+        return [None]
+    if COMFYUI_GPUS != "auto":
+        try:
+            return [int(gpu) for gpu in COMFYUI_GPUS.split(",") if gpu.strip()]
+        except ValueError:
+            raise ValueError(f"ERROR: Invalid COMFYUI_GPUS '{COMFYUI_GPUS}', expected 'auto' or GPU indices like '0,1'")
+    try:
+        output = subprocess.run(
+            ["nvidia-smi", "--query-gpu=index", "--format=csv,noheader"],
+            capture_output=True, text=True, timeout=10, check=True
+        ).stdout
+        gpus = [int(line) for line in output.split() if line.strip()]
+    except Exception as e:
+        logger.warning(f"Failed to list GPUs, running a single ComfyUI instance: {str(e)}")
+        return [None]
+    return gpus or [None]
+
+
+# build the pool of comfyui instances
+def init_comfyui_pool():
+    """
+    Creates one ComfyUI instance per configured GPU, on consecutive ports starting at COMFYUI_PORT.
+    """
+    global comfy_pool
+    gpus = get_comfyui_gpus()
+    instances = [
+        ComfyInstance(
+            index, LOCAL_HOST_IP, COMFYUI_PORT + index, gpu=gpu,
+            name="ComfyUI" if len(gpus) == 1 else f"ComfyUI {index} (GPU {gpu})"
+        )
+        for index, gpu in enumerate(gpus)
+    ]
+    comfy_pool = ComfyPool(instances)
+    if len(instances) > 1:
+        logger.info(f"Running {len(instances)} ComfyUI instances on GPUs {', '.join(str(gpu) for gpu in gpus)}")
+
+
+# initialize comfyui background processes
 def init_comfyui():
     """
-    Initializes a ComfyUI session with retry logic and starts a ComfyUI instance.
-    Waits for the instance to be ready before returning.
+    Starts the supervised ComfyUI instances and their shared WebSocket connections.
+    Waits for the instances to be ready before returning, as long as one of them is.
+    """
+    logger.info("Initializing ComfyUI instance")
+    init_comfyui_pool()
+    for instance in comfy_pool:
+        start_comfyui_socket(instance)
+        start_comfyui_supervisor(instance)
+    start_prompt_coalescer()
+    start_model_scheduler()
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SEC
+    for instance in comfy_pool:
+        instance.supervisor.wait_ready(max(0, deadline - time.monotonic()))
+    ready = comfy_pool.get_ready()
+    if not ready:
+        raise RuntimeError(f"ERROR: ComfyUI not ready after {STARTUP_TIMEOUT_SEC} seconds")
+    if len(ready) < len(comfy_pool):
+        # The supervisors keep restarting the others, jobs go to the ready ones meanwhile
+        logger.warning(f"Only {len(ready)} of {len(comfy_pool)} ComfyUI instances are ready")
+    logger.info("ComfyUI instance is ready" if len(comfy_pool) == 1 else f"{len(ready)} ComfyUI instances are ready")
+
+
+# build a minimal graph that loads a workflow's models
+def build_warmup_workflow(workflow):
+    """
+    Returns the workflow's graph shrunk to a tiny latent & a single sampler step, ending in a PreviewImage
+    so nothing is written to the output folder. Running it loads the same checkpoint as real jobs.
+    """
+    if getattr(workflow.load, "input_images", None):
+        raise ValueError("ERROR: Workflows taking input images can't be warmed up, warm up a workflow using the same checkpoint instead")
+    # Loaded graphs share nodes with the workflow's compiled graph, so nodes are replaced instead of modified
+    workflow_data = workflow.load("warm-up", "1_1", "warmup", COMFYUI_FILENAME_PREFIX)
+    for node_id, node in workflow_data.items():
+        inputs = node["inputs"]
+        if node["class_type"] == "EmptyLatentImage":
+            inputs = {**inputs, "width": COMFYUI_WARMUP_IMAGE_SIZE, "height": COMFYUI_WARMUP_IMAGE_SIZE, "batch_size": 1}
+        elif node["class_type"] == "ImageScale":
+            inputs = {**inputs, "width": COMFYUI_WARMUP_IMAGE_SIZE, "height": COMFYUI_WARMUP_IMAGE_SIZE}
+        elif node["class_type"] == "KSampler":
+            inputs = {**inputs, "steps": 1}
+        elif node["class_type"] in ["SaveImage", "SaveImageWebsocket"]:
+            workflow_data[node_id] = {"class_type": "PreviewImage", "inputs": {"images": inputs["images"]}}
+            continue
+        workflow_data[node_id] = {**node, "inputs": inputs}
+    return workflow_data
+
+
+# wait for a prompt to finish executing
+async def wait_for_prompt(prompt_id, events):
+    """
+    Consume a prompt's routed WebSocket events until it finishes, raising if it fails.
+    """
+    while True:
+        response = await events.get()
+        type = response['type']
+        data = response['data']
+        if type == "execution_success":
+            return
+        elif type == "execution_error":
+            raise RuntimeError(data.get("exception_message", data.get("error", "Unknown error occurred")))
+        elif type == "execution_interrupted":
+            raise RuntimeError(f"ERROR: ComfyUI prompt {prompt_id} was interrupted")
+        elif type == "worker_error":
+            raise RuntimeError(f"ERROR: {data['message']}")
+        elif type == "reconnected" and await is_prompt_complete(prompt_id):
+            return
+
+
+# run the warm-up graphs of the configured workflows on a comfyui instance
+async def run_instance_warmup(instance):
+    """
+    Runs each configured workflow's warm-up graph in turn on the instance, logging the time each one took.
     """
-    print("Initializing ComfyUI instance")
-    start_comfyui()
-    wait_for_comfyui()
-    setup_comfyui_session()
-    print("ComfyUI instance is ready")
+    for workflow_name in COMFYUI_WARMUP_WORKFLOWS:
+        events = asyncio.Queue()
+        prompt_id = None
+        start_time = time.perf_counter()
+        try:
+            workflow_data = build_warmup_workflow(get_workflow(workflow_name))
+            checkpoints = [
+                node["inputs"]["ckpt_name"] for node in workflow_data.values()
+                if node["class_type"] == "CheckpointLoaderSimple"
+            ]
+            prompt_id = await queue_subscribed_prompt(workflow_data, [events], instance=instance)
+            await asyncio.wait_for(wait_for_prompt(prompt_id, events), timeout=COMFYUI_WARMUP_TIMEOUT_SEC)
+            logger.info(f"Warmed up workflow {workflow_name} ({', '.join(checkpoints)}) on {instance.name} in {time.perf_counter() - start_time:.1f} seconds")
+            if model_scheduler:
+                model_scheduler.set_resident(workflow_data)
+        except Exception as e:
+            logger.warning(f"Failed to warm up workflow {workflow_name} on {instance.name} after {time.perf_counter() - start_time:.1f} seconds: {str(e)}")
+        finally:
+            if prompt_id:
+                unsubscribe_prompt(prompt_id, events)
+                comfy_pool.release(prompt_id)
+
+
+# run the warm-up graphs of the configured workflows
+async def run_warmup():
+    """
+    Warms up the ready ComfyUI instances concurrently, so each GPU loads the configured checkpoints.
+    """
+    try:
+        await asyncio.gather(*[run_instance_warmup(instance) for instance in comfy_pool.get_ready()])
+    finally:
+        # The sessions are bound to this event loop, jobs create their own in Runpod's loop
+        for instance in comfy_pool:
+            if instance.session:
+                await instance.session.close()
+
+
+# load the models of the configured workflows before accepting jobs
+def warm_up_comfyui():
+    """
+    Runs a minimal graph for each workflow in COMFYUI_WARMUP_WORKFLOWS so their checkpoints are
+    loaded before the first job arrives. Failures are logged without failing startup.
+    """
+    if not COMFYUI_WARMUP_WORKFLOWS:
+        return
+    logger.info(f"Warming up workflows: {', '.join(COMFYUI_WARMUP_WORKFLOWS)}")
+    start_time = time.perf_counter()
+    asyncio.run(run_warmup())
+    logger.info(f"Warm-up finished in {time.perf_counter() - start_time:.1f} seconds")
 
 
 # main clean up
@@ -548,9 +2040,30 @@ def cleanup():
     """
     Clean up any background processes & open connections
     """
-    stop_comfyui()
-    close_comfyui_session()
-    close_active_websockets()
+    if prompt_coalescer:
+        logger.info(f"Prompt coalescing stats: {prompt_coalescer.stats()}")
+    if model_scheduler:
+        logger.info(f"Model scheduling stats: {model_scheduler.stats()}")
+    if result_cache:
+        logger.info(f"Result cache stats: {result_cache.stats()}")
+    if input_upload_cache:
+        logger.info(f"Input image upload stats: {input_upload_cache.stats()}")
+    if cancelled_prompts["pending"] or cancelled_prompts["running"]:
+        logger.info(f"Cancelled prompt stats: {cancelled_prompts}")
+    if comfy_pool and len(comfy_pool) > 1:
+        logger.info(f"ComfyUI pool stats: {comfy_pool.stats()}")
+    stop_metrics_server()
+    stop_model_prefetch()
+    stop_model_staging()
+    stop_retention_manager()
+    for instance in comfy_pool or []:
+        stop_comfyui_supervisor(instance)
+        stop_comfyui(instance)
+        stop_comfyui_socket(instance)
+        close_comfyui_session(instance)
+    close_download_session()
+    close_io_executor()
+    shutdown_logging()
 
 
 # main method
@@ -559,13 +2072,31 @@ def main():
     Initialize ComfyUI instance (unless in health check mode) and start the Runpod serverless handler.
     Ensures proper cleanup of ComfyUI process and worker memory on exit.
     """
+    if LOG_FORMAT not in LOG_FORMATS:
+        raise ValueError(f"ERROR: Invalid LOG_FORMAT '{LOG_FORMAT}'. Available formats: {', '.join(LOG_FORMATS)}")
+    setup_logging(LOG_LEVEL, LOG_FORMAT)
+    if COMFYUI_OUTPUT_MODE not in COMFYUI_OUTPUT_MODES:
+        raise ValueError(f"ERROR: Invalid COMFYUI_OUTPUT_MODE '{COMFYUI_OUTPUT_MODE}'. Available modes: {', '.join(COMFYUI_OUTPUT_MODES)}")
     if not HEALTH_CHECK_MODE:
-        print("Starting Runpod in production mode")
+        logger.info("Starting Runpod in production mode")
         if ENABLE_NETWORK_VOLUME:
-            link_cached_models()
+            configure_model_paths()
+            if ENABLE_MODEL_STAGING:
+                start_model_staging()
+            if ENABLE_MODEL_PREFETCH:
+                start_model_prefetch()
+        if ENABLE_S3_UPLOAD:
+            init_s3()
+        if ENABLE_RESULT_CACHE:
+            init_result_cache()
+        if ENABLE_METRICS:
+            start_metrics_server()
+        if ENABLE_OUTPUT_RETENTION:
+            start_retention_manager()
         init_comfyui()
+        warm_up_comfyui()
     else:
-        print("Starting Runpod in health check mode")
+        logger.info("Starting Runpod in health check mode")
     try:
         init_runpod()
     finally:
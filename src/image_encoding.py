@@ -0,0 +1,87 @@
+# output image encoding
+
+import io
+import time
+
+from PIL import Image, features
+
+
+# Module constants
+DEFAULT_OUTPUT_FORMAT = "png"  # ComfyUI output format, returned as-is
+OUTPUT_FORMATS = {
+    # name: (Pillow format, content type, file extension, default quality)
+    "png": ("PNG", "image/png", "png", None),
+    "webp": ("WEBP", "image/webp", "webp", 90),
+    "jpeg": ("JPEG", "image/jpeg", "jpg", 90),
+    "avif": ("AVIF", "image/avif", "avif", 80),
+}
+OUTPUT_FORMAT_ALIASES = {
+    "jpg": "jpeg",
+}
+
+
+# Validate & normalize a requested output format and quality
+def parse_output_format(output_format, quality):
+    output_format = str(output_format or DEFAULT_OUTPUT_FORMAT).lower()
+    output_format = OUTPUT_FORMAT_ALIASES.get(output_format, output_format)
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"ERROR: Output format '{output_format}' not supported. Available formats: {', '.join(OUTPUT_FORMATS.keys())}")
+    if quality is None:
+        quality = OUTPUT_FORMATS[output_format][3]
+    else:
+        quality = int(quality)
+        if quality < 1 or quality > 100:
+            raise ValueError(f"ERROR: Output quality must be between 1 and 100, got {quality}")
+    return output_format, quality
+
+
+# Get the content type for an output format
+def get_content_type(output_format):
+    return OUTPUT_FORMATS[output_format][1]
+
+
+# Get the file extension for an output format
+def get_extension(output_format):
+    return OUTPUT_FORMATS[output_format][2]
+
+
+# Re-encode a PNG image into the requested output format
+def encode_image(image_data, output_format, quality):
+    """
+    Re-encodes PNG image bytes into the given output format. Runs in a worker thread,
+    Pillow releases the GIL while encoding. Returns the encoded bytes and the encode time in seconds.
+    """
+    if output_format == DEFAULT_OUTPUT_FORMAT:
+        return image_data, 0.0
+    if output_format == "avif" and not features.check("avif"):
+        try:
+            import pillow_avif  # noqa: F401, registers the AVIF plugin on older Pillow versions
+        except ImportError:
+            raise ValueError("ERROR: AVIF output requires Pillow with AVIF support")
+
+    start_time = time.perf_counter()
+    pillow_format = OUTPUT_FORMATS[output_format][0]
+    with Image.open(io.BytesIO(image_data)) as image:
+        if pillow_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format=pillow_format, quality=quality)
+    return output.getbuffer(), time.perf_counter() - start_time
+
+
+# Downscale a latent preview for streaming
+def encode_preview(image_data, max_size, quality):
+    """
+    Returns a latent preview frame's image as JPEG bytes no larger than max_size on either side.
+    Small JPEG previews, the ComfyUI default, are passed through without decoding.
+    """
+    with Image.open(io.BytesIO(image_data)) as image:
+        if image.format == "JPEG" and max(image.size) <= max_size:
+            return bytes(image_data)
+        # Let the JPEG decoder skip detail the thumbnail would throw away
+        image.draft("RGB", (max_size, max_size))
+        image = image.convert("RGB")
+        image.thumbnail((max_size, max_size))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
@@ -0,0 +1,227 @@
+# input images for img2img & inpainting workflows
+
+import os
+import re
+import base64
+import logging
+import asyncio
+import hashlib
+import math
+import binascii
+import tempfile
+import collections
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+# Module constants
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+BASE64_DECODE_CHUNK_SIZE = 4 * 64 * 1024  # Multiple of 4 so decoded chunks concatenate cleanly
+SPOOL_MAX_BYTES = 8 * 1024 * 1024  # Larger images are buffered in a temporary file instead of memory
+DATA_URI_PATTERN = re.compile(r"^data:[\w/+.-]*(;[\w=.-]+)*;base64,")
+IMAGE_FORMATS = {
+    # Pillow format: (file extension, content type)
+    "PNG": ("png", "image/png"),
+    "JPEG": ("jpg", "image/jpeg"),
+    "WEBP": ("webp", "image/webp"),
+}
+UPLOAD_FILENAME_PATTERN = re.compile(r"^[0-9a-f]{64}\.(png|jpg|webp)$")  # Content-hash names of uploaded input images
+ASPECT_RATIOS = ["1_1", "5_4", "4_5", "4_3", "3_4", "3_2", "2_3", "16_9", "9_16", "21_9", "9_21"]  # Snapped to, inputs are center cropped
+
+
+# Fetched & validated input image
+class InputImage:
+    """
+    An input image buffered in a spooled temporary file, named by its content hash so identical
+    images map to the same ComfyUI input file no matter where they came from.
+    """
+
+    def __init__(self, file, size, digest, image_format, width, height):
+        self.file = file
+        self.size = size
+        self.digest = digest
+        self.width = width
+        self.height = height
+        self.extension, self.content_type = IMAGE_FORMATS[image_format]
+
+    @property
+    def filename(self):
+        return f"{self.digest}.{self.extension}"
+
+    def close(self):
+        self.file.close()
+
+
+# Check if a file name is one this worker uploads input images under
+def is_upload_filename(name):
+    return UPLOAD_FILENAME_PATTERN.match(name) is not None
+
+
+# Check if an input image source is a URL
+def is_url(source):
+    return source.startswith("http://") or source.startswith("https://")
+
+
+# Download an image URL into a spooled file
+async def download_image(session, url, max_bytes):
+    """
+    Streams the response body in chunks, hashing as it goes and giving up as soon as the image
+    is over the size limit, so large or endless responses never sit in memory.
+    Returns the spooled file, the image size & its SHA-256 digest.
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with session.get(url) as response:
+            if response.status >= 400:
+                raise RuntimeError(f"ERROR: Input image download returned {response.status} for {url}")
+            if response.content_length is not None and response.content_length > max_bytes:
+                raise ValueError(f"ERROR: Input image {url} is {response.content_length} bytes, over the {max_bytes} byte limit")
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"ERROR: Input image {url} is over the {max_bytes} byte limit")
+                digest.update(chunk)
+                file.write(chunk)
+    except BaseException:
+        file.close()
+        raise
+    return file, size, digest.hexdigest()
+
+
+# Decode a base64 image into a spooled file
+def decode_image(data, max_bytes):
+    """
+    Decodes a base64 string, with or without a data URI prefix, in chunks into a spooled file.
+    Returns the spooled file, the image size & its SHA-256 digest.
+    """
+    data = DATA_URI_PATTERN.sub("", data, count=1)
+    data = "".join(data.split())
+    if len(data) // 4 * 3 > max_bytes + 2:
+        raise ValueError(f"ERROR: Base64 input image is over the {max_bytes} byte limit")
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        for offset in range(0, len(data), BASE64_DECODE_CHUNK_SIZE):
+            chunk = base64.b64decode(data[offset:offset + BASE64_DECODE_CHUNK_SIZE], validate=True)
+            size += len(chunk)
+            digest.update(chunk)
+            file.write(chunk)
+    except (binascii.Error, ValueError):
+        file.close()
+        raise ValueError("ERROR: Input image is neither an http(s) URL nor valid base64")
+    if size > max_bytes:
+        file.close()
+        raise ValueError(f"ERROR: Base64 input image is over the {max_bytes} byte limit")
+    return file, size, digest.hexdigest()
+
+
+# Check that a buffered file is a supported image
+def inspect_image(file, max_pixels):
+    """
+    Reads the image header for its format & size without decoding the pixel data.
+    Returns the Pillow format, width & height.
+    """
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            image_format, (width, height) = image.format, image.size
+    except Exception:
+        raise ValueError("ERROR: Input image is not a valid image")
+    finally:
+        file.seek(0)
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"ERROR: Input image format {image_format} not supported. Supported formats: {', '.join(IMAGE_FORMATS.keys())}")
+    if width * height > max_pixels:
+        raise ValueError(f"ERROR: Input image is {width}x{height}, over the {max_pixels} pixel limit")
+    return image_format, width, height
+
+
+# Fetch an input image from a URL or base64 string
+async def fetch_image(source, session, run_blocking, max_bytes, max_pixels):
+    """
+    Downloads or decodes an input image and validates it. Blocking decoding & validation
+    run through the given run_blocking function. Returns an InputImage, which the caller closes.
+    """
+    if not isinstance(source, str) or not source:
+        raise ValueError("ERROR: Input image must be an http(s) URL or a base64 string")
+    if is_url(source):
+        file, size, digest = await download_image(session, source, max_bytes)
+    else:
+        file, size, digest = await run_blocking(decode_image, source, max_bytes)
+    try:
+        image_format, width, height = await run_blocking(inspect_image, file, max_pixels)
+    except BaseException:
+        file.close()
+        raise
+    return InputImage(file, size, digest, image_format, width, height)
+
+
+# Get the supported aspect ratio closest to an image's
+def get_image_aspect_ratio(width, height):
+    ratio = math.log(width / height)
+    return min(ASPECT_RATIOS, key=lambda aspect_ratio: abs(math.log(int(aspect_ratio.split("_")[0]) / int(aspect_ratio.split("_")[1])) - ratio))
+
+
+# Bounded record of input images ComfyUI already has
+class UploadCache:
+    """
+    Remembers the most recently used input images uploaded to ComfyUI by content hash, so jobs reusing
+    an image skip the upload. Entries are only trusted while the file is still in ComfyUI's input folder,
+    and concurrent jobs uploading the same image share a single upload.
+    """
+
+    def __init__(self, input_path, max_entries):
+        self.input_path = input_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.uploads = 0
+        self._filenames = collections.OrderedDict()  # filename -> None, least recently used first
+        self._uploading = {}  # filename -> future of the running upload
+
+    # upload an image unless ComfyUI already has it
+    async def ensure(self, image, upload):
+        """
+        Awaits upload(image) unless the image is cached, on disk or already being uploaded.
+        Returns True if the upload was skipped.
+        """
+        filename = image.filename
+        while filename in self._uploading:
+            # Another job is uploading the same image, use its upload unless it fails
+            await asyncio.wait([self._uploading[filename]])
+        if filename in self._filenames and os.path.exists(self.get_path(filename)):
+            self._filenames.move_to_end(filename)
+            self.hits += 1
+            return True
+        if os.path.exists(self.get_path(filename)):
+            # Uploaded by an earlier run of the worker
+            self._remember(filename)
+            self.hits += 1
+            return True
+
+        done = asyncio.get_running_loop().create_future()
+        self._uploading[filename] = done
+        try:
+            await upload(image)
+            self._remember(filename)
+            self.uploads += 1
+        finally:
+            del self._uploading[filename]
+            done.set_result(None)
+        return False
+
+    def stats(self):
+        return {"entries": len(self._filenames), "uploads": self.uploads, "skipped": self.hits}
+
+    def get_path(self, filename):
+        return os.path.join(self.input_path, filename)
+
+    def _remember(self, filename):
+        self._filenames[filename] = None
+        self._filenames.move_to_end(filename)
+        while len(self._filenames) > self.max_entries:
+            self._filenames.popitem(last=False)
@@ -0,0 +1,186 @@
+# structured logging
+
+import re
+import sys
+import json
+import time
+import queue
+import logging
+import logging.handlers
+import threading
+import contextvars
+import collections
+
+
+# Module constants
+LOG_FORMATS = ["text", "json"]
+LOG_QUEUE_SIZE = 10000  # Records waiting for the writer, further records are dropped
+LOG_BATCH_SIZE = 256  # Records written to the sink per write
+LOG_FLUSH_INTERVAL_SEC = 0.5  # Longest a record waits in the batch
+COMFYUI_LOG_BUFFER_LINES = 500  # Recent ComfyUI output lines kept in memory
+COMFYUI_PROGRESS_LOG_INTERVAL_SEC = 5  # Progress bar lines are logged at most this often
+PROGRESS_BAR_PATTERN = re.compile(r"\d+%\|.*\|\s*\d+/\d+")  # tqdm progress bars, e.g. " 45%|####5     | 9/20 [...]"
+
+# Module memory
+job_id_var = contextvars.ContextVar("job_id", default=None)  # Job the current task or thread works on
+_listener = None
+_comfyui_lines = collections.deque(maxlen=COMFYUI_LOG_BUFFER_LINES)  # (monotonic time, line)
+_comfyui_lines_lock = threading.Lock()
+
+
+# Adds the current job ID to log records
+class JobContextFilter(logging.Filter):
+    def filter(self, record):
+        record.job_id = job_id_var.get()
+        return True
+
+
+# Formats log records as single-line JSON objects
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.job_id:
+            entry["job_id"] = record.job_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+# Formats log records as plain text lines
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"{record.levelname:<7} | {record.job_id or '-'} | {record.name} | {record.getMessage()}"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+# Non-blocking queue handler that drops records when the writer falls behind
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+# Background writer batching log records into few writes
+class BatchWriter:
+    """
+    Drains the log queue from a background thread and writes records to the sink in batches,
+    one write & flush per batch instead of per record.
+    """
+
+    def __init__(self, records, formatter, stream=None, batch_size=LOG_BATCH_SIZE):
+        self.records = records
+        self.formatter = formatter
+        self.stream = stream or sys.stdout
+        self.batch_size = batch_size
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write all queued records and stop the writer thread.
+        """
+        self._stopped.set()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                batch.append(self.records.get(timeout=LOG_FLUSH_INTERVAL_SEC))
+                while len(batch) < self.batch_size:
+                    batch.append(self.records.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self._write(batch)
+            elif self._stopped.is_set():
+                return
+
+    def _write(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception as e:
+                lines.append(f"ERROR   | - | logs | Failed to format log record: {str(e)}")
+        try:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+        except Exception:
+            pass
+
+
+# Set up the worker's logging
+def setup_logging(level="INFO", log_format="text"):
+    """
+    Routes all log records through a bounded queue to a background writer that batches them to stdout,
+    with the current job ID attached to every record. Safe to call more than once.
+    """
+    global _listener
+    if _listener:
+        return
+    records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(records)
+    handler.addFilter(JobContextFilter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper())
+    formatter = JsonFormatter() if log_format == "json" else TextFormatter()
+    _listener = BatchWriter(records, formatter)
+    _listener.start()
+
+
+# Flush & stop the log writer
+def shutdown_logging():
+    global _listener
+    if _listener:
+        if DroppingQueueHandler.dropped:
+            logging.getLogger(__name__).warning(f"Dropped {DroppingQueueHandler.dropped} log records")
+        _listener.stop()
+        _listener = None
+        logging.getLogger().handlers = [logging.StreamHandler()]
+
+
+# Log a process' output line by line
+def stream_output(pipe, logger, buffer_lines=True):
+    """
+    Logs the lines of a process output stream and keeps them in the recent output buffer.
+    Progress bar lines are only kept at most once per interval, and when they reach 100%.
+    """
+    last_progress_log = 0.0
+    for line in iter(pipe.readline, ''):
+        line = line.rstrip()
+        if not line:
+            continue
+        now = time.monotonic()
+        if PROGRESS_BAR_PATTERN.search(line):
+            if now - last_progress_log < COMFYUI_PROGRESS_LOG_INTERVAL_SEC and "100%|" not in line:
+                continue
+            last_progress_log = now
+        if buffer_lines:
+            with _comfyui_lines_lock:
+                _comfyui_lines.append((now, line))
+        logger.info(line)
+
+
+# Get the ComfyUI output since a point in time
+def get_recent_output(since=None):
+    """
+    Returns the buffered process output lines logged since the given monotonic time, or all of them.
+    """
+    with _comfyui_lines_lock:
+        return [line for logged_at, line in _comfyui_lines if since is None or logged_at >= since]
@@ -0,0 +1,263 @@
+# job stage timings & prometheus metrics
+
+import logging
+import time
+import threading
+import contextlib
+import http.server
+
+logger = logging.getLogger(__name__)
+
+
+# Module constants
+STAGES = [
+    "input_fetch",  # Downloading or decoding input images
+    "cache_lookup",  # Result cache lookup
+    "health_check",  # Waiting for ComfyUI to be ready
+    "input_upload",  # Uploading input images ComfyUI doesn't have yet
+    "graph_build",  # workflow.load
+    "queue_prompt",  # Until the prompt is queued, including coalescing & scheduling waits
+    "queue_wait",  # Queued until ComfyUI starts executing the prompt
+    "model_load",  # Model loader nodes
+    "sampling",  # Sampler nodes
+    "vae_decode",  # VAE decode nodes
+    "other_nodes",  # Remaining executed nodes
+    "output_retrieval",  # Reading output images from disk or /history
+    "encode",  # Re-encoding outputs into the requested format
+    "upload",  # S3 upload
+    "base64",  # Base64 encoding
+]
+NODE_STAGES = {
+    # node class: stage its execution time counts towards
+    "CheckpointLoaderSimple": "model_load",
+    "CheckpointLoader": "model_load",
+    "UNETLoader": "model_load",
+    "CLIPLoader": "model_load",
+    "DualCLIPLoader": "model_load",
+    "VAELoader": "model_load",
+    "LoraLoader": "model_load",
+    "LoraLoaderModelOnly": "model_load",
+    "ControlNetLoader": "model_load",
+    "UpscaleModelLoader": "model_load",
+    "KSampler": "sampling",
+    "KSamplerAdvanced": "sampling",
+    "SamplerCustom": "sampling",
+    "SamplerCustomAdvanced": "sampling",
+    "VAEDecode": "vae_decode",
+    "VAEDecodeTiled": "vae_decode",
+}
+HISTOGRAM_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300]  # Seconds
+
+
+# Stage timings of a single job
+class JobTimings:
+    """
+    Accumulates the seconds a job spends per stage. Stages measured for each output image
+    (retrieval, encode, upload) are summed over the images, as are the output images' sizes.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.outputs = {}  # output format -> [images, bytes]
+        self._started_at = time.perf_counter()
+
+    # time a block of code as a stage
+    @contextlib.contextmanager
+    def measure(self, stage):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start_time)
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    # count an output image in its final format
+    def add_output(self, output_format, size):
+        output = self.outputs.setdefault(output_format, [0, 0])
+        output[0] += 1
+        output[1] += size
+
+    # split executed node durations into stages
+    def add_nodes(self, node_seconds):
+        """
+        Add the execution time of a prompt's nodes, given as lists of seconds per node class.
+        """
+        for class_type, durations in node_seconds.items():
+            self.add(NODE_STAGES.get(class_type, "other_nodes"), sum(durations))
+
+    def total(self):
+        return time.perf_counter() - self._started_at
+
+    def to_dict(self):
+        """
+        Returns the stage timings in pipeline order, in seconds, with the job's total time.
+        """
+        timings = {stage: round(self.stages[stage], 4) for stage in STAGES if stage in self.stages}
+        timings["total"] = round(self.total(), 4)
+        return timings
+
+
+# Escape a Prometheus label value
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+# Format Prometheus labels
+def _labels(labels):
+    return ",".join(f'{name}="{_label_value(value)}"' for name, value in labels)
+
+
+# Aggregated job metrics
+class JobMetrics:
+    """
+    Aggregates job stage timings into histograms per workflow, aspect ratio & stage, and counts jobs
+    per status. Rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = sorted(buckets)
+        self._histograms = {}  # (workflow, aspect ratio, stage) -> [bucket counts..., count, sum]
+        self._jobs = {}  # (workflow, aspect ratio, status) -> count
+        self._cancelled = {}  # prompt state when cancelled -> [count, GPU seconds]
+        self._outputs = {}  # (workflow, output format) -> [images, bytes]
+        self._lock = threading.Lock()
+
+    # record a finished job
+    def observe(self, workflow, aspect_ratio, timings, status="success"):
+        """
+        Record a job's status, and its stage timings & output sizes if it succeeded.
+        """
+        with self._lock:
+            key = (workflow, aspect_ratio, status)
+            self._jobs[key] = self._jobs.get(key, 0) + 1
+            if status != "success":
+                return
+            for output_format, (images, size) in timings.outputs.items():
+                output = self._outputs.setdefault((workflow, output_format), [0, 0])
+                output[0] += images
+                output[1] += size
+            stages = dict(timings.stages)
+            stages["total"] = timings.total()
+            for stage, seconds in stages.items():
+                histogram = self._histograms.get((workflow, aspect_ratio, stage))
+                if histogram is None:
+                    histogram = self._histograms[(workflow, aspect_ratio, stage)] = [0] * (len(self.buckets) + 2)
+                for index, bucket in enumerate(self.buckets):
+                    if seconds <= bucket:
+                        histogram[index] += 1
+                histogram[-2] += 1
+                histogram[-1] += seconds
+
+    # record a prompt cancelled after its jobs were gone
+    def observe_cancelled(self, state, gpu_sec=0.0):
+        """
+        Record a prompt removed from the ComfyUI queue ("pending") or interrupted ("running"),
+        with the GPU seconds it had used.
+        """
+        with self._lock:
+            cancelled = self._cancelled.setdefault(state, [0, 0.0])
+            cancelled[0] += 1
+            cancelled[1] += gpu_sec
+
+    # render all metrics
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            histograms = {key: list(histogram) for key, histogram in self._histograms.items()}
+            jobs = dict(self._jobs)
+            cancelled = {state: list(values) for state, values in self._cancelled.items()}
+            outputs = {key: list(values) for key, values in self._outputs.items()}
+
+        lines = [
+            "# HELP worker_jobs_total Jobs handled by the worker.",
+            "# TYPE worker_jobs_total counter",
+        ]
+        for (workflow, aspect_ratio, status), count in sorted(jobs.items()):
+            lines.append(f"worker_jobs_total{{{_labels([('workflow', workflow), ('aspect_ratio', aspect_ratio), ('status', status)])}}} {count}")
+
+        lines += [
+            "# HELP worker_cancelled_prompts_total Prompts cancelled in ComfyUI after their jobs timed out, failed or were cancelled.",
+            "# TYPE worker_cancelled_prompts_total counter",
+        ]
+        for state, (count, _) in sorted(cancelled.items()):
+            lines.append(f"worker_cancelled_prompts_total{{{_labels([('state', state)])}}} {count}")
+        lines += [
+            "# HELP worker_cancelled_gpu_seconds_total GPU seconds spent on prompts before they were interrupted.",
+            "# TYPE worker_cancelled_gpu_seconds_total counter",
+            f"worker_cancelled_gpu_seconds_total {sum(gpu_sec for _, gpu_sec in cancelled.values()):.6f}",
+        ]
+
+        lines += [
+            "# HELP worker_output_images_total Output images returned by successful jobs.",
+            "# TYPE worker_output_images_total counter",
+        ]
+        for (workflow, output_format), (images, _) in sorted(outputs.items()):
+            lines.append(f"worker_output_images_total{{{_labels([('workflow', workflow), ('output_format', output_format)])}}} {images}")
+        lines += [
+            "# HELP worker_output_bytes_total Bytes of output images returned by successful jobs, after encoding.",
+            "# TYPE worker_output_bytes_total counter",
+        ]
+        for (workflow, output_format), (_, size) in sorted(outputs.items()):
+            lines.append(f"worker_output_bytes_total{{{_labels([('workflow', workflow), ('output_format', output_format)])}}} {size}")
+
+        lines += [
+            "# HELP worker_job_stage_seconds Seconds spent per job stage.",
+            "# TYPE worker_job_stage_seconds histogram",
+        ]
+        for (workflow, aspect_ratio, stage), histogram in sorted(histograms.items()):
+            labels = [("workflow", workflow), ("aspect_ratio", aspect_ratio), ("stage", stage)]
+            for index, bucket in enumerate(self.buckets):
+                lines.append(f"worker_job_stage_seconds_bucket{{{_labels(labels + [('le', bucket)])}}} {histogram[index]}")
+            lines.append(f"worker_job_stage_seconds_bucket{{{_labels(labels + [('le', '+Inf')])}}} {histogram[-2]}")
+            lines.append(f"worker_job_stage_seconds_count{{{_labels(labels)}}} {histogram[-2]}")
+            lines.append(f"worker_job_stage_seconds_sum{{{_labels(labels)}}} {histogram[-1]:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+# Local HTTP endpoint serving the metrics
+class MetricsServer:
+    """
+    Serves rendered metrics at /metrics from a background thread.
+    """
+
+    def __init__(self, render, host, port):
+        self.host = host
+        self.port = port
+        self._render = render
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        render = self._render
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Metrics request: {format % args}")
+
+        self._server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        logger.info(f"Serving metrics at http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self._thread = None
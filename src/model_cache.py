@@ -0,0 +1,391 @@
+# network volume model paths, prefetching & local staging
+
+import logging
+import os
+import json
+import time
+import hashlib
+import threading
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+# Module constants
+MODEL_INPUT_FOLDERS = {
+    # node input naming a model file: ComfyUI model folder
+    "ckpt_name": "checkpoints",
+    "unet_name": "unet",
+    "vae_name": "vae",
+    "lora_name": "loras",
+    "control_net_name": "controlnet",
+    "upscale_model_name": "upscale_models",
+}
+PREFETCH_READ_SIZE = 16 * 1024 * 1024  # Sequential read size while prefetching
+STAGING_COPY_SIZE = 16 * 1024 * 1024  # Read size while copying models to local disk
+STAGING_PARTIAL_SUFFIX = ".partial"  # Copies in progress, not a model extension so ComfyUI ignores them
+STAGING_META_SUFFIX = ".staged.json"  # Size & hash of a staged copy
+SOURCE_HASH_SUFFIX = ".sha256"  # Optional expected SHA-256 published next to a model on the volume
+
+
+# Find the model files a workflow graph loads
+def get_model_files(workflow_data):
+    """
+    Returns the (model folder, file name) pairs referenced by a workflow's loader nodes.
+    """
+    return sorted({
+        (folder, node["inputs"][name])
+        for node in workflow_data.values()
+        for name, folder in MODEL_INPUT_FOLDERS.items()
+        if isinstance(node["inputs"].get(name), str)
+    })
+
+
+# Write a ComfyUI extra_model_paths config for a model directory
+def write_model_paths_config(config_path, models_path, name="network_volume", staging_path=None):
+    """
+    Writes a ComfyUI extra_model_paths YAML file that adds every model folder found in the
+    given directory to ComfyUI's search paths. With a staging directory, the same folders there
+    are searched first, so staged local copies take precedence. Returns the model folders.
+    """
+    folders = sorted(d for d in os.listdir(models_path) if os.path.isdir(os.path.join(models_path, d)))
+    lines = []
+    if staging_path:
+        for folder in folders:
+            os.makedirs(os.path.join(staging_path, folder), exist_ok=True)
+        lines += ["local_staging:", f"    base_path: {json.dumps(staging_path)}", "    is_default: true"]
+        lines += [f"    {folder}: {json.dumps(folder)}" for folder in folders]
+    lines += [f"{name}:", f"    base_path: {json.dumps(models_path)}"]
+    lines += [f"    {folder}: {json.dumps(folder)}" for folder in folders]
+    temp_path = f"{config_path}.tmp"
+    with open(temp_path, "w") as config_file:
+        config_file.write("\n".join(lines) + "\n")
+    os.replace(temp_path, config_path)
+    return folders
+
+
+# Reads model files ahead of use so they are in the page cache
+class ModelPrefetcher:
+    """
+    Reads model files sequentially from a background thread pool, so the first load of a multi-GB
+    checkpoint from a network volume is served from the page cache. Files are read in the given
+    priority order until the byte budget is used up, each as soon as its path is known.
+    """
+
+    def __init__(self, max_workers=4, max_bytes=None):
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes
+        self.files = 0  # Files prefetched
+        self.bytes = 0  # Bytes prefetched
+        self.seconds = 0.0  # Wall time of the prefetch
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    # prefetch files in the background
+    def start(self, get_paths):
+        """
+        Start prefetching in a background thread the file paths returned by get_paths. It is called in
+        that thread, so finding the paths stays off the caller's path, and may return a generator.
+        """
+        self._thread = threading.Thread(target=self._run, args=(get_paths,), name="model-prefetch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self):
+        """
+        Returns prefetch statistics for logging & metrics.
+        """
+        with self._lock:
+            return {
+                "files": self.files,
+                "bytes": self.bytes,
+                "seconds": self.seconds,
+                "throughput_mb_sec": self.bytes / 1024 / 1024 / self.seconds if self.seconds else 0,
+            }
+
+    # prefetch files within the byte budget
+    def _run(self, get_paths):
+        selected = set()
+        budget = self.max_bytes
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="model-prefetch") as executor:
+            try:
+                for path in get_paths():
+                    if self._stopped.is_set():
+                        break
+                    if path in selected:
+                        continue
+                    try:
+                        size = os.path.getsize(path)
+                    except OSError as e:
+                        logger.warning(f"Cannot prefetch model {path}: {str(e)}")
+                        continue
+                    if budget is not None and size > budget:
+                        logger.info(f"Skipping prefetch of model {path} ({size} bytes), over the prefetch budget")
+                        continue
+                    # Start reading right away, the executor keeps the priority order
+                    selected.add(path)
+                    executor.submit(self._prefetch, path)
+                    if budget is not None:
+                        budget -= size
+            except Exception as e:
+                logger.warning(f"Failed to find models to prefetch: {str(e)}")
+        if not selected:
+            return
+        with self._lock:
+            self.seconds = time.perf_counter() - start_time
+        logger.info(f"Prefetched models: {self.stats()}")
+
+    # read one file sequentially into the page cache
+    def _prefetch(self, path):
+        start_time = time.perf_counter()
+        size = 0
+        buffer = bytearray(PREFETCH_READ_SIZE)
+        try:
+            with open(path, "rb", buffering=0) as model_file:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(model_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    os.posix_fadvise(model_file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                while not self._stopped.is_set():
+                    read = model_file.readinto(buffer)
+                    if not read:
+                        break
+                    size += read
+        except OSError as e:
+            logger.warning(f"Failed to prefetch model {path}: {str(e)}")
+            return
+        seconds = time.perf_counter() - start_time
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+        logger.info(f"Prefetched model {path}: {size} bytes in {seconds:.1f} seconds ({size / 1024 / 1024 / max(seconds, 1e-6):.0f} MB/s)")
+
+
+# Copies models from the network volume to local disk
+class ModelStager:
+    """
+    Keeps local copies of network volume models in a staging directory that ComfyUI searches first.
+    Models are copied in a background thread pool on first use, so jobs never wait for a copy and
+    keep reading from the volume until the local copy is complete. Copies are checked against the
+    source size (and a published SHA-256 if present), and least recently used models are evicted
+    to stay within the byte budget. Models pinned by queued or running prompts are never evicted.
+    """
+
+    def __init__(self, source_path, staging_path, max_bytes, max_workers=2):
+        self.source_path = source_path
+        self.staging_path = staging_path
+        self.max_bytes = max_bytes
+        self.copies = 0  # Models copied to local disk
+        self.copy_bytes = 0  # Bytes copied to local disk
+        self.copy_seconds = 0.0  # Time spent copying, summed over copies
+        self.evictions = 0  # Staged models deleted to stay within the budget
+        self.failures = 0  # Copies that failed or didn't match the source
+        self._entries = collections.OrderedDict()  # relative path -> size, least recently used first
+        self._size = 0
+        self._reserved = 0  # Bytes reserved for copies in progress
+        self._copying = set()  # relative paths being copied
+        self._skipped = set()  # relative paths too large for the budget
+        self._pinned = collections.Counter()  # relative path -> queued or running prompts using the model
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-stage")
+        self._load()
+
+    # stage a model in the background if needed
+    def stage(self, folder, filename):
+        """
+        Marks a model as used, and starts copying it to local disk unless it is staged or being copied.
+        Never blocks on the copy.
+        """
+        relative_path = os.path.join(folder, filename)
+        source = os.path.join(self.source_path, relative_path)
+        with self._lock:
+            if relative_path in self._entries:
+                self._entries.move_to_end(relative_path)
+                return
+            if relative_path in self._copying or relative_path in self._skipped or not os.path.isfile(source):
+                return
+            self._copying.add(relative_path)
+        try:
+            self._executor.submit(self._copy, relative_path)
+        except RuntimeError:
+            # Shutting down
+            with self._lock:
+                self._copying.discard(relative_path)
+
+    # keep models from being evicted while prompts use them
+    def pin(self, model_files):
+        """
+        Marks the given (folder, file name) models as used by a queued or running prompt until unpinned.
+        """
+        with self._lock:
+            for folder, filename in model_files:
+                self._pinned[os.path.join(folder, filename)] += 1
+
+    def unpin(self, model_files):
+        with self._lock:
+            for folder, filename in model_files:
+                relative_path = os.path.join(folder, filename)
+                self._pinned[relative_path] -= 1
+                if self._pinned[relative_path] <= 0:
+                    del self._pinned[relative_path]
+
+    def stop(self):
+        """
+        Stop accepting copies and wait for running copies to finish.
+        """
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        """
+        Returns staging statistics for logging & metrics.
+        """
+        with self._lock:
+            return {
+                "staged_files": len(self._entries),
+                "staged_bytes": self._size,
+                "copying": len(self._copying),
+                "copies": self.copies,
+                "copy_bytes": self.copy_bytes,
+                "copy_throughput_mb_sec": self.copy_bytes / 1024 / 1024 / self.copy_seconds if self.copy_seconds else 0,
+                "evictions": self.evictions,
+                "failures": self.failures,
+            }
+
+    # copy a model to local disk, verifying it against the source
+    def _copy(self, relative_path):
+        source = os.path.join(self.source_path, relative_path)
+        target = os.path.join(self.staging_path, relative_path)
+        partial = target + STAGING_PARTIAL_SUFFIX
+        start_time = time.perf_counter()
+        size = None
+        try:
+            size = os.path.getsize(source)
+            if not self._reserve(size):
+                # Models only too large for now, e.g. while pinned models fill the budget, are tried again on their next use
+                too_large = size > self.max_bytes
+                logger.info(f"Not staging model {relative_path} ({size} bytes), {'over' if too_large else 'no room left in'} the staging budget")
+                size = None
+                with self._lock:
+                    self._copying.discard(relative_path)
+                    if too_large:
+                        self._skipped.add(relative_path)
+                return
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            digest = hashlib.sha256()
+            copied = 0
+            buffer = bytearray(STAGING_COPY_SIZE)
+            with open(source, "rb", buffering=0) as source_file, open(partial, "wb") as target_file:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(source_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                while read := source_file.readinto(buffer):
+                    view = memoryview(buffer)[:read]
+                    digest.update(view)
+                    target_file.write(view)
+                    copied += read
+            sha256 = digest.hexdigest()
+            if copied != size or os.path.getsize(partial) != size:
+                raise RuntimeError(f"copied {copied} of {size} bytes")
+            expected = self._read_source_hash(source)
+            if expected and expected != sha256:
+                raise RuntimeError(f"SHA-256 {sha256} doesn't match published {expected}")
+            with open(target + STAGING_META_SUFFIX, "w") as meta_file:
+                json.dump({"size": size, "sha256": sha256, "source_mtime": os.path.getmtime(source)}, meta_file)
+            os.replace(partial, target)
+        except Exception as e:
+            logger.warning(f"Failed to stage model {relative_path}: {str(e)}")
+            for path in [partial, target + STAGING_META_SUFFIX]:
+                if os.path.exists(path):
+                    os.remove(path)
+            with self._lock:
+                self._copying.discard(relative_path)
+                self.failures += 1
+                if size is not None:
+                    self._reserved -= size
+            return
+
+        seconds = time.perf_counter() - start_time
+        with self._lock:
+            self._copying.discard(relative_path)
+            self._reserved -= size
+            self._entries[relative_path] = size
+            self._size += size
+            self.copies += 1
+            self.copy_bytes += size
+            self.copy_seconds += seconds
+        logger.info(f"Staged model {relative_path}: {size} bytes in {seconds:.1f} seconds ({size / 1024 / 1024 / max(seconds, 1e-6):.0f} MB/s)")
+
+    # make room for a copy, evicting least recently used models that aren't pinned
+    def _reserve(self, size):
+        with self._lock:
+            if self._reserved + size > self.max_bytes:
+                return False
+            evictable = [relative_path for relative_path in self._entries if relative_path not in self._pinned]
+            if self._size - sum(self._entries[relative_path] for relative_path in evictable) + self._reserved + size > self.max_bytes:
+                return False
+            for evicted in evictable:
+                if self._size + self._reserved + size <= self.max_bytes:
+                    break
+                evicted_size = self._entries.pop(evicted)
+                self._size -= evicted_size
+                self.evictions += 1
+                target = os.path.join(self.staging_path, evicted)
+                for path in [target, target + STAGING_META_SUFFIX]:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                logger.info(f"Evicted staged model {evicted} ({evicted_size} bytes)")
+            self._reserved += size
+            return True
+
+    # read the SHA-256 published next to a model on the volume, if any
+    def _read_source_hash(self, source):
+        try:
+            with open(source + SOURCE_HASH_SUFFIX) as hash_file:
+                return hash_file.read().split()[0].lower()
+        except (FileNotFoundError, IndexError):
+            return None
+
+    # index models staged by previous runs, dropping stale or incomplete copies
+    def _load(self):
+        os.makedirs(self.staging_path, exist_ok=True)
+        entries = []
+        for root, _, filenames in os.walk(self.staging_path):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                if filename.endswith(STAGING_PARTIAL_SUFFIX):
+                    os.remove(path)
+                    continue
+                if filename.endswith(STAGING_META_SUFFIX):
+                    continue
+                relative_path = os.path.relpath(path, self.staging_path)
+                source = os.path.join(self.source_path, relative_path)
+                try:
+                    with open(path + STAGING_META_SUFFIX) as meta_file:
+                        meta = json.load(meta_file)
+                    stale = (
+                        os.path.getsize(path) != meta["size"] or
+                        os.path.getsize(source) != meta["size"] or
+                        os.path.getmtime(source) != meta["source_mtime"]
+                    )
+                except (OSError, ValueError, KeyError):
+                    stale = True
+                if stale:
+                    logger.info(f"Removing stale staged model {relative_path}")
+                    for stale_path in [path, path + STAGING_META_SUFFIX]:
+                        if os.path.exists(stale_path):
+                            os.remove(stale_path)
+                    continue
+                entries.append((os.path.getatime(path), relative_path, meta["size"]))
+        for _, relative_path, size in sorted(entries):
+            self._entries[relative_path] = size
+            self._size += size
+        logger.info(f"Found {len(self._entries)} staged models, {self._size} bytes in {self.staging_path}")
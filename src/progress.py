@@ -0,0 +1,184 @@
+# job progress estimation & reporting
+
+import logging
+import time
+import asyncio
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# Module constants
+DEFAULT_NODE_SECONDS = {
+    # node class: expected seconds before any timings were learned
+    "CheckpointLoaderSimple": 5.0,
+    "CLIPTextEncode": 0.2,
+    "KSampler": 10.0,
+    "VAEDecode": 1.0,
+    "VAEEncode": 1.0,
+    "SaveImage": 0.3,
+    "SaveImageWebsocket": 0.3,
+}
+DEFAULT_OTHER_NODE_SECONDS = 0.1
+UNTRACKED_NODE_MAX_FRACTION = 0.9  # Cap on the estimated progress of a node without step updates
+TIMING_SMOOTHING = 0.2  # Weight of the newest job in the learned node timings
+MAX_PROGRESS = 99  # Reported until the job result is returned
+FINAL_PROGRESS = 100  # Reported when the job result is returned
+
+
+# Learned per-workflow node timings
+class StageTimings:
+    """
+    Keeps a moving average of how long each node class takes per workflow key (e.g. workflow & aspect ratio),
+    learned from completed jobs. Shared by all jobs of the worker.
+    """
+
+    def __init__(self, smoothing=TIMING_SMOOTHING):
+        self.smoothing = smoothing
+        self._timings = {}  # workflow key -> {node class: seconds per node}
+        self._lock = threading.Lock()
+
+    def expected(self, workflow_key, class_type):
+        """
+        Returns the expected seconds for one node of a class, learned or default.
+        """
+        with self._lock:
+            seconds = self._timings.get(workflow_key, {}).get(class_type)
+        if seconds is None:
+            seconds = DEFAULT_NODE_SECONDS.get(class_type, DEFAULT_OTHER_NODE_SECONDS)
+        return seconds
+
+    def record(self, workflow_key, node_seconds):
+        """
+        Update the learned timings with the per-node durations of a completed job, by node class.
+        """
+        with self._lock:
+            timings = self._timings.setdefault(workflow_key, {})
+            for class_type, durations in node_seconds.items():
+                seconds = sum(durations) / len(durations)
+                average = timings.get(class_type)
+                timings[class_type] = seconds if average is None else average + self.smoothing * (seconds - average)
+
+    def snapshot(self):
+        with self._lock:
+            return {str(key): dict(timings) for key, timings in self._timings.items()}
+
+
+# Per-job progress estimation & rate-limited reporting
+class ProgressReporter:
+    """
+    Estimates a job's progress & ETA from its ComfyUI execution events and the learned node timings,
+    and reports it from a background task. Reported values only increase, duplicates are dropped,
+    and at most one report is sent per interval, always with the latest value.
+    """
+
+    def __init__(self, send, workflow_key, workflow_data, stage_timings, min_interval_sec=1.0):
+        self.workflow_key = workflow_key
+        self.min_interval_sec = min_interval_sec
+        self.progress = 0  # Latest estimated percentage
+        self.eta_sec = None  # Latest estimated seconds remaining
+        self.sent = 0  # Reports sent
+        self._send = send  # async (percentage, eta_sec)
+        self._stage_timings = stage_timings
+        self._class_types = {node_id: node["class_type"] for node_id, node in workflow_data.items()}
+        self._expected = {node_id: stage_timings.expected(workflow_key, class_type) for node_id, class_type in self._class_types.items()}
+        self._total = sum(self._expected.values()) or 1.0
+        self._done = set()
+        self._cached = set()
+        self.started_at = None  # Monotonic time ComfyUI started executing the prompt
+        self.node_seconds = {}  # node class -> [seconds] of executed nodes
+        self._current = None
+        self._current_started_at = None
+        self._current_fraction = None
+        self._last_sent = 0
+        self._changed = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    # update the estimate from a comfyui event
+    def on_event(self, type, data):
+        """
+        Update the estimate from a ComfyUI WebSocket event. Returns True if the estimated percentage increased.
+        """
+        now = time.monotonic()
+        if self.started_at is None:
+            self.started_at = now
+        if type == "execution_cached":
+            for node_id in data.get("nodes", []):
+                if node_id in self._expected:
+                    self._done.add(node_id)
+                    self._cached.add(node_id)
+        elif type == "executing":
+            self._finish_current(now)
+            node_id = data.get("node")
+            if node_id in self._expected:
+                self._current = node_id
+                self._current_started_at = now
+                self._current_fraction = None
+        elif type == "progress":
+            if data.get("node", self._current) == self._current and data.get("max"):
+                self._current_fraction = float(data["value"]) / float(data["max"])
+        elif type == "execution_success":
+            self._finish_current(now)
+            self._stage_timings.record(self.workflow_key, self.node_seconds)
+        return self._estimate(now)
+
+    async def close(self, finished=False):
+        """
+        Stop reporting, sending the latest value first if it wasn't sent yet.
+        If the job finished, 100% is always sent, without waiting for the interval.
+        """
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if finished:
+            self.progress = FINAL_PROGRESS
+            self.eta_sec = 0.0
+        if self.progress > self._last_sent:
+            await self._report()
+
+    # mark the executing node as done
+    def _finish_current(self, now):
+        if self._current is None:
+            return
+        self._done.add(self._current)
+        self.node_seconds.setdefault(self._class_types[self._current], []).append(now - self._current_started_at)
+        self._current = None
+
+    # estimate progress from the expected durations of done & executing nodes
+    def _estimate(self, now):
+        done = sum(self._expected[node_id] for node_id in self._done)
+        total = self._total - sum(self._expected[node_id] for node_id in self._cached)
+        current = 0.0
+        if self._current is not None:
+            expected = self._expected[self._current]
+            fraction = self._current_fraction
+            if fraction is None:
+                fraction = min((now - self._current_started_at) / expected, UNTRACKED_NODE_MAX_FRACTION) if expected else 0.0
+            current = expected * fraction
+        completed = done - sum(self._expected[node_id] for node_id in self._cached) + current
+        progress = min(MAX_PROGRESS, int(100 * completed / total)) if total > 0 else MAX_PROGRESS
+        self.eta_sec = max(0.0, total - completed)
+        if progress <= self.progress:
+            return False
+        self.progress = progress
+        self._changed.set()
+        return True
+
+    # send the latest value at most once per interval
+    async def _run(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            if self.progress > self._last_sent:
+                await self._report()
+                await asyncio.sleep(self.min_interval_sec)
+
+    async def _report(self):
+        self._last_sent = self.progress
+        self.sent += 1
+        try:
+            await self._send(self.progress, self.eta_sec)
+        except Exception as e:
+            logger.warning(f"Failed to report progress: {str(e)}")
@@ -0,0 +1,213 @@
+# content-addressed result cache
+
+import logging
+import os
+import json
+import hashlib
+import threading
+import collections
+import botocore
+
+from coalescer import OUTPUT_NODE_TYPES
+
+logger = logging.getLogger(__name__)
+
+
+# Module constants
+KEY_VERSION = 1  # Bump to invalidate every cached result
+
+
+# Compute the cache key of a resolved workflow
+def get_cache_key(workflow_data, output_format, quality):
+    """
+    Hashes the fully resolved workflow graph together with the output encoding. Output nodes are
+    normalized so per-job filename prefixes and the output retrieval mode don't change the key.
+    """
+    normalized = {}
+    for node_id, node in workflow_data.items():
+        if node["class_type"] in OUTPUT_NODE_TYPES:
+            node = {"class_type": "output", "inputs": {"images": node["inputs"]["images"]}}
+        normalized[node_id] = node
+    payload = json.dumps([KEY_VERSION, normalized, output_format, quality], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Two-tier cache of encoded output images
+class ResultCache:
+    """
+    Caches encoded output images by cache key in a bounded local disk LRU tier, and optionally
+    in a shared S3 tier so results survive worker restarts and are reused across workers.
+    """
+
+    def __init__(self, path, max_bytes, s3_client=None, bucket=None, s3_prefix=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.s3_prefix = s3_prefix.strip("/") if s3_prefix else None
+        self.hits = 0
+        self.local_hits = 0
+        self.s3_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0  # Bytes of results served from cache instead of generated
+        self.evictions = 0
+        self._entries = collections.OrderedDict()  # filename -> size, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def has_s3_tier(self):
+        return bool(self.s3_client and self.bucket and self.s3_prefix)
+
+    def get_s3_key(self, key, image_index, extension):
+        return f"{self.s3_prefix}/{key}_{image_index}.{extension}"
+
+    # look up all images of a result in the local tier
+    def get_local(self, key, num_images, extension):
+        """
+        Returns the cached images of a result from local disk, or None unless all of them are cached.
+        """
+        images = []
+        with self._lock:
+            for image_index in range(1, num_images + 1):
+                filename = f"{key}_{image_index}.{extension}"
+                if filename not in self._entries:
+                    return None
+                self._entries.move_to_end(filename)
+            for image_index in range(1, num_images + 1):
+                file_path = os.path.join(self.path, f"{key}_{image_index}.{extension}")
+                try:
+                    with open(file_path, "rb") as image_file:
+                        images.append(image_file.read())
+                    os.utime(file_path)
+                except FileNotFoundError:
+                    self._forget(f"{key}_{image_index}.{extension}")
+                    return None
+        return images
+
+    # check that all images of a result exist in the S3 tier
+    def get_s3_size(self, key, num_images, extension):
+        """
+        Returns the total size of the images of a result in the S3 tier, or None unless all of them are stored.
+        """
+        if not self.has_s3_tier():
+            return None
+        size = 0
+        for image_index in range(1, num_images + 1):
+            try:
+                response = self.s3_client.head_object(Bucket=self.bucket, Key=self.get_s3_key(key, image_index, extension))
+                size += response["ContentLength"]
+            except botocore.exceptions.ClientError:
+                return None
+        return size
+
+    # download all images of a result from the S3 tier
+    def get_s3(self, key, num_images, extension):
+        """
+        Returns the images of a result from the S3 tier, or None unless all of them are stored.
+        """
+        if not self.has_s3_tier():
+            return None
+        images = []
+        for image_index in range(1, num_images + 1):
+            try:
+                response = self.s3_client.get_object(Bucket=self.bucket, Key=self.get_s3_key(key, image_index, extension))
+                images.append(response["Body"].read())
+            except botocore.exceptions.ClientError:
+                return None
+        return images
+
+    # store an image of a result in the local tier
+    def put_local(self, key, image_index, extension, image_data):
+        """
+        Writes an image to the local tier, evicting least recently used images over the byte budget.
+        """
+        if self.max_bytes <= 0 or len(image_data) > self.max_bytes:
+            return
+        filename = f"{key}_{image_index}.{extension}"
+        temp_path = os.path.join(self.path, f".{filename}.tmp")
+        with open(temp_path, "wb") as image_file:
+            image_file.write(image_data)
+        os.replace(temp_path, os.path.join(self.path, filename))
+        with self._lock:
+            self._forget(filename)
+            self._entries[filename] = len(image_data)
+            self._size += len(image_data)
+            while self._size > self.max_bytes and self._entries:
+                evicted, _ = next(iter(self._entries.items()))
+                self._forget(evicted)
+                try:
+                    os.remove(os.path.join(self.path, evicted))
+                except FileNotFoundError:
+                    pass
+                self.evictions += 1
+
+    # store an image of a result in the S3 tier
+    def put_s3(self, key, image_index, extension, image_data=None, source_key=None, extra_args=None):
+        """
+        Writes an image to the S3 tier, copying it server-side from an already uploaded object if given.
+        """
+        if not self.has_s3_tier():
+            return
+        s3_key = self.get_s3_key(key, image_index, extension)
+        if source_key:
+            self.s3_client.copy_object(
+                Bucket=self.bucket,
+                Key=s3_key,
+                CopySource={"Bucket": self.bucket, "Key": source_key}
+            )
+        else:
+            self.s3_client.put_object(Bucket=self.bucket, Key=s3_key, Body=bytes(image_data), **(extra_args or {}))
+
+    def record_hit(self, tier, size):
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size
+            if tier == "local":
+                self.local_hits += 1
+            else:
+                self.s3_hits += 1
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def stats(self):
+        """
+        Returns cache statistics for logging & metrics.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "local_hits": self.local_hits,
+                "s3_hits": self.s3_hits,
+                "misses": self.misses,
+                "bytes_saved": self.bytes_saved,
+                "evictions": self.evictions,
+                "local_bytes": self._size,
+                "local_entries": len(self._entries),
+            }
+
+    # remove an entry from the local index
+    def _forget(self, filename):
+        size = self._entries.pop(filename, None)
+        if size is not None:
+            self._size -= size
+
+    # index images left on disk by a previous run, oldest first
+    def _load(self):
+        os.makedirs(self.path, exist_ok=True)
+        entries = []
+        with os.scandir(self.path) as scanner:
+            for entry in scanner:
+                if not entry.is_file():
+                    continue
+                if entry.name.startswith("."):
+                    os.remove(entry.path)
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, filename, size in sorted(entries):
+            self._entries[filename] = size
+            self._size += size
+        logger.info(f"Loaded result cache with {len(self._entries)} images, {self._size} bytes")
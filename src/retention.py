@@ -0,0 +1,217 @@
+# bounded retention of comfyui output, input & temp files
+
+import logging
+import os
+import time
+import shutil
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# Module constants
+SWEEP_INTERVAL_SEC = 300  # How often the directories are scanned & the budgets enforced
+
+
+# Background manager keeping ComfyUI's file directories within budget
+class RetentionManager:
+    """
+    Tracks the files in ComfyUI's output, input & temp directories from a background thread, and deletes
+    files older than the age budget, then the oldest files while over the byte budget or while the disk
+    is low on free space. Scans only stat files they haven't seen before, so huge directories stay cheap.
+    Only files accepted by is_owned (given the file name) are tracked & deleted, other files in the
+    directories are left alone.
+    """
+
+    def __init__(self, directories, max_bytes, max_age_sec, min_free_bytes=0, interval_sec=SWEEP_INTERVAL_SEC, is_owned=None):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.is_owned = is_owned or (lambda name: True)
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        self.min_free_bytes = min_free_bytes
+        self.interval_sec = interval_sec
+        self.sweeps = 0
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+        self.last_sweep_sec = 0.0
+        self._files = {}  # path -> (size, mtime)
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    # start the background sweeps
+    def start(self, orphan_prefixes=None):
+        """
+        Delete orphans left by earlier runs, i.e. files whose names start with one of the given prefixes,
+        then start sweeping in the background.
+        """
+        self.sweep(orphan_prefixes=orphan_prefixes or [])
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    # ask for a sweep soon, e.g. after a failed write
+    def request_sweep(self):
+        self._wakeup.set()
+
+    # delete files of a finished job
+    def remove_files(self, paths):
+        """
+        Delete the given files if they exist, e.g. the artifacts of a finished job.
+        """
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"Failed to remove {path}: {str(e)}")
+                continue
+            with self._lock:
+                self._files.pop(path, None)
+                self.deleted_files += 1
+                self.deleted_bytes += size
+
+    # mark files as recently used
+    def touch(self, paths):
+        """
+        Update the modification time of the given files, e.g. reused input images, so the age & size
+        budgets delete them last.
+        """
+        now = time.time()
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"Failed to touch {path}: {str(e)}")
+                continue
+            with self._lock:
+                if path in self._files:
+                    self._files[path] = (self._files[path][0], now)
+
+    # scan the directories & enforce the budgets
+    def sweep(self, orphan_prefixes=()):
+        """
+        Refresh the file index and delete files over the age, size & free space budgets.
+        """
+        with self._sweep_lock:
+            start_time = time.perf_counter()
+            self._scan()
+            now = time.time()
+            with self._lock:
+                files = sorted(self._files.items(), key=lambda item: item[1][1])  # Oldest first
+            total = sum(size for _, (size, _) in files)
+            doomed = []
+            for path, (size, mtime) in files:
+                name = os.path.basename(path)
+                if (orphan_prefixes and name.startswith(tuple(orphan_prefixes))) or (self.max_age_sec and now - mtime > self.max_age_sec):
+                    doomed.append(path)
+                    total -= size
+            doomed_paths = set(doomed)
+            free_needed = self._free_bytes_needed()
+            for path, (size, _) in files:
+                if not (total > self.max_bytes or free_needed > 0):
+                    break
+                if path in doomed_paths:
+                    continue
+                doomed.append(path)
+                total -= size
+                free_needed -= size
+            if doomed:
+                deleted_files = self.deleted_files
+                self.remove_files(doomed)
+                logger.info(f"Deleted {self.deleted_files - deleted_files} files over the retention budget")
+            self.sweeps += 1
+            self.last_sweep_sec = time.perf_counter() - start_time
+
+    # get disk usage
+    def stats(self):
+        with self._lock:
+            directories = {directory: {"files": 0, "bytes": 0} for directory in self.directories}
+            for path, (size, _) in self._files.items():
+                for directory in self.directories:
+                    if path.startswith(directory + os.sep):
+                        directories[directory]["files"] += 1
+                        directories[directory]["bytes"] += size
+                        break
+        stats = {
+            "directories": directories,
+            "bytes": sum(usage["bytes"] for usage in directories.values()),
+            "max_bytes": self.max_bytes,
+            "deleted_files": self.deleted_files,
+            "deleted_bytes": self.deleted_bytes,
+            "sweeps": self.sweeps,
+            "last_sweep_sec": round(self.last_sweep_sec, 3),
+        }
+        disk = self._disk_usage()
+        if disk:
+            stats["disk_free_bytes"] = disk.free
+            stats["disk_total_bytes"] = disk.total
+        return stats
+
+    # background sweep loop
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval_sec)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                self.sweep()
+                logger.debug(f"Retention stats: {self.stats()}")
+            except Exception as e:
+                logger.error(f"Retention sweep failed: {str(e)}")
+
+    # refresh the file index, only statting new files
+    def _scan(self):
+        seen = {}
+        with self._lock:
+            known = dict(self._files)
+        for directory in self.directories:
+            pending = [directory]
+            while pending:
+                try:
+                    with os.scandir(pending.pop()) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False) and self.is_owned(entry.name):
+                                info = known.get(entry.path)
+                                if info is None:
+                                    try:
+                                        stat = entry.stat(follow_symlinks=False)
+                                    except FileNotFoundError:
+                                        continue
+                                    info = (stat.st_size, stat.st_mtime)
+                                seen[entry.path] = info
+                except FileNotFoundError:
+                    continue
+        with self._lock:
+            self._files = seen
+
+    def _disk_usage(self):
+        for directory in self.directories:
+            try:
+                return shutil.disk_usage(directory)
+            except OSError:
+                continue
+        return None
+
+    def _free_bytes_needed(self):
+        if not self.min_free_bytes:
+            return 0
+        disk = self._disk_usage()
+        return max(0, self.min_free_bytes - disk.free) if disk else 0
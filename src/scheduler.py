@@ -0,0 +1,171 @@
+# model-affinity prompt scheduling
+
+import logging
+import json
+import time
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+
+# Module constants
+CHECKPOINT_INPUTS = ["ckpt_name", "unet_name"]  # Node inputs naming the model a workflow loads
+DURATION_SMOOTHING = 0.2  # Weight of the newest prompt duration in the moving averages
+
+
+# Get the models a workflow loads
+def get_checkpoints(workflow_data):
+    return tuple(sorted(
+        node["inputs"][name]
+        for node in workflow_data.values()
+        for name in CHECKPOINT_INPUTS
+        if name in node["inputs"]
+    ))
+
+
+# Get the signatures of a workflow's nodes, identical nodes across prompts are cached by ComfyUI
+def get_node_signatures(workflow_data):
+    return {
+        json.dumps([node_id, node["class_type"], node["inputs"]], sort_keys=True)
+        for node_id, node in workflow_data.items()
+    }
+
+
+# Orders pending prompts so consecutive prompts share the resident checkpoint
+class ModelScheduler:
+    """
+    Holds prompts until ComfyUI has a free slot, then queues the pending prompt that loads the
+    resident checkpoint & shares the most nodes with the previous prompt, so ComfyUI swaps models
+    less often and reuses more of its execution cache. A prompt is never passed over for longer
+    than the starvation bound.
+    """
+
+    def __init__(self, queue_prompt, wait_prompt, max_in_flight=1, max_wait_sec=30, abandon_prompt=None):
+        self.max_in_flight = max_in_flight
+        self.max_wait_sec = max_wait_sec
+        self.resident_checkpoints = None  # Models loaded by the most recently queued prompt
+        self.dispatched = 0  # Prompts queued to ComfyUI
+        self.swaps = 0  # Prompts that loaded different models than the previous prompt
+        self.swaps_avoided = 0  # Prompts queued ahead of an older prompt that would have swapped models
+        self.starved = 0  # Prompts queued in arrival order because they hit the starvation bound
+        self._queue_prompt = queue_prompt  # async (workflow_data, [events]) -> prompt ID
+        self._wait_prompt = wait_prompt  # async (prompt_id, events), returns once the prompt finished
+        self._abandon_prompt = abandon_prompt  # async (prompt_id, [events], cancel) for jobs gone while queueing
+        self._pending = []
+        self._in_flight = 0
+        self._last_signatures = set()
+        self._swap_duration = None  # Moving average of prompt durations with a model swap
+        self._resident_duration = None  # Moving average of prompt durations without a model swap
+
+    # queue a prompt once it is its turn
+    async def submit(self, workflow_data, event_queues):
+        """
+        Queue a prompt with the given job event queues subscribed to it once the scheduler picks it.
+        Returns the prompt ID.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append({
+            "workflow_data": workflow_data,
+            "event_queues": event_queues,
+            "checkpoints": get_checkpoints(workflow_data),
+            "signatures": get_node_signatures(workflow_data),
+            "submitted_at": time.monotonic(),
+            "future": future,
+        })
+        self._dispatch()
+        return await future
+
+    def set_resident(self, workflow_data):
+        """
+        Record the models of a prompt queued outside the scheduler, e.g. during warm-up.
+        """
+        self.resident_checkpoints = get_checkpoints(workflow_data)
+        self._last_signatures = get_node_signatures(workflow_data)
+
+    def stats(self):
+        """
+        Returns scheduling statistics for logging & metrics. The time saved is estimated from
+        the avoided swaps and the measured extra duration of prompts that swapped models.
+        """
+        swap_cost_sec = 0.0
+        if self._swap_duration is not None and self._resident_duration is not None:
+            swap_cost_sec = max(0.0, self._swap_duration - self._resident_duration)
+        return {
+            "dispatched": self.dispatched,
+            "pending": len(self._pending),
+            "swaps": self.swaps,
+            "swaps_avoided": self.swaps_avoided,
+            "starved": self.starved,
+            "swap_cost_sec": swap_cost_sec,
+            "time_saved_sec": self.swaps_avoided * swap_cost_sec,
+        }
+
+    # queue pending prompts while ComfyUI has free slots
+    def _dispatch(self):
+        # Drop prompts whose jobs were cancelled while pending
+        self._pending = [r for r in self._pending if not r["future"].done()]
+        while self._pending and self._in_flight < self.max_in_flight:
+            request = self._pick()
+            self._pending.remove(request)
+            self._in_flight += 1
+            asyncio.get_running_loop().create_task(self._run(request))
+
+    # pick the next prompt to queue
+    def _pick(self):
+        oldest = self._pending[0]
+        best = max(self._pending, key=lambda r: (
+            r["checkpoints"] == self.resident_checkpoints,
+            len(r["signatures"] & self._last_signatures),
+            -r["submitted_at"],
+        ))
+        if best is oldest:
+            return oldest
+        if time.monotonic() - oldest["submitted_at"] > self.max_wait_sec:
+            self.starved += 1
+            return oldest
+        if oldest["checkpoints"] != self.resident_checkpoints and best["checkpoints"] == self.resident_checkpoints:
+            self.swaps_avoided += 1
+        return best
+
+    # queue a prompt and hold its slot until it finished
+    async def _run(self, request):
+        swapped = self.resident_checkpoints is not None and request["checkpoints"] != self.resident_checkpoints
+        if swapped:
+            self.swaps += 1
+            logger.info(f"Scheduling model swap from {', '.join(self.resident_checkpoints)} to {', '.join(request['checkpoints'])}")
+        self.resident_checkpoints = request["checkpoints"]
+        self._last_signatures = request["signatures"]
+        self.dispatched += 1
+
+        start_time = time.monotonic()
+        events = asyncio.Queue()
+        try:
+            try:
+                prompt_id = await self._queue_prompt(request["workflow_data"], request["event_queues"] + [events])
+            except Exception as e:
+                if not request["future"].done():
+                    request["future"].set_exception(e)
+                return
+            if not request["future"].done():
+                request["future"].set_result(prompt_id)
+            elif self._abandon_prompt:
+                # The job was cancelled while the prompt was being queued
+                await self._abandon_prompt(prompt_id, request["event_queues"], True)
+            try:
+                await self._wait_prompt(prompt_id, events)
+            except Exception as e:
+                logger.warning(f"Scheduled prompt {prompt_id} did not finish cleanly: {str(e)}")
+                return
+            self._record_duration(swapped, time.monotonic() - start_time)
+        finally:
+            self._in_flight -= 1
+            self._dispatch()
+
+    # update the moving average prompt durations
+    def _record_duration(self, swapped, duration):
+        average = self._swap_duration if swapped else self._resident_duration
+        average = duration if average is None else average + DURATION_SMOOTHING * (duration - average)
+        if swapped:
+            self._swap_duration = average
+        else:
+            self._resident_duration = average
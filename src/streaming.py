@@ -0,0 +1,91 @@
+# streamed job updates for the generator handler
+
+import logging
+import time
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+
+# Per-job stream of progress & preview updates
+class JobStream:
+    """
+    Collects a running job's progress and latent previews as updates for the streaming handler to yield.
+    Previews are throttled: a frame is dropped if it arrives within the interval of the last one sent
+    or while the last one is still being encoded, so a slow client never builds up a backlog.
+    """
+
+    def __init__(self, encode_preview, preview_interval_sec, previews=True):
+        self.previews_sent = 0
+        self.previews_dropped = 0
+        self.first_preview_sec = None  # Seconds from the stream's start to its first preview
+        self._encode_preview = encode_preview  # async function, preview frame bytes -> URL of the preview image
+        self._preview_interval_sec = preview_interval_sec
+        self._previews = previews
+        self._started_at = time.monotonic()
+        self._progress = 0
+        self._last_preview_at = None
+        self._encoding = None
+        self._updates = asyncio.Queue()
+
+    # add a progress update
+    def put_progress(self, progress, eta_sec=None):
+        self._progress = progress
+        self._updates.put_nowait({
+            "type": "progress",
+            "progress": progress,
+            "eta_sec": round(eta_sec, 1) if eta_sec is not None else None,
+        })
+
+    # add a latent preview frame, unless throttled
+    def put_preview(self, image_data):
+        """
+        Encode & add the given preview image bytes in the background, or drop them if a preview
+        was sent within the interval or is still being encoded.
+        """
+        if not self._previews:
+            return
+        now = time.monotonic()
+        throttled = self._last_preview_at is not None and now - self._last_preview_at < self._preview_interval_sec
+        if throttled or (self._encoding and not self._encoding.done()):
+            self.previews_dropped += 1
+            return
+        self._last_preview_at = now
+        # Copy the bytes, the frame buffer may be a view into the WebSocket message
+        self._encoding = asyncio.get_running_loop().create_task(self._send_preview(bytes(image_data)))
+
+    async def _send_preview(self, image_data):
+        try:
+            url = await self._encode_preview(image_data)
+        except Exception as e:
+            logger.debug(f"Dropping undecodable preview: {str(e)}")
+            return
+        if self.first_preview_sec is None:
+            self.first_preview_sec = time.monotonic() - self._started_at
+            logger.debug(f"Sent first preview after {self.first_preview_sec:.3f} seconds")
+        self.previews_sent += 1
+        self._updates.put_nowait({"type": "preview", "progress": self._progress, "url": url})
+
+    # stop encoding previews
+    def close(self):
+        if self._encoding and not self._encoding.done():
+            self._encoding.cancel()
+
+    # yield updates until the job finishes
+    async def updates(self, job):
+        """
+        Async generator yielding the stream's updates as they arrive, until the given job task is done
+        and every update added before that has been yielded.
+        """
+        while True:
+            if not self._updates.empty():
+                yield self._updates.get_nowait()
+                continue
+            if job.done():
+                return
+            update = asyncio.ensure_future(self._updates.get())
+            await asyncio.wait([update, job], return_when=asyncio.FIRST_COMPLETED)
+            if update.done():
+                yield update.result()
+            else:
+                update.cancel()
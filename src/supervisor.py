@@ -0,0 +1,167 @@
+# comfyui process supervisor
+
+import logging
+import time
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# Module constants
+POLL_INTERVAL_SEC = 1  # How often the process, websocket & health are checked
+STARTUP_TIMEOUT_SEC = 300  # How long a freshly started instance may take to become healthy
+UNHEALTHY_TIMEOUT_SEC = 30  # How long a ready instance may stay unhealthy before it is restarted
+RESTART_BACKOFF_MIN_SEC = 1  # Delay before the first restart
+RESTART_BACKOFF_MAX_SEC = 60  # Delay cap between repeated restarts
+STABLE_AFTER_SEC = 60  # Healthy time after which the restart backoff is reset
+
+
+# Background supervisor for a managed ComfyUI instance
+class ComfySupervisor:
+    """
+    Watches a ComfyUI process (exit code, websocket liveness & periodic health probes) from a
+    background thread and keeps a cached ready state that jobs can read without any I/O.
+    Crashed or unresponsive instances are restarted with backoff, failing in-flight jobs fast.
+    """
+
+    def __init__(self, start_process, stop_process, probe, socket, name="ComfyUI"):
+        self.name = name
+        self.restarts = 0  # Times the instance was restarted
+        self.last_failure = None  # Reason for the most recent restart
+        self.last_exit_code = None  # Exit code of the most recently crashed process
+        self._start_process = start_process  # Starts the instance, returns a Popen or None if already running
+        self._stop_process = stop_process  # Stops the instance started by start_process
+        self._probe = probe  # Raises if the instance is unhealthy
+        self._socket = socket
+        self._process = None
+        self._launch_error = None
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._started_at = 0.0
+        self._ready_since = None
+        self._unhealthy_since = None
+        self._starting = True  # No health check has passed since the last launch
+        self._backoff = RESTART_BACKOFF_MIN_SEC
+        self._thread = None
+
+    # start the instance and the supervision thread
+    def start(self):
+        """
+        Start the ComfyUI instance and begin supervising it.
+        """
+        self._stopped.clear()
+        self._launch()
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-supervisor", daemon=True)
+        self._thread.start()
+
+    # stop supervising, without stopping the instance
+    def stop(self):
+        """
+        Stop the supervision thread. The instance itself is left to the caller to stop.
+        """
+        self._stopped.set()
+        self._ready.clear()
+        if self._thread:
+            self._thread.join(timeout=POLL_INTERVAL_SEC * 5)
+            self._thread = None
+
+    def is_ready(self):
+        """
+        Returns the cached ready state, without any I/O.
+        """
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        """
+        Block until the instance is ready. Returns True if it became ready within the timeout.
+        """
+        return self._ready.wait(timeout)
+
+    def status(self):
+        """
+        Returns a snapshot of the supervisor state for logging & metrics.
+        """
+        return {
+            "ready": self.is_ready(),
+            "restarts": self.restarts,
+            "last_failure": self.last_failure,
+            "last_exit_code": self.last_exit_code,
+        }
+
+    # supervision loop
+    def _run(self):
+        while not self._stopped.wait(POLL_INTERVAL_SEC):
+            try:
+                self._check()
+            except Exception as e:
+                logger.error(f"{self.name} supervisor check failed: {str(e)}")
+
+    # check the instance once and react to failures
+    def _check(self):
+        now = time.monotonic()
+        if self._launch_error:
+            self._restart(f"{self.name} failed to start: {self._launch_error}")
+            return
+        exit_code = self._process.poll() if self._process else None
+        if exit_code is not None:
+            self.last_exit_code = exit_code
+            self._restart(f"{self.name} process exited with code {exit_code}")
+            return
+
+        healthy = self._socket.is_connected()
+        if healthy:
+            try:
+                self._probe()
+            except Exception as e:
+                healthy = False
+                if self.is_ready():
+                    logger.warning(f"{self.name} health check failed: {str(e)}")
+
+        if healthy:
+            if not self.is_ready():
+                logger.info(f"{self.name} is ready after {now - self._started_at:.1f} seconds")
+                self._ready_since = now
+                self._starting = False
+                self._ready.set()
+            self._unhealthy_since = None
+            if now - self._ready_since > STABLE_AFTER_SEC:
+                self._backoff = RESTART_BACKOFF_MIN_SEC
+            return
+
+        # Unhealthy, allow more time while the instance is still starting up
+        self._ready.clear()
+        self._ready_since = None
+        if self._unhealthy_since is None:
+            self._unhealthy_since = self._started_at if self._starting else now
+        timeout = STARTUP_TIMEOUT_SEC if self._starting else UNHEALTHY_TIMEOUT_SEC
+        if now - self._unhealthy_since > timeout:
+            self._restart(f"{self.name} unresponsive for {timeout} seconds")
+
+    # fail in-flight jobs and restart the instance with backoff
+    def _restart(self, reason):
+        logger.error(f"{reason}, restarting in {self._backoff} seconds")
+        self.last_failure = reason
+        self._ready.clear()
+        self._ready_since = None
+        self._socket.fail_all(reason)
+        try:
+            self._stop_process()
+        except Exception as e:
+            logger.error(f"Failed to stop {self.name}: {str(e)}")
+        if self._stopped.wait(self._backoff):
+            return
+        self._backoff = min(self._backoff * 2, RESTART_BACKOFF_MAX_SEC)
+        self.restarts += 1
+        self._launch()
+
+    # start a fresh instance
+    def _launch(self):
+        self._started_at = time.monotonic()
+        self._unhealthy_since = None
+        self._starting = True
+        self._launch_error = None
+        try:
+            self._process = self._start_process()
+        except Exception as e:
+            self._launch_error = str(e)
+            self._process = None
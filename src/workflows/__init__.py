@@ -1,40 +1,108 @@
 # workflows package
 
+import logging
+import os
+import json
+import time
+import types
 import pathlib
 import importlib
+import threading
+
+from .templates.api_json import build_json_workflow_loader
+
+logger = logging.getLogger(__name__)
 
 # Module constants
 DEFAULT_WORKFLOW_NAME = "sd_1_5"  # Default workflow
+WORKFLOWS_JSON_PATH = os.getenv("WORKFLOWS_JSON_PATH", "")  # Directory of ComfyUI API-format JSON workflows, e.g. on the network volume
+WORKFLOWS_RESCAN_INTERVAL_SEC = float(os.getenv("WORKFLOWS_RESCAN_INTERVAL_SEC", "5"))  # Minimum time between checks for added or removed workflows
 
 # Module memory
-_workflows = {}  # Dictionary to store all workflow modules
+_workflows = {}  # Dictionary to store loaded workflow modules
+_workflow_sources = {}  # Workflow name -> Python module name or JSON file path, loaded on first use
 _available_workflows = ""  # Description of available workflows
+_workflow_names = []  # Sorted names of available workflows
+_workflow_dirs_mtime = None  # Modification times of the workflow directories at the last discovery
+_checked_at = 0.0  # Monotonic time of the last check for added or removed workflows
+_workflows_lock = threading.Lock()
 
-# Load all workflows on module import
-def _load_workflows():
-    global _workflows, _available_workflows
-    print("Loading workflows")
+# Get the modification times of the directories workflows are found in
+def _get_workflow_dirs_mtime():
+    paths = [pathlib.Path(__file__).parent]
+    if WORKFLOWS_JSON_PATH:
+        paths.append(pathlib.Path(WORKFLOWS_JSON_PATH))
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(path.stat().st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+# Find available workflows without importing them
+def _discover_workflows():
+    global _workflow_sources, _available_workflows, _workflow_names, _workflow_dirs_mtime
+    _workflow_dirs_mtime = _get_workflow_dirs_mtime()
     package_name = __package__ or pathlib.Path(__file__).parent.name
+    sources = {}
     for f in pathlib.Path(__file__).parent.glob("*.py"):
-        if f.name != "__init__.py" and f.name != "templates":
-            module_name = f.stem
-            try:
-                print(f"Importing workflow {module_name} from {package_name}")
-                module = importlib.import_module(f".{module_name}", package=package_name)
-                _workflows[module_name] = module
-            except ImportError as e:
-                print(f"WARNING: Failed to import {module_name}: {str(e)}")
-    _available_workflows = ", ".join(_workflows.keys())
-
-# Load workflows when this module is imported
-_load_workflows()
+        if f.name != "__init__.py":
+            sources[f.stem] = ("module", f".{f.stem}", package_name)
+    if WORKFLOWS_JSON_PATH and os.path.isdir(WORKFLOWS_JSON_PATH):
+        for f in pathlib.Path(WORKFLOWS_JSON_PATH).glob("*.json"):
+            if f.stem in sources:
+                logger.warning(f"Ignoring JSON workflow {f}, a workflow named {f.stem} already exists")
+                continue
+            sources[f.stem] = ("json", str(f), package_name)
+    _workflow_sources = sources
+    _workflow_names = sorted(sources.keys())
+    _available_workflows = ", ".join(_workflow_names)
+
+# Find workflows again if files were added or removed since the last discovery, at most once per interval
+def _refresh_workflows():
+    global _checked_at
+    now = time.monotonic()
+    if now - _checked_at < WORKFLOWS_RESCAN_INTERVAL_SEC:
+        return
+    _checked_at = now
+    if _get_workflow_dirs_mtime() != _workflow_dirs_mtime:
+        _discover_workflows()
+
+# Import a workflow module or compile a JSON workflow
+def _load_workflow(workflow_name):
+    kind, source, package_name = _workflow_sources[workflow_name]
+    if kind == "module":
+        logger.info(f"Importing workflow {workflow_name} from {package_name}")
+        return importlib.import_module(source, package=package_name)
+    logger.info(f"Loading JSON workflow {workflow_name} from {source}")
+    with open(source) as workflow_file:
+        workflow_data = json.load(workflow_file)
+    module = types.ModuleType(f"{package_name}.{workflow_name}")
+    module.load = build_json_workflow_loader(workflow_data)
+    return module
+
+# Find workflows when this module is imported
+_discover_workflows()
 
 # Get a workflow by name
 def get_workflow(workflow_name):
-    global _workflows, _available_workflows
-    if workflow_name not in _workflows:
-        raise ValueError(f"ERROR: Workflow '{workflow_name}' not found. Available workflows: {_available_workflows}")
-    return _workflows[workflow_name]
+    with _workflows_lock:
+        if workflow_name in _workflows:
+            return _workflows[workflow_name]
+        if workflow_name not in _workflow_sources:
+            # Pick up JSON workflows added since startup
+            _refresh_workflows()
+        if workflow_name not in _workflow_sources:
+            raise ValueError(f"ERROR: Workflow '{workflow_name}' not found. Available workflows: {_available_workflows}")
+        _workflows[workflow_name] = _load_workflow(workflow_name)
+        return _workflows[workflow_name]
+
+# Get the names of all available workflows
+def get_workflow_names():
+    with _workflows_lock:
+        _refresh_workflows()
+        return list(_workflow_names)
 
 # Get the default workflow
 def get_default_workflow():
@@ -0,0 +1,18 @@
+from .templates.image_to_image import build_workflow_loader
+
+SD_CHECKPOINT_NAME = "v1-5-pruned-emaonly.safetensors"
+NEGATIVE_PROMPT = "text, watermark, blurry, low quality, bad quality"
+SAMPLER_CFG = 9
+SAMPLER_STEPS = 40
+SAMPLER_DENOISE = 1
+MAX_IMAGE_SIZE = 768
+
+load = build_workflow_loader(
+    SD_CHECKPOINT_NAME,
+    NEGATIVE_PROMPT,
+    MAX_IMAGE_SIZE,
+    SAMPLER_STEPS,
+    SAMPLER_CFG,
+    sampler_denoise=SAMPLER_DENOISE,
+    inpaint=True,
+)
@@ -0,0 +1,21 @@
+from .templates.high_resolution import build_workflow_loader
+
+SD_CHECKPOINT_NAME = "sdxl_lightning_4step.safetensors"
+NEGATIVE_PROMPT = "text, watermark, blurry, low quality, bad quality"
+SAMPLER_ALGORITHM = "dpmpp_sde"
+SAMPLER_CFG = 1.5
+SAMPLER_STEPS = 4
+UPSCALE_DENOISE = 0.35
+NATIVE_IMAGE_SIZE = 1024
+MAX_IMAGE_SIZE = 2048
+
+load = build_workflow_loader(
+    SD_CHECKPOINT_NAME,
+    NEGATIVE_PROMPT,
+    NATIVE_IMAGE_SIZE,
+    MAX_IMAGE_SIZE,
+    SAMPLER_STEPS,
+    SAMPLER_CFG,
+    SAMPLER_ALGORITHM,
+    upscale_denoise=UPSCALE_DENOISE,
+)
@@ -1,13 +1,23 @@
 # templates package
 
+# Module constants
+DIMENSION_MULTIPLE = 64  # Latent-friendly image size multiple (VAE factor 8 x UNet downsampling 8)
+COMPILED_CACHE_SIZE = 32  # Compiled graphs kept per workflow, one per aspect ratio & output mode
+AUTO_TILE_SIZE_META = "auto_tile_size"  # _meta flag of tiled VAE nodes whose tile size the worker sets per GPU
+
 # Calculate image height & width based on max size & aspect ratio
-def calculate_dimensions(max_size: int, aspect_ratio: str) -> tuple[int, int]:
+def calculate_dimensions(max_size: int, aspect_ratio: str, multiple: int = DIMENSION_MULTIPLE) -> tuple[int, int]:
     # Parse aspect ratio string (e.g., "16:9" -> [16, 9])
-    width_ratio, height_ratio = map(int, aspect_ratio.replace('_', ':').split(':'))
-    
+    try:
+        width_ratio, height_ratio = map(int, aspect_ratio.replace('_', ':').split(':'))
+    except ValueError:
+        raise ValueError(f"ERROR: Invalid aspect ratio '{aspect_ratio}', expected e.g. '16_9'")
+    if width_ratio <= 0 or height_ratio <= 0:
+        raise ValueError(f"ERROR: Invalid aspect ratio '{aspect_ratio}', expected e.g. '16_9'")
+
     # Calculate aspect ratio as a float
     ratio = width_ratio / height_ratio
-    
+
     # If width is larger in the ratio (e.g., 16:9)
     if ratio > 1:
         width = max_size
@@ -16,5 +26,21 @@ def calculate_dimensions(max_size: int, aspect_ratio: str) -> tuple[int, int]:
     else:
         height = max_size
         width = int(max_size * ratio)
-    
+
+    # Snap to the nearest latent-friendly multiple
+    width = max(multiple, round(width / multiple) * multiple)
+    height = max(multiple, round(height / multiple) * multiple)
+
     return width, height
+
+# Copy a compiled workflow with some node inputs replaced
+def patch_workflow(workflow_data, patches):
+    """
+    Returns a copy of a compiled workflow with the given (node ID, input name) -> value patches applied.
+    Only patched nodes are copied, all other nodes are shared with the compiled workflow and must not be modified.
+    """
+    workflow_data = dict(workflow_data)
+    for (node_id, input_name), value in patches.items():
+        node = workflow_data[node_id]
+        workflow_data[node_id] = {**node, "inputs": {**node["inputs"], input_name: value}}
+    return workflow_data
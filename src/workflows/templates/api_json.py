@@ -0,0 +1,103 @@
+import copy
+import functools
+
+from . import COMPILED_CACHE_SIZE, calculate_dimensions, patch_workflow
+from .stable_diffusion import random_seed
+
+# Node inputs patched per job
+SEED_INPUTS = ["seed", "noise_seed"]
+LATENT_INPUTS = ["width", "height", "batch_size"]
+
+# Check that a workflow is in ComfyUI's API format (exported with "Save (API Format)")
+def validate_api_workflow(workflow_data):
+    if not isinstance(workflow_data, dict) or "nodes" in workflow_data:
+        raise ValueError("ERROR: Workflow is not in ComfyUI API format, export it with 'Save (API Format)'")
+    for node_id, node in workflow_data.items():
+        if not isinstance(node, dict) or "class_type" not in node or "inputs" not in node:
+            raise ValueError(f"ERROR: Workflow node {node_id} is missing 'class_type' or 'inputs'")
+
+# Create loader for a ComfyUI API-format workflow
+def build_json_workflow_loader(workflow_data):
+
+    validate_api_workflow(workflow_data)
+
+    # Find the nodes jobs patch: sampler seeds, the positive prompt encodes, empty latents & image outputs
+    seed_inputs = [
+        (node_id, name)
+        for node_id, node in workflow_data.items()
+        for name in SEED_INPUTS
+        if name in node["inputs"]
+    ]
+    prompt_nodes = []
+    for node_id, name in seed_inputs:
+        positive = workflow_data[node_id]["inputs"].get("positive")
+        if isinstance(positive, list) and "text" in workflow_data.get(positive[0], {}).get("inputs", {}):
+            prompt_nodes.append(positive[0])
+    latent_nodes = [
+        node_id for node_id, node in workflow_data.items()
+        if all(name in node["inputs"] for name in LATENT_INPUTS)
+    ]
+    save_nodes = [node_id for node_id, node in workflow_data.items() if node["class_type"] == "SaveImage"]
+    if not prompt_nodes:
+        raise ValueError("ERROR: Workflow has no sampler with a positive text prompt")
+    if not save_nodes:
+        raise ValueError("ERROR: Workflow has no SaveImage node")
+    max_size = max(
+        (max(workflow_data[node_id]["inputs"]["width"], workflow_data[node_id]["inputs"]["height"]) for node_id in latent_nodes),
+        default=None
+    )
+
+    # Build the graph for an aspect ratio & output mode once, jobs patch in their prompt, seed & prefix
+    @functools.lru_cache(maxsize=COMPILED_CACHE_SIZE)
+    def compile(aspect_ratio, output_mode):
+
+        compiled = copy.deepcopy(workflow_data)
+
+        if max_size:
+            image_width, image_height = calculate_dimensions(max_size, aspect_ratio)
+            for node_id in latent_nodes:
+                compiled[node_id]["inputs"].update(width=image_width, height=image_height)
+
+        # Send output images over the websocket instead of writing them to disk
+        if output_mode == "websocket":
+            for node_id in save_nodes:
+                compiled[node_id] = {
+                    "class_type": "SaveImageWebsocket",
+                    "inputs": {
+                        "images": compiled[node_id]["inputs"]["images"]
+                    }
+                }
+
+        return compiled
+
+    # Loader for ComfyUI API-format workflow
+    def load(
+        positive_prompt,
+        aspect_ratio,
+        job_id,
+        filename_prefix,
+        output_mode="file",
+        num_images=1,
+        seeds=None
+    ):
+
+        filename_prefix = f"{filename_prefix}_{job_id}"
+
+        if seeds and len(seeds) > 1:
+            raise ValueError("ERROR: Per-image seeds are not supported for JSON workflows, pass a single seed")
+        seed = seeds[0] if seeds else random_seed()
+
+        patches = {}
+        for node_id, name in seed_inputs:
+            patches[(node_id, name)] = seed
+        for node_id in prompt_nodes:
+            patches[(node_id, "text")] = positive_prompt
+        for node_id in latent_nodes:
+            patches[(node_id, "batch_size")] = num_images
+        if output_mode != "websocket":
+            for node_id in save_nodes:
+                patches[(node_id, "filename_prefix")] = filename_prefix
+
+        return patch_workflow(compile(aspect_ratio, output_mode), patches)
+
+    return load
@@ -0,0 +1,225 @@
+import copy
+import functools
+
+from . import AUTO_TILE_SIZE_META, COMPILED_CACHE_SIZE, calculate_dimensions, patch_workflow
+from .stable_diffusion import random_seed
+
+# Module constants
+DEFAULT_TILE_SIZE = 512  # VAE tile size, the worker sets it for the GPU of the instance running the prompt
+
+# Create loader for large-resolution stable diffusion workflow
+def build_workflow_loader(
+    sd_checkpoint_name,
+    negative_prompt,
+    native_size,
+    max_size,
+    sampler_steps,
+    sampler_cfg,
+    sampler_algorithm="euler",
+    sampler_scheduler="normal",
+    upscale_steps=None,
+    upscale_denoise=0.35,
+    upscale_method="lanczos",
+):
+
+    # Generate at the model's native size, then upscale & refine with a low-denoise second pass
+    upscale = max_size > native_size
+    upscale_steps = upscale_steps or sampler_steps
+
+    # Build the graph for an aspect ratio & output mode once, jobs patch in their prompt, seed & prefix
+    @functools.lru_cache(maxsize=COMPILED_CACHE_SIZE)
+    def compile(aspect_ratio, output_mode):
+
+        native_width, native_height = calculate_dimensions(native_size, aspect_ratio)
+        image_width, image_height = calculate_dimensions(max_size, aspect_ratio)
+
+        workflow_data = {
+
+            "3": {
+                "class_type": "KSampler",
+                "inputs": {
+                    "model": ["4", 0],
+                    "positive": ["6", 0],
+                    "negative": ["7", 0],
+                    "latent_image": ["5", 0],
+                    "seed": None,
+                    "steps": sampler_steps,
+                    "cfg": sampler_cfg,
+                    "sampler_name": sampler_algorithm,
+                    "scheduler": sampler_scheduler,
+                    "denoise": 1
+                }
+            },
+
+            "4": {
+                "class_type": "CheckpointLoaderSimple",
+                "inputs": {
+                    "ckpt_name": sd_checkpoint_name
+                }
+            },
+
+            "5": {
+                "class_type": "EmptyLatentImage",
+                "inputs": {
+                    "width": native_width,
+                    "height": native_height,
+                    "batch_size": 1
+                }
+            },
+
+            "6": {
+                "class_type": "CLIPTextEncode",
+                "inputs": {
+                    "clip": ["4", 1],
+                    "text": None
+                }
+            },
+
+            "7": {
+                "class_type": "CLIPTextEncode",
+                "inputs": {
+                    "clip": ["4", 1],
+                    "text": negative_prompt
+                }
+            },
+
+            # Decode in tiles, so VAE memory is bounded by the tile size instead of the image size
+            "8": {
+                "class_type": "VAEDecodeTiled",
+                "inputs": {
+                    "samples": ["3", 0],
+                    "vae": ["4", 2],
+                    "tile_size": DEFAULT_TILE_SIZE,
+                    "overlap": DEFAULT_TILE_SIZE // 8,
+                    "temporal_size": 64,
+                    "temporal_overlap": 8
+                },
+                "_meta": {AUTO_TILE_SIZE_META: True}
+            },
+
+            "9": {
+                "class_type": "SaveImage",
+                "inputs": {
+                    "images": ["8", 0],
+                    "filename_prefix": None
+                }
+            }
+
+        }
+
+        if upscale:
+            workflow_data.update({
+                "10": {
+                    "class_type": "ImageScale",
+                    "inputs": {
+                        "image": ["8", 0],
+                        "upscale_method": upscale_method,
+                        "width": image_width,
+                        "height": image_height,
+                        "crop": "center"
+                    }
+                },
+                "11": {
+                    "class_type": "VAEEncodeTiled",
+                    "inputs": {
+                        "pixels": ["10", 0],
+                        "vae": ["4", 2],
+                        "tile_size": DEFAULT_TILE_SIZE,
+                        "overlap": DEFAULT_TILE_SIZE // 8,
+                        "temporal_size": 64,
+                        "temporal_overlap": 8
+                    },
+                    "_meta": {AUTO_TILE_SIZE_META: True}
+                },
+                # Second pass at the output size with the same seed, only refining details
+                "12": {
+                    "class_type": "KSampler",
+                    "inputs": {
+                        "model": ["4", 0],
+                        "positive": ["6", 0],
+                        "negative": ["7", 0],
+                        "latent_image": ["11", 0],
+                        "seed": None,
+                        "steps": upscale_steps,
+                        "cfg": sampler_cfg,
+                        "sampler_name": sampler_algorithm,
+                        "scheduler": sampler_scheduler,
+                        "denoise": upscale_denoise
+                    }
+                },
+                "13": {
+                    "class_type": "VAEDecodeTiled",
+                    "inputs": {
+                        "samples": ["12", 0],
+                        "vae": ["4", 2],
+                        "tile_size": DEFAULT_TILE_SIZE,
+                        "overlap": DEFAULT_TILE_SIZE // 8,
+                        "temporal_size": 64,
+                        "temporal_overlap": 8
+                    },
+                    "_meta": {AUTO_TILE_SIZE_META: True}
+                },
+            })
+            workflow_data["9"]["inputs"]["images"] = ["13", 0]
+
+        # Send output images over the websocket instead of writing them to disk
+        if output_mode == "websocket":
+            workflow_data["9"] = {
+                "class_type": "SaveImageWebsocket",
+                "inputs": {
+                    "images": workflow_data["9"]["inputs"]["images"]
+                }
+            }
+
+        return workflow_data
+
+    # Loader for large-resolution stable diffusion workflow
+    def load(
+        positive_prompt,
+        aspect_ratio,
+        job_id,
+        filename_prefix,
+        output_mode="file",
+        num_images=1,
+        seeds=None
+    ):
+
+        filename_prefix = f"{filename_prefix}_{job_id}"
+
+        # One seed generates the whole batch from a single batched latent,
+        # explicit per-image seeds each get their own sampler branch
+        seeds = list(seeds) if seeds else [random_seed()]
+        batch_size = num_images if len(seeds) == 1 else 1
+
+        patches = {
+            ("3", "seed"): seeds[0],
+            ("5", "batch_size"): batch_size,
+            ("6", "text"): positive_prompt,
+        }
+        if upscale:
+            patches[("12", "seed")] = seeds[0]
+        if output_mode != "websocket":
+            patches[("9", "filename_prefix")] = filename_prefix
+        workflow_data = patch_workflow(compile(aspect_ratio, output_mode), patches)
+
+        # Extra branches from the first sampler to the save node, sharing the checkpoint, latent & prompt encodes
+        for index, seed in enumerate(seeds[1:], start=1):
+            branch_ids = {node_id: f"{node_id}_{index}" for node_id in BRANCH_NODES}
+            for node_id, branch_id in branch_ids.items():
+                node = copy.deepcopy(workflow_data[node_id])
+                for name, value in node["inputs"].items():
+                    if isinstance(value, list) and len(value) == 2 and value[0] in branch_ids:
+                        node["inputs"][name] = [branch_ids[value[0]], value[1]]
+                if node["class_type"] == "KSampler":
+                    node["inputs"]["seed"] = seed
+                if "filename_prefix" in node["inputs"]:
+                    # Own prefix per branch, so each saved file belongs to a known seed
+                    node["inputs"]["filename_prefix"] = f"{filename_prefix}-{index}"
+                workflow_data[branch_id] = node
+
+        return workflow_data
+
+    # Nodes per output image, by ID
+    BRANCH_NODES = ["3", "8", "10", "11", "12", "13", "9"] if upscale else ["3", "8", "9"]
+
+    return load
@@ -0,0 +1,231 @@
+import copy
+import functools
+
+from . import COMPILED_CACHE_SIZE, calculate_dimensions, patch_workflow
+from .stable_diffusion import random_seed
+
+# Create loader for stable diffusion img2img & inpainting workflows
+def build_workflow_loader(
+    sd_checkpoint_name,
+    negative_prompt,
+    max_size,
+    sampler_steps,
+    sampler_cfg,
+    sampler_algorithm="euler",
+    sampler_scheduler="normal",
+    sampler_denoise=0.75,
+    inpaint=False,
+):
+
+    # Build the graph for an aspect ratio & output mode once, jobs patch in their images, prompt, seed & prefix
+    @functools.lru_cache(maxsize=COMPILED_CACHE_SIZE)
+    def compile(aspect_ratio, output_mode):
+
+        image_width, image_height = calculate_dimensions(max_size, aspect_ratio)
+
+        workflow_data = {
+
+            "3": {
+                "class_type": "KSampler",
+                "inputs": {
+                    "model": ["4", 0],
+                    "positive": ["6", 0],
+                    "negative": ["7", 0],
+                    "latent_image": ["5", 0],
+                    "seed": None,
+                    "steps": sampler_steps,
+                    "cfg": sampler_cfg,
+                    "sampler_name": sampler_algorithm,
+                    "scheduler": sampler_scheduler,
+                    "denoise": sampler_denoise
+                }
+            },
+
+            "4": {
+                "class_type": "CheckpointLoaderSimple",
+                "inputs": {
+                    "ckpt_name": sd_checkpoint_name
+                }
+            },
+
+            "5": {
+                "class_type": "RepeatLatentBatch",
+                "inputs": {
+                    "samples": ["12", 0],
+                    "amount": 1
+                }
+            },
+
+            "6": {
+                "class_type": "CLIPTextEncode",
+                "inputs": {
+                    "clip": ["4", 1],
+                    "text": None
+                }
+            },
+
+            "7": {
+                "class_type": "CLIPTextEncode",
+                "inputs": {
+                    "clip": ["4", 1],
+                    "text": negative_prompt
+                }
+            },
+
+            "8": {
+                "class_type": "VAEDecode",
+                "inputs": {
+                    "samples": ["3", 0],
+                    "vae": ["4", 2]
+                }
+            },
+
+            "9": {
+                "class_type": "SaveImage",
+                "inputs": {
+                    "images": ["8", 0],
+                    "filename_prefix": None
+                }
+            },
+
+            "10": {
+                "class_type": "LoadImage",
+                "inputs": {
+                    "image": None
+                }
+            },
+
+            # Crop & scale the input image to the output size
+            "11": {
+                "class_type": "ImageScale",
+                "inputs": {
+                    "image": ["10", 0],
+                    "upscale_method": "lanczos",
+                    "width": image_width,
+                    "height": image_height,
+                    "crop": "center"
+                }
+            },
+
+            "12": {
+                "class_type": "VAEEncode",
+                "inputs": {
+                    "pixels": ["11", 0],
+                    "vae": ["4", 2]
+                }
+            }
+
+        }
+
+        # Only repaint the white areas of the mask, scaled & cropped like the input image
+        if inpaint:
+            workflow_data.update({
+                "13": {
+                    "class_type": "LoadImageMask",
+                    "inputs": {
+                        "image": None,
+                        "channel": "red"
+                    }
+                },
+                "14": {
+                    "class_type": "MaskToImage",
+                    "inputs": {
+                        "mask": ["13", 0]
+                    }
+                },
+                "15": {
+                    "class_type": "ImageScale",
+                    "inputs": {
+                        "image": ["14", 0],
+                        "upscale_method": "bilinear",
+                        "width": image_width,
+                        "height": image_height,
+                        "crop": "center"
+                    }
+                },
+                "16": {
+                    "class_type": "ImageToMask",
+                    "inputs": {
+                        "image": ["15", 0],
+                        "channel": "red"
+                    }
+                },
+                "17": {
+                    "class_type": "SetLatentNoiseMask",
+                    "inputs": {
+                        "samples": ["12", 0],
+                        "mask": ["16", 0]
+                    }
+                },
+            })
+            workflow_data["5"]["inputs"]["samples"] = ["17", 0]
+
+        # Send output images over the websocket instead of writing them to disk
+        if output_mode == "websocket":
+            workflow_data["9"] = {
+                "class_type": "SaveImageWebsocket",
+                "inputs": {
+                    "images": ["8", 0]
+                }
+            }
+
+        return workflow_data
+
+    # Loader for stable diffusion img2img & inpainting workflows
+    def load(
+        positive_prompt,
+        aspect_ratio,
+        job_id,
+        filename_prefix,
+        output_mode="file",
+        num_images=1,
+        seeds=None,
+        input_images=None,
+        denoise=None
+    ):
+
+        input_images = input_images or {}
+        for name in INPUT_IMAGES:
+            if name not in input_images:
+                raise ValueError(f"ERROR: Workflow requires an input '{name}'")
+        filename_prefix = f"{filename_prefix}_{job_id}"
+
+        # One seed generates the whole batch from a repeated latent,
+        # explicit per-image seeds each get their own sampler branch
+        seeds = list(seeds) if seeds else [random_seed()]
+        batch_size = num_images if len(seeds) == 1 else 1
+
+        patches = {
+            ("3", "seed"): seeds[0],
+            ("5", "amount"): batch_size,
+            ("6", "text"): positive_prompt,
+            ("10", "image"): input_images["image"],
+        }
+        if inpaint:
+            patches[("13", "image")] = input_images["mask"]
+        if denoise is not None:
+            patches[("3", "denoise")] = denoise
+        if output_mode != "websocket":
+            patches[("9", "filename_prefix")] = filename_prefix
+        workflow_data = patch_workflow(compile(aspect_ratio, output_mode), patches)
+
+        # Extra sampler, decode & save branches sharing the checkpoint, latent & prompt encodes
+        for index, seed in enumerate(seeds[1:], start=1):
+            sampler_id, decode_id, save_id = f"3_{index}", f"8_{index}", f"9_{index}"
+            workflow_data[sampler_id] = copy.deepcopy(workflow_data["3"])
+            workflow_data[sampler_id]["inputs"]["seed"] = seed
+            workflow_data[decode_id] = copy.deepcopy(workflow_data["8"])
+            workflow_data[decode_id]["inputs"]["samples"] = [sampler_id, 0]
+            workflow_data[save_id] = copy.deepcopy(workflow_data["9"])
+            workflow_data[save_id]["inputs"]["images"] = [decode_id, 0]
+            if output_mode != "websocket":
+                # Own prefix per branch, so each saved file belongs to a known seed
+                workflow_data[save_id]["inputs"]["filename_prefix"] = f"{filename_prefix}-{index}"
+
+        return workflow_data
+
+    # Input images jobs must provide, by name
+    INPUT_IMAGES = ["image", "mask"] if inpaint else ["image"]
+    load.input_images = INPUT_IMAGES
+
+    return load
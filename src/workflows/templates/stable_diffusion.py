@@ -1,6 +1,12 @@
+import copy
 import random
+import functools
 
-from . import calculate_dimensions
+from . import COMPILED_CACHE_SIZE, calculate_dimensions, patch_workflow
+
+# Generate a random sampler seed
+def random_seed():
+    return random.randint(10**14, 10**15 - 1)
 
 # Create loader for standard stable diffusion workflow
 def build_workflow_loader(
@@ -14,17 +20,9 @@ def build_workflow_loader(
     sampler_denoise=1,
 ):
 
-    # Loader for standard stable diffusion workflow
-    def load(
-        positive_prompt,
-        aspect_ratio,
-        job_id,
-        filename_prefix
-    ):
-
-        filename_prefix = f"{filename_prefix}_{job_id}"
-
-        random_seed = random.randint(10**14, 10**15 - 1)
+    # Build the graph for an aspect ratio & output mode once, jobs patch in their prompt, seed & prefix
+    @functools.lru_cache(maxsize=COMPILED_CACHE_SIZE)
+    def compile(aspect_ratio, output_mode):
 
         image_width, image_height = calculate_dimensions(max_size, aspect_ratio)
 
@@ -37,7 +35,7 @@ def build_workflow_loader(
                     "positive": ["6", 0],
                     "negative": ["7", 0],
                     "latent_image": ["5", 0],
-                    "seed": random_seed,
+                    "seed": None,
                     "steps": sampler_steps,
                     "cfg": sampler_cfg,
                     "sampler_name": sampler_algorithm,
@@ -66,7 +64,7 @@ def build_workflow_loader(
                 "class_type": "CLIPTextEncode",
                 "inputs": {
                     "clip": ["4", 1],
-                    "text": positive_prompt
+                    "text": None
                 }
             },
 
@@ -90,11 +88,62 @@ def build_workflow_loader(
                 "class_type": "SaveImage",
                 "inputs": {
                     "images": ["8", 0],
-                    "filename_prefix": filename_prefix
+                    "filename_prefix": None
+                }
+            }
+
+        }
+
+        # Send output images over the websocket instead of writing them to disk
+        if output_mode == "websocket":
+            workflow_data["9"] = {
+                "class_type": "SaveImageWebsocket",
+                "inputs": {
+                    "images": ["8", 0]
                 }
             }
 
+        return workflow_data
+
+    # Loader for standard stable diffusion workflow
+    def load(
+        positive_prompt,
+        aspect_ratio,
+        job_id,
+        filename_prefix,
+        output_mode="file",
+        num_images=1,
+        seeds=None
+    ):
+
+        filename_prefix = f"{filename_prefix}_{job_id}"
+
+        # One seed generates the whole batch from a single batched latent,
+        # explicit per-image seeds each get their own sampler branch
+        seeds = list(seeds) if seeds else [random_seed()]
+        batch_size = num_images if len(seeds) == 1 else 1
+
+        patches = {
+            ("3", "seed"): seeds[0],
+            ("5", "batch_size"): batch_size,
+            ("6", "text"): positive_prompt,
         }
+        if output_mode != "websocket":
+            patches[("9", "filename_prefix")] = filename_prefix
+        workflow_data = patch_workflow(compile(aspect_ratio, output_mode), patches)
+
+        # Extra sampler, decode & save branches sharing the checkpoint, latent & prompt encodes
+        for index, seed in enumerate(seeds[1:], start=1):
+            sampler_id, decode_id, save_id = f"3_{index}", f"8_{index}", f"9_{index}"
+            workflow_data[sampler_id] = copy.deepcopy(workflow_data["3"])
+            workflow_data[sampler_id]["inputs"]["seed"] = seed
+            workflow_data[decode_id] = copy.deepcopy(workflow_data["8"])
+            workflow_data[decode_id]["inputs"]["samples"] = [sampler_id, 0]
+            workflow_data[save_id] = copy.deepcopy(workflow_data["9"])
+            workflow_data[save_id]["inputs"]["images"] = [decode_id, 0]
+            if output_mode != "websocket":
+                # Own prefix per branch, so each saved file belongs to a known seed
+                workflow_data[save_id]["inputs"]["filename_prefix"] = f"{filename_prefix}-{index}"
 
         return workflow_data
     
@@ -0,0 +1,130 @@
+# shared fixtures, running stand-in comfyui servers from bench/fake_comfyui.py
+
+import os
+import sys
+import time
+import signal
+import socket
+import subprocess
+
+import pytest
+import requests
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_PATH, "src"))
+sys.path.insert(0, os.path.join(ROOT_PATH, "bench"))
+
+FAKE_COMFYUI_PATH = os.path.join(ROOT_PATH, "bench", "fake_comfyui.py")
+
+
+# Pick an unused local port
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# A stand-in ComfyUI process that can be started, crashed, frozen & probed like a real one
+class FakeComfyUI:
+
+    def __init__(self, output_path, *args):
+        self.port = get_free_port()
+        self.web_url = f"http://127.0.0.1:{self.port}"
+        self.ws_url = f"ws://127.0.0.1:{self.port}/ws"
+        self.output_path = output_path
+        self.args = list(args)
+        self.process = None
+        self.starts = 0
+
+    def start(self):
+        self.starts += 1
+        self.process = subprocess.Popen(
+            [sys.executable, FAKE_COMFYUI_PATH, "--port", str(self.port), "--output-path", self.output_path] + self.args,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        return self.process
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            os.killpg(os.getpgid(self.process.pid), signal.SIGKILL)
+            self.process.wait()
+        self.process = None
+
+    def probe(self):
+        requests.get(f"{self.web_url}/system_stats", timeout=0.5).raise_for_status()
+
+    def wait_ready(self, timeout=15):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.probe()
+            except requests.RequestException:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def crash(self):
+        os.kill(self.process.pid, signal.SIGKILL)
+
+    def freeze(self):
+        os.kill(self.process.pid, signal.SIGSTOP)
+
+
+@pytest.fixture
+def fake_comfyui(tmp_path):
+    """
+    Factory of stand-in ComfyUI servers, stopped at the end of the test.
+    """
+    fakes = []
+
+    def create(*args):
+        fake = FakeComfyUI(str(tmp_path / f"output{len(fakes)}"), *args)
+        fakes.append(fake)
+        return fake
+
+    yield create
+    for fake in fakes:
+        fake.stop()
+
+
+@pytest.fixture
+def comfy_worker(tmp_path, monkeypatch):
+    """
+    Factory pointing the handler at a supervised stand-in ComfyUI, ready when returned,
+    with its output & input folders under a temporary ComfyUI path.
+    """
+    import handler
+    import supervisor
+    from comfy_pool import ComfyInstance, ComfyPool
+    from comfy_socket import ComfySocket
+    from supervisor import ComfySupervisor
+
+    monkeypatch.setattr(supervisor, "POLL_INTERVAL_SEC", 0.05)
+    comfyui_path = tmp_path / "comfyui"
+    (comfyui_path / "input").mkdir(parents=True)
+    monkeypatch.setattr(handler, "COMFYUI_PATH", str(comfyui_path))
+    monkeypatch.setattr(handler, "input_upload_cache", None)
+    instances = []
+
+    def create(*args):
+        fake = FakeComfyUI(str(comfyui_path / "output"), *args)
+        instance = ComfyInstance(0, "127.0.0.1", fake.port, name="Fake ComfyUI")
+        instance.fake = fake
+        instance.socket = ComfySocket(instance.ws_url, instance.client_id)
+        instance.socket.start()
+        instance.supervisor = ComfySupervisor(fake.start, fake.stop, fake.probe, instance.socket, name=instance.name)
+        instance.supervisor.start()
+        instances.append(instance)
+        assert instance.supervisor.wait_ready(15)
+        monkeypatch.setattr(handler, "comfy_pool", ComfyPool([instance]))
+        return instance
+
+    yield create
+    for instance in instances:
+        instance.supervisor.stop()
+        instance.socket.stop()
+        instance.fake.stop()
+        if instance.session:
+            instance.session.detach()
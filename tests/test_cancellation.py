@@ -0,0 +1,48 @@
+# tests of cancelling the prompts of timed out jobs
+
+import os
+import asyncio
+
+import requests
+
+import handler
+from workflows import get_workflow
+
+
+def get_fake_stats(instance):
+    return requests.get(f"{instance.fake.web_url}/fake/stats", timeout=5).json()
+
+
+def test_timed_out_jobs_cancel_their_prompts(comfy_worker, monkeypatch):
+    # Every node takes long enough for both jobs to time out, the second prompt waits behind the first
+    instance = comfy_worker("--node-delays", "*=30")
+    monkeypatch.setattr(handler, "COMFYUI_JOB_TIMEOUT_SEC", 1)
+    workflow = get_workflow("sd_1_5")
+    job_ids = ["running-job", "pending-job"]
+    # Files the jobs saved before they timed out
+    output_paths = [handler.get_output_image_path(job_id) for job_id in job_ids]
+    for output_path in output_paths:
+        open(output_path, "wb").close()
+
+    async def run_job(job_id):
+        return await handler.process_job("a cat", workflow, "1_1", job_id, None, seeds=[1])
+
+    async def run():
+        return await asyncio.gather(*(run_job(job_id) for job_id in job_ids), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, TimeoutError) for result in results)
+
+    stats = get_fake_stats(instance)
+    assert len(stats["interrupted"]) == 1
+    assert len(stats["deleted"]) == 1
+    assert stats["interrupted"] != stats["deleted"]
+    queue = requests.get(f"{instance.fake.web_url}/queue", timeout=5).json()
+    assert queue["queue_pending"] == []
+    assert handler.cancelled_prompts["running"] >= 1 and handler.cancelled_prompts["pending"] >= 1
+
+    # The jobs' files are deleted and the instance no longer counts their prompts
+    assert not any(os.path.exists(output_path) for output_path in output_paths)
+    assert instance.prompts == set()
+    assert handler.comfy_pool.get(stats["interrupted"][0]) is None
+    assert handler.comfy_pool.get(stats["deleted"][0]) is None
@@ -0,0 +1,169 @@
+# tests of prompt routing & per-instance restarts across stand-in comfyui instances
+
+import time
+import asyncio
+
+import pytest
+
+import supervisor
+from comfy_pool import ComfyInstance, ComfyPool
+from comfy_socket import ComfySocket
+from supervisor import ComfySupervisor
+
+CHECKPOINT_A = ("a.safetensors",)
+CHECKPOINT_B = ("b.safetensors",)
+
+
+@pytest.fixture(autouse=True)
+def fast_supervisor(monkeypatch):
+    monkeypatch.setattr(supervisor, "POLL_INTERVAL_SEC", 0.05)
+    monkeypatch.setattr(supervisor, "STARTUP_TIMEOUT_SEC", 10)
+    monkeypatch.setattr(supervisor, "UNHEALTHY_TIMEOUT_SEC", 1)
+    monkeypatch.setattr(supervisor, "RESTART_BACKOFF_MIN_SEC", 0.1)
+    monkeypatch.setattr(supervisor, "RESTART_BACKOFF_MAX_SEC", 0.4)
+
+
+@pytest.fixture
+def comfy_pool(fake_comfyui):
+    """
+    Factory of pools of supervised stand-in ComfyUI instances, ready when returned.
+    """
+    instances = []
+
+    def create(count, affinity_slack=1):
+        for index in range(count):
+            fake = fake_comfyui()
+            instance = ComfyInstance(index, "127.0.0.1", fake.port, gpu=index, name=f"Fake ComfyUI {index}")
+            instance.fake = fake
+            instance.socket = ComfySocket(instance.ws_url, instance.client_id)
+            instance.socket.start()
+            instance.supervisor = ComfySupervisor(fake.start, fake.stop, fake.probe, instance.socket, name=instance.name)
+            instance.supervisor.start()
+            instances.append(instance)
+        for instance in instances:
+            assert instance.supervisor.wait_ready(15)
+        return ComfyPool(instances, affinity_slack)
+
+    yield create
+    for instance in instances:
+        instance.supervisor.stop()
+        instance.socket.stop()
+
+
+# Wait until a condition holds
+def wait_for(condition, timeout=15):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def test_picks_least_loaded_instance(comfy_pool):
+    pool = comfy_pool(3)
+    picked = []
+    for prompt_index in range(6):
+        instance = pool.pick()
+        pool.assign(f"prompt{prompt_index}", instance)
+        picked.append(instance.index)
+    assert picked == [0, 1, 2, 0, 1, 2]
+
+    pool.release("prompt4")
+    assert pool.pick() is pool.instances[1]
+    assert pool.get("prompt5") is pool.instances[2]
+    assert pool.get("prompt4") is None
+
+
+def test_concurrent_prompts_spread_before_they_are_queued(comfy_pool):
+    pool = comfy_pool(2)
+
+    # Assignment happens before the queue request, so prompts picked back to back don't pile onto one instance
+    async def route(prompt_id):
+        instance = pool.pick()
+        pool.assign(prompt_id, instance)
+        await asyncio.sleep(0.01)
+        return instance.index
+
+    async def run():
+        return await asyncio.gather(*(route(f"prompt{index}") for index in range(4)))
+
+    assert sorted(asyncio.run(run())) == [0, 0, 1, 1]
+
+
+def test_checkpoint_affinity_within_slack(comfy_pool):
+    pool = comfy_pool(2, affinity_slack=1)
+    instance_a, instance_b = pool.instances
+    pool.assign("a1", instance_a, CHECKPOINT_A)
+    pool.assign("b1", instance_b, CHECKPOINT_B)
+
+    # Instance A holds the checkpoint and is within the slack of the least loaded instance
+    assert pool.pick(CHECKPOINT_A) is instance_a
+    pool.assign("a2", instance_a, CHECKPOINT_A)
+    assert pool.affinity_hits == 1
+
+    # Instance A is busier than the slack allows, so the least loaded instance wins
+    pool.assign("a3", instance_a, CHECKPOINT_A)
+    assert pool.pick(CHECKPOINT_A) is instance_b
+
+    # Without a checkpoint the least loaded instance always wins
+    pool.release("a3")
+    assert pool.pick() is instance_b
+
+
+def test_cold_instance_counts_as_resident(comfy_pool):
+    pool = comfy_pool(2, affinity_slack=1)
+    instance_a, instance_b = pool.instances
+    pool.assign("a1", instance_a, CHECKPOINT_A)
+    # Instance B hasn't loaded any model, so it is as good as one holding the checkpoint
+    assert pool.pick(CHECKPOINT_B) is instance_b
+    pool.assign("b1", instance_b, CHECKPOINT_B)
+    assert instance_b.resident_checkpoints == CHECKPOINT_B
+    # A job without checkpoints keeps the instance's resident models
+    pool.assign("b2", instance_b)
+    assert instance_b.resident_checkpoints == CHECKPOINT_B
+
+
+def test_skips_instances_that_are_not_ready(comfy_pool):
+    pool = comfy_pool(2)
+    instance_a, instance_b = pool.instances
+    pool.assign("b1", instance_b, CHECKPOINT_A)
+    instance_a.fake.freeze()
+    assert wait_for(lambda: not instance_a.is_ready(), timeout=5)
+    assert pool.get_ready() == [instance_b]
+    assert pool.pick() is instance_b
+    assert pool.pick(CHECKPOINT_B) is instance_b
+
+    instance_b.supervisor.stop()
+    assert not pool.is_ready()
+    assert pool.pick() is None
+
+
+def test_restarts_only_the_crashed_instance(comfy_pool):
+    pool = comfy_pool(2)
+    instance_a, instance_b = pool.instances
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        events_a, events_b = asyncio.Queue(), asyncio.Queue()
+        pool.assign("a1", instance_a)
+        instance_a.socket.subscribe("a1", events_a, loop)
+        pool.assign("b1", instance_b)
+        instance_b.socket.subscribe("b1", events_b, loop)
+
+        instance_a.fake.crash()
+        event = await asyncio.wait_for(events_a.get(), timeout=10)
+        assert event["type"] == "worker_error"
+        assert await asyncio.to_thread(wait_for, lambda: instance_a.supervisor.restarts == 1 and instance_a.is_ready())
+        # The other instance's jobs are untouched
+        assert events_b.empty()
+
+    asyncio.run(run())
+    assert instance_a.fake.starts == 2
+    assert instance_b.fake.starts == 1
+    assert instance_b.supervisor.restarts == 0
+    assert instance_b.is_ready()
+    stats = pool.stats()["instances"]
+    assert stats["Fake ComfyUI 0"]["restarts"] == 1
+    assert stats["Fake ComfyUI 0"]["last_exit_code"] == -9
+    assert stats["Fake ComfyUI 1"]["restarts"] == 0
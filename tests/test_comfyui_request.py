@@ -0,0 +1,63 @@
+# tests of http requests to comfyui & their retries
+
+import asyncio
+import threading
+
+import aiohttp
+import pytest
+import requests
+
+import handler
+from comfy_pool import ComfyInstance
+
+PROMPT = {"1": {"class_type": "Placeholder", "inputs": {}}}
+
+
+def get_queued_prompts(fake):
+    queue = requests.get(f"{fake.web_url}/queue", timeout=5).json()
+    return len(queue["queue_running"]) + len(queue["queue_pending"])
+
+
+async def request(fake, method, path, **kwargs):
+    instance = ComfyInstance(0, "127.0.0.1", fake.port)
+    try:
+        return await handler.comfyui_request(instance, method, path, **kwargs)
+    finally:
+        await instance.session.close()
+
+
+def test_dropped_prompt_is_not_queued_twice(fake_comfyui):
+    # Keep the prompt in the queue long enough to count it
+    fake = fake_comfyui("--drop-prompt-responses", "1", "--node-delays", "*=30")
+    fake.start()
+    fake.wait_ready()
+    with pytest.raises(aiohttp.ClientConnectionError):
+        asyncio.run(request(fake, "POST", "/prompt", json={"prompt": PROMPT, "client_id": "test"}))
+    assert get_queued_prompts(fake) == 1
+
+
+def test_get_is_retried_after_disconnect(fake_comfyui):
+    fake = fake_comfyui()
+    fake.start()
+    fake.wait_ready()
+
+    # Restarting ComfyUI drops the pooled connection, a read-only request is safe to send again
+    async def run():
+        instance = ComfyInstance(0, "127.0.0.1", fake.port)
+        try:
+            await handler.comfyui_request(instance, "GET", "/queue")
+            fake.stop()
+            fake.start()
+            await asyncio.to_thread(fake.wait_ready)
+            return await handler.comfyui_request(instance, "GET", "/queue")
+        finally:
+            await instance.session.close()
+    assert asyncio.run(run()) == {"queue_running": [], "queue_pending": []}
+
+
+def test_post_is_retried_until_comfyui_accepts_connections(fake_comfyui):
+    fake = fake_comfyui("--node-delays", "*=30")
+    threading.Timer(0.3, fake.start).start()
+    response = asyncio.run(request(fake, "POST", "/prompt", json={"prompt": PROMPT, "client_id": "test"}))
+    assert response["prompt_id"]
+    assert get_queued_prompts(fake) == 1
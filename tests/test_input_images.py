@@ -0,0 +1,74 @@
+# tests of input image fetching & deduplicated uploads
+
+import io
+import base64
+import asyncio
+
+import requests
+from PIL import Image
+
+import handler
+from workflows import get_workflow
+
+
+def get_base64_image(color="red", size=(64, 64)):
+    output = io.BytesIO()
+    Image.new("RGB", size, color).save(output, format="PNG")
+    return base64.b64encode(output.getvalue()).decode("ascii")
+
+
+def get_uploads(instance):
+    return requests.get(f"{instance.fake.web_url}/fake/stats", timeout=5).json()["uploads"]
+
+
+def run_jobs(*events):
+    async def run():
+        return await asyncio.gather(*(handler.handler(event) for event in events))
+    return asyncio.run(run())
+
+
+def create_event(job_id, **job_input):
+    return {"id": job_id, "input": {"prompt": "a cat", "workflow": "sd_1_5_img2img", **job_input}}
+
+
+def test_same_image_is_uploaded_once(comfy_worker, monkeypatch):
+    instance = comfy_worker()
+    monkeypatch.setattr(handler, "update_job", lambda *args: None)
+    image = get_base64_image()
+
+    # Concurrent jobs share one upload, later jobs find the image already uploaded
+    results = run_jobs(create_event("job1", image=image), create_event("job2", image=f"data:image/png;base64,{image}"))
+    results += run_jobs(create_event("job3", image=image))
+    assert all(isinstance(result, str) and result != "ERROR" for result in results)
+    uploads = get_uploads(instance)
+    assert len(uploads) == 1
+    assert handler.input_upload_cache.stats() == {"entries": 1, "uploads": 1, "skipped": 2}
+
+    # Another image is uploaded under its own hash
+    run_jobs(create_event("job4", image=get_base64_image("blue")))
+    assert len(set(get_uploads(instance))) == 2
+
+
+def test_invalid_or_oversized_images_are_rejected(comfy_worker, monkeypatch):
+    instance = comfy_worker()
+    monkeypatch.setattr(handler, "update_job", lambda *args: None)
+    monkeypatch.setattr(handler, "RETURN_ERROR_DETAILS", True)
+    monkeypatch.setattr(handler, "INPUT_IMAGE_MAX_MB", 0.001)
+
+    invalid, oversized, not_an_image = run_jobs(
+        create_event("invalid", image="not base64!"),
+        create_event("oversized", image=get_base64_image(size=(512, 512))),
+        create_event("not-an-image", image=base64.b64encode(b"plain text").decode("ascii")),
+    )
+    for result in [invalid, oversized, not_an_image]:
+        assert isinstance(result, dict) and result["error"].startswith("ERROR")
+    assert get_uploads(instance) == []
+
+
+def test_graphs_load_the_uploaded_names():
+    image_name, mask_name = f"{'ab' * 32}.png", f"{'cd' * 32}.png"
+    img2img = get_workflow("sd_1_5_img2img").load("a cat", "1_1", "job", "APP", input_images={"image": image_name})
+    inpaint = get_workflow("sd_1_5_inpaint").load("a cat", "1_1", "job", "APP", input_images={"image": image_name, "mask": mask_name})
+    assert [node["inputs"]["image"] for node in img2img.values() if node["class_type"] == "LoadImage"] == [image_name]
+    loaded = {node["class_type"]: node["inputs"]["image"] for node in inpaint.values() if node["class_type"] in ["LoadImage", "LoadImageMask"]}
+    assert sorted(loaded.values()) == sorted([image_name, mask_name])
@@ -0,0 +1,43 @@
+# tests of job metrics labels
+
+import handler
+from metrics import JobMetrics, JobTimings
+
+
+def test_aspect_ratio_label_is_canonical():
+    assert handler.get_aspect_ratio_label("16_9") == "16_9"
+    assert handler.get_aspect_ratio_label("16:9") == "16_9"
+    assert handler.get_aspect_ratio_label("01:1") == "1_1"
+
+
+def test_aspect_ratio_label_of_invalid_or_unknown_ratios_is_other():
+    assert handler.get_aspect_ratio_label("7_3") == "other"
+    assert handler.get_aspect_ratio_label("wide") == "other"
+    assert handler.get_aspect_ratio_label("16_9_1") == "other"
+    assert handler.get_aspect_ratio_label('1_1"} evil{x="') == "other"
+    assert handler.get_aspect_ratio_label(None) == "other"
+    assert handler.get_aspect_ratio_label(1.5) == "other"
+
+
+def test_client_aspect_ratios_share_label_series():
+    job_metrics = JobMetrics()
+    for aspect_ratio in ["16:9", "16_9", "bogus", "123_456"]:
+        job_metrics.observe("sd_1_5", handler.get_aspect_ratio_label(aspect_ratio), JobTimings())
+    output = job_metrics.render()
+    assert 'worker_jobs_total{workflow="sd_1_5",aspect_ratio="16_9",status="success"} 2' in output
+    assert 'worker_jobs_total{workflow="sd_1_5",aspect_ratio="other",status="success"} 2' in output
+
+
+def test_output_sizes_are_counted_per_format():
+    job_metrics = JobMetrics()
+    timings = JobTimings()
+    timings.add_output("webp", 1000)
+    timings.add_output("webp", 500)
+    job_metrics.observe("sd_1_5", "1_1", timings)
+    failed_timings = JobTimings()
+    failed_timings.add_output("png", 4000)
+    job_metrics.observe("sd_1_5", "1_1", failed_timings, status="error")
+    output = job_metrics.render()
+    assert 'worker_output_images_total{workflow="sd_1_5",output_format="webp"} 2' in output
+    assert 'worker_output_bytes_total{workflow="sd_1_5",output_format="webp"} 1500' in output
+    assert 'output_format="png"' not in output
@@ -0,0 +1,99 @@
+# tests of model prefetching & staging
+
+import threading
+
+from model_cache import ModelPrefetcher, ModelStager
+
+
+def write_model(path, size):
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test_prefetch_finds_paths_in_its_thread(tmp_path):
+    first = write_model(tmp_path / "first.safetensors", 1000)
+    second = write_model(tmp_path / "second.safetensors", 1000)
+    threads = []
+
+    def get_paths():
+        threads.append(threading.current_thread())
+        yield first
+        yield first
+        yield str(tmp_path / "missing.safetensors")
+        yield second
+
+    model_prefetcher = ModelPrefetcher(max_workers=2)
+    model_prefetcher.start(get_paths)
+    model_prefetcher._thread.join(timeout=5)
+    assert threads and threads[0] is not threading.current_thread()
+    assert model_prefetcher.stats()["files"] == 2
+    assert model_prefetcher.stats()["bytes"] == 2000
+
+
+def test_prefetch_keeps_priority_within_budget(tmp_path):
+    paths = [write_model(tmp_path / f"model{index}.safetensors", 1000) for index in range(3)]
+    model_prefetcher = ModelPrefetcher(max_workers=1, max_bytes=2500)
+    model_prefetcher.start(lambda: iter(paths))
+    model_prefetcher._thread.join(timeout=5)
+    assert model_prefetcher.stats()["files"] == 2
+
+
+def test_prefetch_survives_failing_path_lookup(tmp_path):
+    model = write_model(tmp_path / "model.safetensors", 1000)
+
+    def get_paths():
+        yield model
+        raise RuntimeError("workflow failed to build")
+
+    model_prefetcher = ModelPrefetcher()
+    model_prefetcher.start(get_paths)
+    model_prefetcher._thread.join(timeout=5)
+    assert model_prefetcher.stats()["files"] == 1
+
+
+def create_stager(tmp_path, max_bytes):
+    source_path = tmp_path / "volume"
+    (source_path / "checkpoints").mkdir(parents=True)
+    for name in ["a", "b", "c"]:
+        write_model(source_path / "checkpoints" / f"{name}.safetensors", 1000)
+    return ModelStager(str(source_path), str(tmp_path / "staging"), max_bytes, max_workers=1)
+
+
+def stage(model_stager, name):
+    model_stager.stage("checkpoints", f"{name}.safetensors")
+    model_stager._executor.submit(lambda: None).result(timeout=5)
+
+
+def is_staged(tmp_path, name):
+    return (tmp_path / "staging" / "checkpoints" / f"{name}.safetensors").exists()
+
+
+def test_staging_evicts_least_recently_used(tmp_path):
+    model_stager = create_stager(tmp_path, 2500)
+    stage(model_stager, "a")
+    stage(model_stager, "b")
+    stage(model_stager, "c")
+    assert not is_staged(tmp_path, "a")
+    assert is_staged(tmp_path, "b") and is_staged(tmp_path, "c")
+    assert model_stager.stats()["evictions"] == 1
+    model_stager.stop()
+
+
+def test_staging_keeps_pinned_models(tmp_path):
+    model_stager = create_stager(tmp_path, 2500)
+    stage(model_stager, "a")
+    stage(model_stager, "b")
+    model_stager.pin([("checkpoints", "a.safetensors")])
+    stage(model_stager, "c")
+    assert is_staged(tmp_path, "a") and is_staged(tmp_path, "c")
+    assert not is_staged(tmp_path, "b")
+
+    # With every staged model pinned there is no room, the model is staged on a later use instead
+    model_stager.pin([("checkpoints", "c.safetensors")])
+    stage(model_stager, "b")
+    assert not is_staged(tmp_path, "b")
+    model_stager.unpin([("checkpoints", "a.safetensors")])
+    stage(model_stager, "b")
+    assert is_staged(tmp_path, "b") and is_staged(tmp_path, "c")
+    assert not is_staged(tmp_path, "a")
+    model_stager.stop()
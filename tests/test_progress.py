@@ -0,0 +1,76 @@
+# tests of the job progress estimation & rate-limited reporting
+
+import time
+import asyncio
+
+import handler
+from progress import ProgressReporter, StageTimings, MAX_PROGRESS
+
+MIN_INTERVAL_SEC = 0.1
+WORKFLOW_DATA = {
+    "3": {"class_type": "KSampler", "inputs": {}},
+    "8": {"class_type": "VAEDecode", "inputs": {}},
+}
+
+
+def assert_rate_limited(reports):
+    """
+    Reports must only go up, and be at least the minimum interval apart.
+    """
+    percentages = [percentage for _, percentage, _ in reports]
+    assert percentages == sorted(set(percentages))
+    for (previous, _, _), (sent_at, _, _) in zip(reports, reports[1:]):
+        assert sent_at - previous >= MIN_INTERVAL_SEC * 0.9
+
+
+def test_reports_are_rate_limited_and_finished_at_100():
+    reports = []
+
+    async def send(percentage, eta_sec):
+        reports.append((time.monotonic(), percentage, eta_sec))
+
+    async def run(finished):
+        progress = ProgressReporter(send, "key", WORKFLOW_DATA, StageTimings(), MIN_INTERVAL_SEC)
+        progress.on_event("executing", {"node": "3"})
+        for step in range(1, 21):
+            progress.on_event("progress", {"node": "3", "value": step, "max": 20})
+            await asyncio.sleep(0.02)
+        progress.on_event("executing", {"node": "8"})
+        progress.on_event("execution_success", {})
+        await progress.close(finished)
+        return progress
+
+    # Steps every 20ms are reported at most every 100ms, then 100% without waiting for the interval
+    started_at = time.monotonic()
+    progress = asyncio.run(run(True))
+    assert 2 <= len(reports) <= 7
+    assert_rate_limited(reports[:-1])
+    assert reports[-1][1:] == (100, 0.0)
+    assert reports[-1][0] - started_at < 20 * 0.02 + MIN_INTERVAL_SEC
+    assert progress.sent == len(reports)
+
+    # A failed job stops at the latest estimate, flushed on close
+    reports.clear()
+    asyncio.run(run(False))
+    assert_rate_limited(reports[:-1])
+    assert reports[-1][1] == MAX_PROGRESS
+
+
+def test_job_progress_updates(comfy_worker, monkeypatch):
+    comfy_worker("--step-delay", "0.02")
+    monkeypatch.setattr(handler, "PROGRESS_MIN_INTERVAL_SEC", MIN_INTERVAL_SEC)
+    reports = []
+
+    def update_job(event, percentage, eta_sec=None):
+        reports.append((time.monotonic(), percentage, eta_sec))
+
+    monkeypatch.setattr(handler, "update_job", update_job)
+    event = {"id": "progress-job", "input": {"prompt": "a cat", "workflow": "sd_1_5", "seed": 1}}
+    result = asyncio.run(handler.handler(event))
+    assert isinstance(result, str) and result != "ERROR"
+
+    # Intermediate estimates are rate limited, the last update is always 100%
+    assert len(reports) >= 2
+    assert_rate_limited(reports[:-1])
+    assert all(percentage <= MAX_PROGRESS for _, percentage, _ in reports[:-1])
+    assert reports[-1][1:] == (100, 0.0)
@@ -0,0 +1,56 @@
+# tests of the retention budget of comfyui's file folders
+
+import os
+import time
+
+import handler
+from retention import RetentionManager
+
+DIGEST = "ab" * 32
+
+
+def write_file(path, size, age_sec=0):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    mtime = time.time() - age_sec
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_deletes_only_worker_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(handler, "COMFYUI_FILENAME_PREFIX", "APP")
+    output_path, input_path = tmp_path / "output", tmp_path / "input"
+    baked_input = write_file(input_path / "example.png", 5000, age_sec=7 * 24 * 3600)
+    user_output = write_file(output_path / "ComfyUI_00001_.png", 5000, age_sec=7 * 24 * 3600)
+    old_output = write_file(output_path / "APP_job_00001_.png", 100, age_sec=2 * 24 * 3600)
+    old_upload = write_file(input_path / f"{DIGEST}.png", 100, age_sec=2 * 24 * 3600)
+    new_upload = write_file(input_path / f"{'cd' * 32}.webp", 100)
+    retention_manager = RetentionManager([output_path, input_path], max_bytes=10 ** 9, max_age_sec=24 * 3600, is_owned=handler.is_worker_file)
+
+    retention_manager.sweep()
+    assert baked_input.exists() and user_output.exists() and new_upload.exists()
+    assert not old_output.exists() and not old_upload.exists()
+    assert retention_manager.stats()["bytes"] == 100
+
+
+def test_size_budget_ignores_foreign_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(handler, "COMFYUI_FILENAME_PREFIX", "APP")
+    input_path = tmp_path / "input"
+    baked_input = write_file(input_path / "example.png", 5000, age_sec=3600)
+    oldest_upload = write_file(input_path / f"{DIGEST}.jpg", 300, age_sec=60)
+    newest_upload = write_file(input_path / f"{'cd' * 32}.png", 300)
+    retention_manager = RetentionManager([input_path], max_bytes=500, max_age_sec=0, is_owned=handler.is_worker_file)
+
+    retention_manager.sweep(orphan_prefixes=["APP_"])
+    assert baked_input.exists() and newest_upload.exists()
+    assert not oldest_upload.exists()
+
+
+def test_worker_file_names(monkeypatch):
+    monkeypatch.setattr(handler, "COMFYUI_FILENAME_PREFIX", "APP")
+    assert handler.is_worker_file("APP_job-1_00001_.png")
+    assert handler.is_worker_file(f"{DIGEST}.webp")
+    assert not handler.is_worker_file("APPLE.png")
+    assert not handler.is_worker_file(f"{DIGEST}.gif")
+    assert not handler.is_worker_file(f"{DIGEST.upper()}.png")
+    assert not handler.is_worker_file("example.png")
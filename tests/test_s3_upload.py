@@ -0,0 +1,81 @@
+# tests of in-memory s3 uploads against a moto s3 mock
+
+import io
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import handler
+from handler import BufferReader
+
+BUCKET_NAME = "test-bucket"
+
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(handler, "AWS_ACCESS_KEY", "testing")
+    monkeypatch.setattr(handler, "AWS_SECRET_KEY", "testing")
+    monkeypatch.setattr(handler, "AWS_BUCKET_NAME", BUCKET_NAME)
+    monkeypatch.setattr(handler, "s3_client", None)
+    monkeypatch.setattr(handler, "s3_transfer_config", None)
+    with mock_aws():
+        boto3.client("s3", region_name=handler.AWS_REGION).create_bucket(Bucket=BUCKET_NAME)
+        yield boto3.client("s3", region_name=handler.AWS_REGION)
+
+
+def test_buffer_reader_read_and_seek():
+    data = bytes(range(256)) * 4
+    reader = BufferReader(bytearray(data))
+    assert reader.readable() and reader.seekable()
+    assert reader.read(10) == data[:10]
+    assert reader.tell() == 10
+    assert reader.seek(5, io.SEEK_CUR) == 15
+    assert reader.read(5) == data[15:20]
+    assert reader.seek(-4, io.SEEK_END) == len(data) - 4
+    assert reader.read() == data[-4:]
+    assert reader.read(10) == b""
+    assert reader.seek(-10) == 0
+    assert reader.read() == data
+
+
+def test_buffer_reader_readinto_stops_at_end():
+    reader = BufferReader(memoryview(b"abcdef"))
+    buffer = bytearray(4)
+    assert reader.readinto(buffer) == 4
+    assert buffer == b"abcd"
+    assert reader.readinto(buffer) == 2
+    assert buffer[:2] == b"ef"
+    assert reader.readinto(buffer) == 0
+
+
+def test_init_s3_warms_up_client(s3_bucket):
+    handler.init_s3()
+    assert handler.s3_client is not None
+    assert handler.s3_transfer_config.multipart_threshold == handler.S3_MULTIPART_THRESHOLD_MB * 1024 * 1024
+
+
+def test_upload_in_memory_image_below_multipart_threshold(s3_bucket):
+    image_data = os.urandom(1024)
+    url = handler.upload_image("job", image_data, "webp", image_index=2)
+    assert url == handler.get_s3_url("job_2.webp")
+    uploaded = s3_bucket.get_object(Bucket=BUCKET_NAME, Key="job_2.webp")
+    assert uploaded["Body"].read() == image_data
+    assert uploaded["ContentType"] == "image/webp"
+    assert "-" not in uploaded["ETag"]
+
+
+def test_upload_in_memory_image_in_parts(s3_bucket):
+    # 12 MB is over the 8 MB multipart threshold and splits into two 8 MB parts
+    image_data = os.urandom(12 * 1024 * 1024)
+    url = handler.upload_image("job", image_data, "png")
+    assert url == handler.get_s3_url("job.png")
+    uploaded = s3_bucket.get_object(Bucket=BUCKET_NAME, Key="job.png")
+    assert uploaded["Body"].read() == image_data
+    assert uploaded["ContentType"] == "image/png"
+    assert uploaded["CacheControl"] == f"max-age={handler.S3_CACHE_CONTROL_MAX_AGE}"
+    # Multipart uploads get an ETag suffixed with their part count
+    assert uploaded["ETag"].strip('"').endswith("-2")
@@ -0,0 +1,76 @@
+# tests of the streaming handler's updates
+
+import io
+import asyncio
+
+import boto3
+import pytest
+from moto import mock_aws
+from PIL import Image
+
+import handler
+
+BUCKET_NAME = "test-bucket"
+
+
+def get_preview_frame():
+    output = io.BytesIO()
+    Image.new("RGB", (64, 64), "red").save(output, format="JPEG")
+    return output.getvalue()
+
+
+@pytest.fixture
+def fake_job(monkeypatch):
+    """
+    Replaces the job with one streaming a preview & progress, then returning its result.
+    """
+    monkeypatch.setattr(handler, "STREAM_PREVIEW_INTERVAL_SEC", 0)
+
+    async def run_job(event, stream):
+        stream.put_progress(50, 1.0)
+        stream.put_preview(get_preview_frame())
+        await asyncio.sleep(0.2)
+        return "https://example.com/result.png"
+
+    monkeypatch.setattr(handler, "handler", run_job)
+
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(handler, "ENABLE_S3_UPLOAD", True)
+    monkeypatch.setattr(handler, "AWS_BUCKET_NAME", BUCKET_NAME)
+    monkeypatch.setattr(handler, "s3_client", None)
+    with mock_aws():
+        boto3.client("s3", region_name=handler.AWS_REGION).create_bucket(Bucket=BUCKET_NAME)
+        yield boto3.client("s3", region_name=handler.AWS_REGION)
+
+
+async def collect(event):
+    return [update async for update in handler.stream_handler(event)]
+
+
+def test_previews_are_streamed_as_urls(fake_job, s3_bucket):
+    updates = asyncio.run(collect({"id": "job", "input": {}}))
+    assert [update["type"] for update in updates] == ["progress", "preview", "result"]
+    assert updates[1]["url"] == handler.get_s3_url("job_preview_1.jpg")
+    assert "image" not in updates[1]
+    preview = s3_bucket.get_object(Bucket=BUCKET_NAME, Key="job_preview_1.jpg")
+    assert preview["ContentType"] == "image/jpeg"
+    assert updates[-1] == {"type": "result", "result": "https://example.com/result.png"}
+
+
+def test_previews_are_skipped_without_s3(fake_job, monkeypatch):
+    monkeypatch.setattr(handler, "ENABLE_S3_UPLOAD", False)
+    updates = asyncio.run(collect({"id": "job", "input": {}}))
+    assert [update["type"] for update in updates] == ["progress", "result"]
+
+
+def test_streamed_updates_are_aggregated(monkeypatch):
+    configs = []
+    monkeypatch.setattr(handler, "ENABLE_STREAMING", True)
+    monkeypatch.setattr(handler.runpod.serverless, "start", configs.append)
+    handler.init_runpod()
+    assert configs[0]["handler"] is handler.stream_handler
+    assert configs[0]["return_aggregate_stream"] is True
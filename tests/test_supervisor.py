@@ -0,0 +1,141 @@
+# tests of the comfyui supervisor against stand-in comfyui processes
+
+import time
+import uuid
+import asyncio
+
+import pytest
+
+import supervisor
+from comfy_socket import ComfySocket
+from supervisor import ComfySupervisor
+
+
+@pytest.fixture(autouse=True)
+def fast_supervisor(monkeypatch):
+    monkeypatch.setattr(supervisor, "POLL_INTERVAL_SEC", 0.05)
+    monkeypatch.setattr(supervisor, "STARTUP_TIMEOUT_SEC", 10)
+    monkeypatch.setattr(supervisor, "UNHEALTHY_TIMEOUT_SEC", 1)
+    monkeypatch.setattr(supervisor, "RESTART_BACKOFF_MIN_SEC", 0.1)
+    monkeypatch.setattr(supervisor, "RESTART_BACKOFF_MAX_SEC", 0.4)
+
+
+# Wait until a condition holds
+def wait_for(condition, timeout=15):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+# Start a supervised stand-in comfyui
+def start_supervised(fake, probe=None):
+    comfy_socket = ComfySocket(fake.ws_url, str(uuid.uuid4()))
+    comfy_socket.start()
+    comfy_supervisor = ComfySupervisor(fake.start, fake.stop, probe or fake.probe, comfy_socket, name="Fake ComfyUI")
+    comfy_supervisor.start()
+    return comfy_supervisor, comfy_socket
+
+
+def stop_supervised(comfy_supervisor, comfy_socket):
+    comfy_supervisor.stop()
+    comfy_socket.stop()
+
+
+def test_becomes_ready(fake_comfyui):
+    fake = fake_comfyui()
+    comfy_supervisor, comfy_socket = start_supervised(fake)
+    try:
+        assert comfy_supervisor.wait_ready(15)
+        assert comfy_supervisor.status() == {"ready": True, "restarts": 0, "last_failure": None, "last_exit_code": None}
+    finally:
+        stop_supervised(comfy_supervisor, comfy_socket)
+
+
+def test_restarts_exited_process_and_fails_in_flight_jobs(fake_comfyui):
+    fake = fake_comfyui()
+    comfy_supervisor, comfy_socket = start_supervised(fake)
+
+    async def run():
+        assert await asyncio.to_thread(comfy_supervisor.wait_ready, 15)
+        events = asyncio.Queue()
+        comfy_socket.subscribe("prompt", events, asyncio.get_running_loop())
+        fake.crash()
+        event = await asyncio.wait_for(events.get(), timeout=10)
+        assert event["type"] == "worker_error"
+        assert "exited with code -9" in event["data"]["message"]
+        assert await asyncio.to_thread(wait_for, lambda: comfy_supervisor.restarts == 1 and comfy_supervisor.is_ready())
+
+    try:
+        asyncio.run(run())
+        assert comfy_supervisor.last_exit_code == -9
+        assert fake.starts == 2
+    finally:
+        stop_supervised(comfy_supervisor, comfy_socket)
+
+
+def test_restarts_hung_process(fake_comfyui):
+    fake = fake_comfyui()
+    comfy_supervisor, comfy_socket = start_supervised(fake)
+    try:
+        assert comfy_supervisor.wait_ready(15)
+        fake.freeze()
+        assert wait_for(lambda: not comfy_supervisor.is_ready(), timeout=5)
+        # A hang after startup gets UNHEALTHY_TIMEOUT_SEC, not the startup timeout
+        assert wait_for(lambda: fake.starts == 2, timeout=5)
+        assert comfy_supervisor.last_failure == f"Fake ComfyUI unresponsive for {supervisor.UNHEALTHY_TIMEOUT_SEC} seconds"
+        assert wait_for(lambda: comfy_supervisor.restarts == 1 and comfy_supervisor.is_ready())
+        assert comfy_supervisor.last_exit_code is None
+    finally:
+        stop_supervised(comfy_supervisor, comfy_socket)
+
+
+def test_unhealthy_instance_is_not_ready_then_restarted(fake_comfyui):
+    fake = fake_comfyui()
+    healthy = [True]
+
+    def probe():
+        if not healthy[0]:
+            raise RuntimeError("unhealthy")
+        fake.probe()
+
+    comfy_supervisor, comfy_socket = start_supervised(fake, probe)
+    try:
+        assert comfy_supervisor.wait_ready(15)
+        healthy[0] = False
+        failed_at = time.monotonic()
+        assert wait_for(lambda: not comfy_supervisor.is_ready(), timeout=1)
+        # Ready instances get UNHEALTHY_TIMEOUT_SEC to recover before they are restarted
+        assert wait_for(lambda: fake.starts == 2, timeout=5)
+        assert time.monotonic() - failed_at >= supervisor.UNHEALTHY_TIMEOUT_SEC
+        healthy[0] = True
+        assert wait_for(comfy_supervisor.is_ready)
+        assert comfy_supervisor.restarts == 1
+    finally:
+        stop_supervised(comfy_supervisor, comfy_socket)
+
+
+def test_restart_backoff_doubles_up_to_cap(fake_comfyui):
+    fake = fake_comfyui()
+    attempts = []
+
+    def start_process():
+        attempts.append(time.monotonic())
+        raise OSError("cannot start")
+
+    comfy_socket = ComfySocket(fake.ws_url, str(uuid.uuid4()))
+    comfy_supervisor = ComfySupervisor(start_process, lambda: None, fake.probe, comfy_socket, name="Fake ComfyUI")
+    comfy_supervisor.start()
+    try:
+        assert wait_for(lambda: len(attempts) >= 6, timeout=10)
+    finally:
+        comfy_supervisor.stop()
+    gaps = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+    # Each restart waits for the backoff after the failed check: 0.1, 0.2, 0.4, then capped at 0.4
+    for gap, backoff in zip(gaps, [0.1, 0.2, 0.4, 0.4, 0.4]):
+        assert backoff <= gap < backoff + 0.3
+    assert comfy_supervisor.restarts >= 5
+    assert "failed to start: cannot start" in comfy_supervisor.last_failure
+    assert not comfy_supervisor.is_ready()
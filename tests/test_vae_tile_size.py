@@ -0,0 +1,67 @@
+# tests of per-gpu vae tile sizes
+
+import handler
+from comfy_pool import ComfyInstance, ComfyPool
+from workflows import get_workflow
+
+GB = 1024 * 1024 * 1024
+
+
+class ReadySupervisor:
+
+    def is_ready(self):
+        return True
+
+    def status(self):
+        return {}
+
+
+def create_instance(index, vram_total_gb):
+    instance = ComfyInstance(index, "127.0.0.1", 3000 + index)
+    instance.supervisor = ReadySupervisor()
+    instance.vram_total = vram_total_gb * GB
+    return instance
+
+
+def load_high_resolution_graph():
+    return get_workflow("sdxl_lightning_4step_2k").load("a cat", "4_3", "job", "APP", seeds=[1, 2])
+
+
+def get_tile_sizes(workflow_data):
+    return {
+        node_id: (node["inputs"]["tile_size"], node["inputs"]["overlap"])
+        for node_id, node in workflow_data.items()
+        if node["class_type"] in ["VAEDecodeTiled", "VAEEncodeTiled"]
+    }
+
+
+def test_sizes_template_tiles_only():
+    template_graph = load_high_resolution_graph()
+    patched = handler.apply_vae_tile_size(template_graph, 768)
+    assert set(get_tile_sizes(patched).values()) == {(768, 96)}
+    assert len(get_tile_sizes(patched)) == 6
+
+    # Tiled VAE nodes set by the workflow itself, e.g. a JSON workflow, are kept
+    user_graph = {"8": {"class_type": "VAEDecodeTiled", "inputs": {"samples": ["3", 0], "vae": ["4", 2], "tile_size": 320, "overlap": 16}}}
+    assert handler.apply_vae_tile_size(user_graph, 768) is user_graph
+    assert get_tile_sizes(user_graph) == {"8": (320, 16)}
+
+
+def test_cache_key_includes_tile_size(monkeypatch):
+    small, large = create_instance(0, 16), create_instance(1, 48)
+    workflow_data = load_high_resolution_graph()
+    small_key = handler.get_result_cache_key(workflow_data, "png", None, small)
+    large_key = handler.get_result_cache_key(workflow_data, "png", None, large)
+    assert small_key != large_key
+
+    # Before routing, the key is only known if every ready instance gives the same tile size
+    monkeypatch.setattr(handler, "comfy_pool", ComfyPool([small, create_instance(2, 16)]))
+    assert handler.get_result_cache_key(workflow_data, "png", None) == small_key
+    monkeypatch.setattr(handler, "comfy_pool", ComfyPool([small, large]))
+    assert handler.get_result_cache_key(workflow_data, "png", None) is None
+
+
+def test_cache_key_of_graphs_without_sized_tiles(monkeypatch):
+    monkeypatch.setattr(handler, "comfy_pool", ComfyPool([create_instance(0, 16), create_instance(1, 48)]))
+    workflow_data = get_workflow("sd_1_5").load("a cat", "1_1", "job", "APP", seeds=[1])
+    assert handler.get_result_cache_key(workflow_data, "png", None) == handler.get_cache_key(workflow_data, "png", None)
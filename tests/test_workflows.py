@@ -0,0 +1,68 @@
+# tests of workflow discovery
+
+import os
+
+import pytest
+
+import workflows
+
+
+@pytest.fixture
+def json_workflows(tmp_path, monkeypatch):
+    """
+    Directory of JSON workflows, with rediscovery allowed right away.
+    """
+    monkeypatch.setattr(workflows, "WORKFLOWS_JSON_PATH", str(tmp_path))
+    monkeypatch.setattr(workflows, "WORKFLOWS_RESCAN_INTERVAL_SEC", 0)
+    discoveries = []
+    discover_workflows = workflows._discover_workflows
+
+    def count_discoveries():
+        discoveries.append(True)
+        discover_workflows()
+
+    monkeypatch.setattr(workflows, "_discover_workflows", count_discoveries)
+    discover_workflows()
+    yield tmp_path, discoveries
+    monkeypatch.undo()
+    workflows._discover_workflows()
+
+
+def add_workflow(path, name):
+    (path / f"{name}.json").write_text("{}")
+    # Make sure the directory's modification time changes even on coarse-grained filesystems
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_picks_up_added_json_workflows(json_workflows):
+    path, discoveries = json_workflows
+    assert "custom" not in workflows.get_workflow_names()
+    add_workflow(path, "custom")
+    assert "custom" in workflows.get_workflow_names()
+    assert discoveries == [True]
+
+
+def test_skips_rediscovery_while_unchanged(json_workflows):
+    path, discoveries = json_workflows
+    names = workflows.get_workflow_names()
+    for _ in range(10):
+        assert workflows.get_workflow_names() == names
+        with pytest.raises(ValueError, match="not found"):
+            workflows.get_workflow("missing")
+    assert discoveries == []
+    assert "sd_1_5" in names
+
+
+def test_rediscovers_at_most_once_per_interval(json_workflows, monkeypatch):
+    path, discoveries = json_workflows
+    monkeypatch.setattr(workflows, "WORKFLOWS_RESCAN_INTERVAL_SEC", 3600)
+    workflows.get_workflow_names()
+    add_workflow(path, "custom")
+    with pytest.raises(ValueError, match="not found"):
+        workflows.get_workflow("custom")
+    assert "custom" not in workflows.get_workflow_names()
+    monkeypatch.setattr(workflows, "_checked_at", 0.0)
+    monkeypatch.setattr(workflows, "WORKFLOWS_RESCAN_INTERVAL_SEC", 0)
+    assert "custom" in workflows.get_workflow_names()
+    assert discoveries == [True]